@@ -4,24 +4,37 @@ Create a backup archive from a database and a filesystem.
 
 __version__ = "1.0.0"
 
-import functools
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Any
 
 import humanfriendly
 
-from backup.archive import Archive
+from backup.archive import Archive, QueuedWriter
 from backup.calendar import Calendar
-from backup.database import DB, DBError
+from backup.database import DB, DBError, SQLiteDB
+from backup.exclusion import Exclusion
 from backup.filesystem import FS, FSError
+from backup.index import FileIndex, FileIndexError
+from backup.journal import Journal
+from backup.partition import PartitionArchive
+from backup.reference import ReferenceStore, ReferenceStoreError
 from backup.reporter import Reporter, reporter_inspect
-from backup.source import Source
+from backup.source import Source, SourceError
 from backup.target import Target
+from backup.target.local import LocalError
 from backup.target.s3 import S3Error
 from backup.thinning import ThinningStrategy
 from backup.utils import LF, LFLF, formatkv
 from backup.utils.mail import Attachment, Mailer, Priority
 
+# size of blocks read from an archive file to feed several targets
+FANOUT_BLOCK_SIZE = 1024 * 1024
+# blocks queued for each target before the fan-out waits for it
+FANOUT_QUEUE_SIZE = 8
+
 """
     ########     ###     ######  ##    ## ##     ## ########
     ##     ##   ## ##   ##    ## ##   ##  ##     ## ##     ##
@@ -77,28 +90,336 @@ class Backup(Reporter):
         if not self.quiet:
             print(text)
 
-    def backup_database(self, archive: Archive) -> DB:
-        """Creates a database backup and stores it into the archive."""
+    def backup_database(self, archive: Archive) -> DB | SQLiteDB:
+        """Creates a database backup and stores it into the archive.
+
+        A SQLite database is stored as a snapshot, other databases are
+        dumped.
+
+        """
         self.message(f"Processing database of {self.source.description}")
 
+        if self.source.dbfile:
+            db = SQLiteDB(self.source.dbfile)
+            db.dump_to_archive(archive)
+            return db
+
         db = DB(
             self.source.dbname,
             self.source.dbhost,
             self.source.dbuser,
             self.source.dbpass,
             self.source.dbprefix,
+            port=self.source.dbport,
         )
         db.dump_to_archive(archive)
         return db
 
-    def backup_filesystem(self, archive: Archive) -> FS:
-        """Creates filesystem backup and stores it into the archive."""
+    def backup_filesystem(
+        self,
+        archive: Archive,
+        exclusion: Exclusion | None = None,
+        index: FileIndex | None = None,
+        incremental: bool = False,
+        journal: Journal | None = None,
+        targets: list[Target] | None = None,
+        dry: bool = False,
+        skip_generated: bool = False,
+        reference: ReferenceStore | None = None,
+        database: bool = False,
+    ) -> FS:
+        """Creates filesystem backup and stores it into the archive.
+
+        The given exclusion will be applied on top of the default profile
+        of the source.
+
+        If targets are given, the closed partitions of the source are
+        stored in partition archives of their own on these targets.
+
+        If skip_generated is True, files the source can generate from other
+        files (like thumbnails of images) are left out.
+
+        If a reference store is given, files of the source matching their
+        release in the store are left out.
+
+        If database is True, the live files of a database stored in the
+        filesystem are left out, as the database is backed up on its own.
+
+        """
         self.message(f"Processing filesystem of {self.source.description}")
 
-        fs = FS(self.source.fspath)
+        exclusion = self.filesystem_exclusion(self.source, exclusion, database)
+
+        fs = FS(
+            self.source.fspath,
+            exclusion,
+            index=index,
+            incremental=incremental,
+            journal=journal,
+            partitions=self.source.partitions() if targets else None,
+            generated=self.source.generated_files() if skip_generated else None,
+            pristine=(
+                reference.pristine(self.source.components()) if reference else None
+            ),
+        )
+        if targets:
+            # partitions first: a full walk will keep their index entries
+            self.backup_partitions(fs, archive, targets, dry=dry)
         fs.add_to_archive(archive)
         return fs
 
+    @staticmethod
+    def filesystem_exclusion(
+        source: Source, exclusion: Exclusion | None = None, database: bool = False
+    ) -> Exclusion:
+        """Returns the exclusion applied to the filesystem of the given
+        source: the given exclusion on top of the default profile of the
+        source, and the live files of its database if the database is
+        backed up on its own.
+
+        """
+        exclusion = (exclusion or Exclusion()).profile(source.fsexcludes)
+        if database and source.dbexcludes:
+            exclusion = Exclusion(
+                [*source.dbexcludes, *exclusion.patterns],
+                max_size=exclusion.max_size,
+            )
+        return exclusion
+
+    @staticmethod
+    def partsize(targets: list[Target] | None, default: int) -> int:
+        """Returns the size of parts to compute the checksums of archives for:
+        the part size of the first target transferring archives in parts.
+
+        """
+        for target in targets or []:
+            if isinstance(target.partsize, int):
+                return target.partsize
+        return default
+
+    def backup_partitions(
+        self, fs: FS, archive: Archive, targets: list[Target], dry: bool = False
+    ) -> None:
+        """Transfers each partition of the filesystem to the targets which
+        don't have an archive of the partition with the same content.
+
+        Each partition is listed in the manifest of the given archive.
+
+        """
+        for partition in fs.partitions:
+            digest, files = fs.partition_digest(partition)
+            partarchive = PartitionArchive(self.source.slug, partition, digest)
+            partarchive.partsize = self.partsize(targets, partarchive.partsize)
+
+            missing = [t for t in targets if not t.contains_archive(partarchive)]
+            if missing and not dry:
+                self.message(f"Creating partition archive for {partition.path}")
+                with partarchive:
+                    fs.add_partition_to_archive(partarchive)
+                    partarchive.manifest.append(("Partition", partition.path))
+                    partarchive.manifest.append(("Digest", digest))
+                    partarchive.add_manifest(partarchive.timestamp)
+                try:
+                    self.transfer_to_targets(partarchive, missing, what="partition ")
+                finally:
+                    partarchive.remove()
+
+            fs.record_partition(partarchive, files)
+            archive.manifest.append(
+                ("Partition", f"{partition.path} {partarchive.filename}")
+            )
+            if fs.index:
+                # thinning keeps the partition archives of retained archives
+                fs.index.add_references(archive.name, [partarchive.filename])
+
+    def transfer_to_targets(
+        self,
+        archive: Archive,
+        targets: list[Target],
+        dry: bool = False,
+        what: str = "",
+    ) -> None:
+        """Transfers the given archive to all given targets.
+
+        With several targets the archive file is read once and fed to the
+        streams of all targets supporting streams, which upload it
+        concurrently. Each stream is written by a thread of its own from a
+        bounded queue, so a slow target doesn't hold up the others until
+        its queue is full. The other targets transfer the file one after
+        another. A failing target doesn't stop the transfers to the other
+        targets, the first error is raised after all transfers.
+
+        """
+        failed: dict[int, BaseException] = {}
+        if len(targets) > 1 and not dry and not archive.streams:
+            streams = {}
+            for n, target in enumerate(targets):
+                try:
+                    stream = target.open_stream(archive)
+                except (LocalError, S3Error) as e:
+                    logging.warning("%s: %s", target.label, e)
+                    continue
+                if stream is not None:
+                    streams[n] = QueuedWriter(stream, FANOUT_QUEUE_SIZE)
+            if streams:
+                self.message(f"Transfering {what}archive to {len(streams)} targets")
+                try:
+                    with open(archive.tarname(), "rb") as f:
+                        while data := f.read(FANOUT_BLOCK_SIZE):
+                            for stream in streams.values():
+                                stream.write(data)
+                except BaseException:
+                    for stream in streams.values():
+                        stream.abort()
+                    raise
+                for n, stream in streams.items():
+                    try:
+                        stream.close()
+                    except Exception as e:
+                        logging.warning("%s: %r", targets[n].label, e)
+                        failed[n] = e
+
+        errors = []
+        for n, target in enumerate(targets):
+            if n in failed:
+                errors.append(failed[n])
+                continue
+            self.message(f"Transfering {what}archive to {target.description}")
+            try:
+                target.transfer_archive(archive, dry=dry)
+            except (LocalError, S3Error) as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def resume_transfers(
+        self, targets: list[Target], attic: str | None = None, dry: bool = False
+    ) -> None:
+        """Transfers the archives of the source whose transfer was
+        interrupted by a previous execution.
+
+        Such archives are left behind together with the state of their
+        upload. Afterwards they are handled like a new archive. Targets
+        mirroring the current files of the source are left out: they
+        would store these files under the timestamp of the old archive.
+
+        """
+        names = set()
+        for state in Path(".").glob(f"{self.source.slug}-*.tgz.*.upload.json"):
+            name = state.name.split(".tgz.", 1)[0] + ".tgz"
+            if Path(name).is_file():
+                names.add(name)
+            else:
+                state.unlink()
+
+        for name in sorted(names):
+            try:
+                archive = Archive.fromfilename(name, check_label=self.source.slug)
+            except ValueError:
+                continue
+
+            for target in targets:
+                if target.mirrors_source:
+                    continue
+                if not target.contains_archive(archive):
+                    self.message(f"Resuming transfer of {name} to {target.description}")
+                    target.transfer_archive(archive, dry=dry)
+
+            if not dry:
+                if attic:
+                    archive.rename(attic)
+                else:
+                    archive.remove()
+
+    def thin_out(
+        self,
+        target: Target,
+        thinning: ThinningStrategy,
+        dry: bool = False,
+        references: dict[str, set[str]] | None = None,
+    ) -> Any:
+        """Thins out the archives of the source on the given target.
+
+        Only archives newer than the horizon of the strategy are looked at
+        if the target records a complete thinning with the same strategy.
+        Otherwise all archives are looked at (like on the first thinning
+        or after a change of the strategy) and the complete thinning is
+        recorded afterwards.
+
+        The given references map incremental archives to the archives
+        holding their unchanged files: these are kept as long as an archive
+        referring to them is kept. Partition archives referred to by
+        archives are deleted once no remaining archive refers to them.
+
+        """
+        dropped = set()
+
+        def perform_thinning(archives):
+            """Execute the given thinning strategy on the given archives."""
+            inarchives, outarchives = thinning.execute_on(archives, attr="ctime")
+
+            if references:
+                pinned = set()
+                for archive in inarchives:
+                    pinned |= references.get(archive.name, set())
+                kept = [a for a in outarchives if a.name in pinned]
+                if kept:
+                    logging.info(
+                        "keep %d archives referred to by incremental archives",
+                        len(kept),
+                    )
+                    inarchives = [*inarchives, *kept]
+                    outarchives = [a for a in outarchives if a.name not in pinned]
+
+            dropped.update(a.name for a in outarchives)
+            return (inarchives, outarchives)
+
+        label = self.source.slug
+        since = None
+        if target.thinning_marker(label) == str(thinning):
+            since = thinning.horizon()
+        result = target.perform_thinning(label, perform_thinning, dry=dry, since=since)
+        if since is None and not dry and not getattr(result, "errors", None):
+            target.mark_thinning(label, str(thinning))
+        if references and not getattr(result, "errors", None):
+            self.thin_out_partitions(target, references, dropped, dry=dry)
+        return result
+
+    def thin_out_partitions(
+        self,
+        target: Target,
+        references: dict[str, set[str]],
+        dropped: set[str],
+        dry: bool = False,
+    ) -> None:
+        """Deletes the partition archives of the source on the given target
+        which no remaining archive refers to.
+
+        Only partition archives referred to by some archive in the given
+        references are deleted, unknown ones are left alone. Archives
+        expired by the target later (like by lifecycle rules) keep their
+        partition archives until they are gone.
+
+        """
+        label = self.source.slug
+        known = {
+            name
+            for referenced in references.values()
+            for name in referenced
+            if PartitionArchive.is_partition(name)
+        }
+        if not known:
+            return
+        archives = target.list_archives(label)
+        if dry:
+            archives = [a for a in archives if a.name not in dropped]
+        referenced = set()
+        for archive in archives:
+            referenced |= references.get(archive.name, set())
+        obsolete = known - referenced
+        if obsolete:
+            target.thin_out_partitions(label, obsolete, dry=dry)
+
     def send_report(
         self,
         reporters: list[Any],
@@ -138,6 +459,12 @@ class Backup(Reporter):
     @reporter_inspect("database")
     @reporter_inspect("filesystem")
     @reporter_inspect("thinning")
+    @reporter_inspect("exclusion")
+    @reporter_inspect("incremental")
+    @reporter_inspect("partitions")
+    @reporter_inspect("skip_generated")
+    @reporter_inspect("reference")
+    @reporter_inspect("stream")
     def execute(
         self,
         targets: list[Target],
@@ -146,6 +473,14 @@ class Backup(Reporter):
         thinning: ThinningStrategy | None = None,
         attic: str | None = None,
         dry: bool = False,
+        exclusion: Exclusion | None = None,
+        statedir: str | None = None,
+        incremental: bool = False,
+        journal: str | None = None,
+        partitions: bool = False,
+        skip_generated: bool = False,
+        reference: str | None = None,
+        stream: bool = False,
     ):
         """Perfoms the creation of a backup.
 
@@ -153,36 +488,82 @@ class Backup(Reporter):
         included in the backup. Setting both flags to False will result
         in an empty backup.
 
-        The backup will be transferred to each of the given targets.
+        The backup will be transferred to each of the given targets, to
+        several targets concurrently.
 
         Each given target will be thinned out according to the given
         thinning strategy.
 
+        The given exclusion specifies which files of the filesystem should
+        not be included in the backup in addition to the default profile
+        of the source.
+
+        If statedir is given a persistent file index for the source will be
+        kept in that directory. The index is only updated if the execution
+        succeeds. In incremental mode only files changed since they were
+        archived before will be included in the backup. If a journal
+        written by a watcher is given, incremental backups will only look
+        at the files recorded as changed in that journal. A successful
+        execution acknowledges the changes, so the watcher compacts the
+        journal.
+
+        If partitions is True, closed partitions of the filesystem (like
+        the uploads of past months) are stored in archives of their own.
+        Such an archive is only transferred to the targets not already
+        storing an archive of the partition with the same content.
+
+        If skip_generated is True, files which can be generated again after
+        a restore (like thumbnails of images) are left out of the backup.
+
+        If reference is given, it names the directory of a reference store.
+        Files of core, plugins and themes matching a release in the store
+        are left out of the backup and can be restored from the store.
+
+        If stream is True, the archive is transferred to the targets
+        supporting streams while it is written. A local backup file is
+        only written if attic is given or a target can't transfer streams.
+
         If attic is given the backup file will be renamed to its value.
         Otherwise the backup file will be deleted (after it was
-        transferred to the given targets, of course).
+        transferred to the given targets, of course). Archives kept in a
+        local directory are thinned out if it is given as LocalTarget.
 
-        """
+        Archives whose transfer was interrupted by a previous execution are
+        transferred first.
 
-        def perform_thinning(strategy, archives):
-            """Execute the given thinning strategy on the given archives."""
-            inarchives, outarchives = strategy.execute_on(archives, attr="ctime")
-
-            return (inarchives, outarchives)
+        """
 
         reporters: list[Reporter] = [self]
 
+        index = None
+
         try:
             # start of execution
             self.stime = time.monotonic()
 
             reporters.append(self.source)
 
+            # resume interrupted transfers
+
+            if targets:
+                self.resume_transfers(targets, attic=attic, dry=dry)
+
             # create archive (if requested)
 
+            if statedir:
+                path = Path(statedir) / f"{self.source.slug}.index"
+                # thinning needs the references of incremental archives
+                if filesystem or (thinning and path.exists()):
+                    index = FileIndex(path)
+
             if database or filesystem:
 
                 archive = Archive(self.source.slug)
+                archive.partsize = self.partsize(targets, archive.partsize)
+                if stream and not dry:
+                    streams = [target.open_stream(archive) for target in targets]
+                    archive.streams = [s for s in streams if s is not None]
+                    archive.staged = bool(attic) or None in streams
                 with archive:
                     self.message(f"Creating archive for {self.source.description}")
 
@@ -191,32 +572,59 @@ class Backup(Reporter):
                         reporters.append(reporter)
 
                     if filesystem is True:
-                        reporter = self.backup_filesystem(archive)
+                        reporter = self.backup_filesystem(
+                            archive,
+                            exclusion,
+                            index=index,
+                            incremental=incremental,
+                            journal=Journal(Path(journal)) if journal else None,
+                            targets=targets if partitions else None,
+                            dry=dry,
+                            skip_generated=skip_generated,
+                            reference=(
+                                ReferenceStore(Path(reference)) if reference else None
+                            ),
+                            database=database,
+                        )
                         reporters.append(reporter)
 
                     archive.add_manifest(archive.timestamp)
 
                 # transfer archive to targets
 
-                for target in targets:
-                    self.message(f"Transfering archive to {target.description}")
-                    target.transfer_archive(archive, dry=dry)
+                self.transfer_to_targets(archive, targets, dry=dry)
 
             else:
                 archive = None
 
             # thin out target (if requested)
 
-            if thinning:
+            if thinning and targets:
                 for target in targets:
                     self.message(
                         f"Thinning archives on {target.description} using strategy '{thinning}'"
                     )
-                    target.perform_thinning(
-                        self.source.slug,
-                        functools.partial(perform_thinning, thinning),
-                        dry=dry,
-                    )
+                # targets are thinned out concurrently
+                with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                    futures = [
+                        executor.submit(
+                            self.thin_out,
+                            target,
+                            thinning,
+                            dry=dry,
+                            references=index.references() if index else None,
+                        )
+                        for target in targets
+                    ]
+                for future in futures:
+                    future.result()
+
+            # commit file index
+
+            if index and not dry:
+                index.commit()
+                if journal and incremental and (position := index.get_state("journal")):
+                    Journal(Path(journal)).acknowledge(position)
 
             # remove archive
 
@@ -243,7 +651,7 @@ class Backup(Reporter):
 
                 # create celendar attachments
                 for target in targets:
-                    calendar = Calendar(target.list_archives())
+                    calendar = Calendar(target.list_archives(self.source.slug))
                     doc = calendar.format()
                     if doc:
                         attachments.append(
@@ -258,8 +666,20 @@ class Backup(Reporter):
 
             return "OK"
 
-        except (DBError, FSError, S3Error) as e:
+        except (
+            DBError,
+            FSError,
+            FileIndexError,
+            LocalError,
+            ReferenceStoreError,
+            S3Error,
+            SourceError,
+        ) as e:
             self.error = e
             self.etime = time.monotonic()
             if self.mailer and self.mailer.serviceable():
                 self.send_report(reporters, self.mailer)
+
+        finally:
+            if index:
+                index.close()
@@ -11,15 +11,20 @@
 from __future__ import annotations
 
 import collections
-import io
+import hashlib
 import logging
 import os
+import queue
 import tarfile
+import tempfile
+import threading
 import time
 from pathlib import Path
+from typing import BinaryIO
 
 import humanfriendly
 
+from backup.progress import Progress
 from backup.reporter import Reporter, reporter_check, reporter_check_result
 from backup.utils import formatkv, timestamp2date, timestamp4now
 
@@ -34,6 +39,183 @@ class ArchiveResult(collections.namedtuple("Result", ["size"])):
         return f"Result(size={size})"
 
 
+class ArchiveChecksums(
+    collections.namedtuple("Checksums", ["partsize", "parts", "sha256", "size"])
+):
+    """Class for the checksums of an archive.
+
+    The parts are the MD5 digests of the consecutive parts of the given
+    size, the SHA-256 digest is the hex digest of the whole archive.
+
+    """
+
+    __slots__ = ()
+
+    def etag(self) -> str:
+        """Returns the ETag of an upload in parts of partsize to S3."""
+        if len(self.parts) == 1:
+            return self.parts[0].hex()
+        digest = hashlib.md5(b"".join(self.parts), usedforsecurity=False)
+        return f"{digest.hexdigest()}-{len(self.parts)}"
+
+
+class ChecksumWriter:
+    """File object wrapper which computes the checksums of all data written
+    through it.
+
+    """
+
+    def __init__(
+        self, fileobj: BinaryIO, partsize: int, progress: Progress | None = None
+    ) -> None:
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+        self.partsize = partsize
+        self.progress = progress
+
+        self.parts: list[bytes] = []
+        self.part = hashlib.md5(usedforsecurity=False)
+        self.partfill = 0
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.fileobj.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+        if self.progress:
+            self.progress.update(len(data))
+
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.partsize - self.partfill)
+            self.part.update(view[:n])
+            self.partfill += n
+            view = view[n:]
+            if self.partfill == self.partsize:
+                self.parts.append(self.part.digest())
+                self.part = hashlib.md5(usedforsecurity=False)
+                self.partfill = 0
+        return len(data)
+
+    def flush(self) -> None:
+        self.fileobj.flush()
+
+    def close(self) -> None:
+        self.fileobj.close()
+
+    def abort(self) -> None:
+        if hasattr(self.fileobj, "abort"):
+            self.fileobj.abort()
+        else:
+            self.fileobj.close()
+
+    def checksums(self) -> ArchiveChecksums:
+        parts = list(self.parts)
+        if self.partfill or not parts:
+            parts.append(self.part.digest())
+        return ArchiveChecksums(self.partsize, parts, self.hash.hexdigest(), self.size)
+
+
+class TeeWriter:
+    """File object wrapper which writes all data to several file objects.
+
+    Closing completes all file objects, aborting cancels the ones which
+    can be aborted (like uploads) and closes the others.
+
+    """
+
+    def __init__(self, fileobjs: list) -> None:
+        self.fileobjs = fileobjs
+        self.name = next(
+            (f.name for f in fileobjs if isinstance(getattr(f, "name", None), str)),
+            None,
+        )
+
+    def write(self, data: bytes) -> int:
+        for fileobj in self.fileobjs:
+            fileobj.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        for fileobj in self.fileobjs:
+            fileobj.flush()
+
+    def close(self) -> None:
+        for n, fileobj in enumerate(self.fileobjs):
+            try:
+                fileobj.close()
+            except BaseException:
+                TeeWriter(self.fileobjs[n + 1 :]).abort()
+                raise
+
+    def abort(self) -> None:
+        for fileobj in self.fileobjs:
+            if hasattr(fileobj, "abort"):
+                fileobj.abort()
+            else:
+                fileobj.close()
+
+
+class QueuedWriter:
+    """File object wrapper which writes to a file object in a thread of its
+    own.
+
+    Up to size blocks are queued: a slow file object only blocks the writer
+    once its queue is full. An error of the file object aborts it, further
+    data is dropped and the error is raised on close.
+
+    """
+
+    def __init__(self, fileobj, size: int) -> None:
+        self.fileobj = fileobj
+        self.queue: queue.Queue = queue.Queue(maxsize=size)
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while (data := self.queue.get()) is not None:
+            if self.error:
+                continue
+            try:
+                self.fileobj.write(data)
+            except BaseException as e:
+                self.error = e
+                TeeWriter([self.fileobj]).abort()
+
+    def write(self, data: bytes) -> int:
+        if not self.error:
+            self.queue.put(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _finish(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def close(self) -> None:
+        self._finish()
+        if self.error:
+            raise self.error
+        self.fileobj.close()
+
+    def abort(self) -> None:
+        self._finish()
+        if not self.error:
+            TeeWriter([self.fileobj]).abort()
+
+
+# size up to which archive files are kept in memory
+ARCHIVEFILE_MEMORY_SIZE = 16 * 1024 * 1024
+
+# default size of parts to compute checksums for
+ARCHIVE_PART_SIZE = 8 * 1024 * 1024
+
+
 class ArchiveFile:
     def __init__(self, name: str, binmode: bool = False) -> None:
         super().__init__()
@@ -45,7 +227,7 @@ class ArchiveFile:
         self.ctime = time.time()
         self.mtime = self.ctime
 
-        self.handle = io.BytesIO()
+        self.handle = tempfile.SpooledTemporaryFile(max_size=ARCHIVEFILE_MEMORY_SIZE)
 
     def write(self, data: str | bytes) -> None:
         if isinstance(data, str):
@@ -64,7 +246,7 @@ class ArchiveFile:
         self.handle.seek(0, os.SEEK_END)
         return self.handle.tell()
 
-    def fileobject(self) -> io.BytesIO:
+    def fileobject(self) -> BinaryIO:
         self.handle.seek(0)
         return self.handle
 
@@ -73,6 +255,7 @@ class Archive(Reporter):
     def __init__(self, label: str, timestamp: str | None = None) -> None:
         super().__init__()
 
+        self.label = label
         self.timestamp = timestamp or timestamp4now()
 
         self.name = f"{label}-{self.timestamp}"
@@ -82,8 +265,25 @@ class Archive(Reporter):
 
         self.filename = f"{self.name}.tgz"
 
+        # key of the archive at the target it was listed from
+        self.key: str | None = None
+
         self.tar = None
 
+        # additional lines for the manifest as key and value pairs
+        self.manifest: list[tuple[str, str]] = []
+
+        # checksums are computed while writing (for parts of partsize)
+        self.partsize = ARCHIVE_PART_SIZE
+        self.checksums: ArchiveChecksums | None = None
+        self.writer: ChecksumWriter | None = None
+        self.progress: Progress | None = None
+
+        # streams receiving the archive while it is written (like uploads),
+        # the local file is only written if the archive is staged
+        self.streams: list = []
+        self.staged = True
+
     @classmethod
     def fromfilename(cls, filename: str, check_label: str | None = None) -> Archive:
         import re
@@ -113,22 +313,42 @@ class Archive(Reporter):
         return os.path.join(path, self.filename)
 
     def __enter__(self):
+        outputs = list(self.streams)
+        if self.staged:
+            outputs.insert(0, open(self.tarname(), "wb"))
+        self.progress = Progress(f"Archive {self.filename}")
+        self.writer = ChecksumWriter(TeeWriter(outputs), self.partsize, self.progress)
         self.tar = tarfile.open(
             self.tarname(),
             "w:gz",
+            fileobj=self.writer,
             debug=1 if logging.getLogger().getEffectiveLevel() == logging.DEBUG else 0,
         )
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        if self.tar:
-            self.tar.close()
-        else:
-            raise RuntimeError("archive not opened")
-
-        self.store_result(
-            "createArchive", ArchiveResult(os.path.getsize(self.tarname()))
-        )
+        assert self.writer is not None
+        try:
+            if self.tar:
+                self.tar.close()
+            else:
+                raise RuntimeError("archive not opened")
+        except BaseException:
+            self.writer.abort()
+            raise
+        finally:
+            assert self.progress is not None
+            counters = self.progress.finish()
+        if exc_type is not None:
+            # streams must not complete an incomplete archive
+            self.writer.abort()
+            return
+        self.writer.close()
+        self.checksums = self.writer.checksums()
+
+        size = os.path.getsize(self.tarname()) if self.staged else self.writer.size
+        self.store_result("createArchive", ArchiveResult(size))
+        self.store_result("writeArchive", counters)
 
     def create_archive_file(self, name: str, binmode: bool = False) -> ArchiveFile:
         return ArchiveFile(name, binmode=binmode)
@@ -152,10 +372,39 @@ class Archive(Reporter):
         else:
             raise RuntimeError("archive not opened")
 
+    def add_entry(
+        self, path: Path, name: str, fileobj: BinaryIO | None = None
+    ) -> tarfile.TarInfo | None:
+        """Adds a single filesystem entry without descending into directories.
+
+        The content of a regular file is read from the given file object
+        if any, otherwise the file will be opened.
+
+        Returns None for entries which can't be archived (like sockets).
+
+        """
+        if self.tar:
+            tarinfo = self.tar.gettarinfo(str(path), arcname=name)
+            if tarinfo is None:
+                logging.debug("skip unsupported entry '%s'", path)
+                return None
+            if tarinfo.isreg() and fileobj is not None:
+                self.tar.addfile(tarinfo, fileobj)
+            elif tarinfo.isreg():
+                with open(path, "rb") as f:
+                    self.tar.addfile(tarinfo, f)
+            else:
+                self.tar.addfile(tarinfo)
+            return tarinfo
+        else:
+            raise RuntimeError("archive not opened")
+
     @reporter_check
     def add_manifest(self, timestamp: str) -> None:
         f = self.create_archive_file("MANIFEST")
         f.writeline(f"Timestamp: {timestamp}")
+        for key, value in self.manifest:
+            f.writeline(f"{key}: {value}")
         self.add_archive_file(f)
 
     @reporter_check_result
@@ -11,14 +11,54 @@
 # 8 data types
 import collections
 
+# 16 generic operating system services
+import os
+
+# 6 text processing services
+import re
+
+# 12 data persistence
+import sqlite3
+
 # 17 concurrent execution
 import subprocess
 
+# 11 file and directory access
+import tempfile
+
+# 16 generic operating system services
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+
 import humanfriendly
 
+from backup.progress import Progress
 from backup.reporter import Reporter, reporter_check_result
 from backup.utils import formatkv
 
+# number of tables loaded concurrently by restore_dump
+RESTORE_WORKERS = 4
+
+# kinds of sections of a dump written by mysqldump
+HEADER = "Header"
+SCHEMA = "Table structure"
+DATA = "Dumping data"
+
+# start of a section: "-- Dumping data for table `wp_posts`"
+RE_SECTION = re.compile(rb"^-- (.+?) for (?:table|view|database) `(.*)`$")
+# lines of the footer restoring the settings of the dumping session
+RE_FOOTER = re.compile(rb"^/\*M?!\d+ SET .*=@OLD_|^-- Dump completed")
+# secondary indexes in a CREATE TABLE statement
+RE_SECONDARY_KEY = re.compile(rb"^(?:FULLTEXT |SPATIAL )?KEY ")
+RE_INNODB = re.compile(rb"\bENGINE=InnoDB\b", re.IGNORECASE)
+
+# settings for loading the data of a table in a single transaction
+BULK_LOAD = b"SET autocommit=0;\nSET unique_checks=0;\nSET foreign_key_checks=0;\n"
+COMMIT = b"COMMIT;\n"
+
 
 class DBError(Exception):
     def __init__(self, db: "DB", message: str) -> None:
@@ -43,6 +83,102 @@ class DBResult(collections.namedtuple("Result", ["size", "numberOfTables"])):
         return f"Result(size={size}, numberOfTables={self.numberOfTables})"
 
 
+class DBRestoreResult(
+    collections.namedtuple(
+        "Result", ["size", "numberOfTables", "numberOfIndexes", "duration"]
+    )
+):
+    """Class for results of db restores with proper formatting."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        duration = humanfriendly.format_timespan(self.duration)
+        return (
+            f"Result(size={size}, numberOfTables={self.numberOfTables}, "
+            f"numberOfIndexes={self.numberOfIndexes}, duration={duration})"
+        )
+
+
+class DumpSection(
+    collections.namedtuple("DumpSection", ["kind", "table", "path", "size"])
+):
+    """Class for a section of a dump (like the data of a table) spooled
+    into a file."""
+
+    __slots__ = ()
+
+
+def split_dump(fileobj: BinaryIO, directory: Path) -> Iterator[DumpSection]:
+    """Splits a dump written by mysqldump into its sections.
+
+    Each section is written into a file in the given directory and
+    yielded as soon as it is complete. The first section is the header
+    with the settings of the session, the footer restoring them is left
+    out. Lines are only taken for the footer at the end of the dump:
+    footer lines followed by other statements are kept.
+
+    """
+    kind, table, count = HEADER, "", 0
+    trailer: list[bytes] = []
+    path = directory / f"{count}.sql"
+    out = open(path, "wb")
+    try:
+        for line in fileobj:
+            if m := RE_SECTION.match(line.rstrip()):
+                out.writelines(trailer)
+                trailer = []
+                out.close()
+                yield DumpSection(kind, table, path, path.stat().st_size)
+                kind = m.group(1).decode()
+                table = m.group(2).decode(errors="replace")
+                count += 1
+                path = directory / f"{count}.sql"
+                out = open(path, "wb")
+            elif RE_FOOTER.match(line) or (trailer and not line.strip()):
+                trailer.append(line)
+            else:
+                out.writelines(trailer)
+                trailer = []
+                out.write(line)
+        out.close()
+        yield DumpSection(kind, table, path, path.stat().st_size)
+    finally:
+        out.close()
+
+
+def defer_indexes(schema: bytes) -> tuple[bytes, list[bytes]]:
+    """Returns the given schema without the secondary indexes of its
+    table and the definitions of these indexes.
+
+    Only indexes of InnoDB tables without foreign keys are deferred: for
+    these, building an index after loading is faster than updating it
+    row by row. MyISAM tables disable their indexes while loading anyway.
+
+    """
+    lines = schema.splitlines(keepends=True)
+    start = next((i for i, s in enumerate(lines) if s.startswith(b"CREATE TABLE ")), 0)
+    end = next((i for i in range(start, len(lines)) if lines[i].startswith(b")")), 0)
+    if not end or not RE_INNODB.search(lines[end]):
+        return schema, []
+
+    entries = [line.strip().rstrip(b",") for line in lines[start + 1 : end]]
+    if any(entry.startswith(b"CONSTRAINT ") for entry in entries):
+        return schema, []
+    keys = [entry for entry in entries if RE_SECONDARY_KEY.match(entry)]
+    if not keys:
+        return schema, []
+
+    kept = [b"  " + entry for entry in entries if not RE_SECONDARY_KEY.match(entry)]
+    body = b",\n".join(kept) + b"\n"
+    return b"".join(lines[: start + 1]) + body + b"".join(lines[end:]), keys
+
+
+def quote(name: str) -> bytes:
+    return b"`" + name.replace("`", "``").encode() + b"`"
+
+
 class DB(Reporter):
     def __init__(
         self,
@@ -51,6 +187,7 @@ class DB(Reporter):
         user: str | None,
         password: str | None,
         prefix: str | None,
+        port: int | None = None,
     ) -> None:
         super().__init__()
 
@@ -68,6 +205,7 @@ class DB(Reporter):
         self.user = user
         self.password = password
         self.prefix = prefix
+        self.port = port
 
     def __str__(self):
         return formatkv(
@@ -77,6 +215,17 @@ class DB(Reporter):
             title="DATABASE",
         )
 
+    def connection(self) -> list[str]:
+        """Returns the options of the mysql clients to connect to the db."""
+        options = [
+            f"--host={self.host}",
+            f"--user={self.user}",
+            f"--password={self.password}",
+        ]
+        if self.port:
+            options.append(f"--port={self.port}")
+        return options
+
     def tables(self):
         # get list of tables
         if self.prefix:
@@ -84,12 +233,9 @@ class DB(Reporter):
         else:
             execute = "show tables"
         p = subprocess.Popen(
-            [
-                "mysql",
-                self.db,
-                f"--host={self.host}",
-                f"--user={self.user}",
-                f"--password={self.password}",
+            ["mysql", self.db]
+            + self.connection()
+            + [
                 "--batch",
                 "--skip-column-names",
                 f"--execute={execute}",
@@ -118,11 +264,9 @@ class DB(Reporter):
             raise DBError(self, "no tables to dump")
 
         p = subprocess.Popen(
-            [
-                "mysqldump",
-                f"--host={self.host}",
-                f"--user={self.user}",
-                f"--password={self.password}",
+            ["mysqldump"]
+            + self.connection()
+            + [
                 "--opt",
                 self.db,
             ]
@@ -144,3 +288,233 @@ class DB(Reporter):
         archive.add_archive_file(f)
 
         return DBResult(len(stdoutdata), len(tables))
+
+    def execute(
+        self, statements: Iterable[bytes | Path], progress: Progress | None = None
+    ) -> None:
+        """Executes the given statements (or the content of the given
+        files) in a session of the mysql client."""
+        p = subprocess.Popen(
+            ["mysql", self.db] + self.connection() + ["--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+        try:
+            for statement in statements:
+                if isinstance(statement, bytes):
+                    p.stdin.write(statement)
+                    continue
+                with open(statement, "rb") as f:
+                    while data := f.read(1024 * 1024):
+                        p.stdin.write(data)
+                        if progress:
+                            progress.update(len(data))
+        except BrokenPipeError:
+            # the client stopped at an error
+            pass
+
+        (_, stderrdata) = p.communicate()
+
+        if not p.returncode == 0:
+            message = f"RC={p.returncode}"
+            if stderrdata:
+                message = stderrdata.decode(errors="replace").strip()
+            raise DBError(self, message)
+
+    def load_table(
+        self, section: DumpSection, header: bytes, trailer: bytes, progress: Progress
+    ) -> None:
+        """Loads the data of a table in a single transaction."""
+        table = Progress(f"Table {section.table}", total=section.size, quiet=True)
+        self.execute([header, BULK_LOAD, section.path, COMMIT, trailer], table)
+        table.finish()
+        progress.update(section.size)
+
+    @reporter_check_result
+    def restore_dump(self, filename: Path, workers: int = RESTORE_WORKERS):
+        """Restores a dump written by dump_to_archive into the db.
+
+        The tables are created one after the other while reading the dump,
+        their data is loaded concurrently by up to workers sessions, each
+        table in a single transaction without unique and foreign key
+        checks. Deferred secondary indexes are added after the data of
+        their table. Everything else (like views) follows when all tables
+        are loaded.
+
+        """
+        progress = Progress("restore database", total=filename.stat().st_size)
+        header = b""
+        deferred: dict[str, bytes] = {}
+        final: list[bytes | Path] = []
+        futures = []
+        tables = indexes = 0
+
+        with tempfile.TemporaryDirectory() as directory, open(filename, "rb") as f:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                for section in split_dump(f, Path(directory)):
+                    if section.kind == HEADER:
+                        header = section.path.read_bytes()
+                        progress.update(section.size)
+                    elif section.kind == SCHEMA:
+                        schema, keys = defer_indexes(section.path.read_bytes())
+                        self.execute([header, schema])
+                        progress.update(section.size)
+                        tables += 1
+                        if keys:
+                            indexes += len(keys)
+                            deferred[section.table] = (
+                                b"ALTER TABLE "
+                                + quote(section.table)
+                                + b" "
+                                + b", ".join(b"ADD " + key for key in keys)
+                                + b";\n"
+                            )
+                    elif section.kind == DATA:
+                        trailer = deferred.pop(section.table, b"")
+                        futures.append(
+                            executor.submit(
+                                self.load_table, section, header, trailer, progress
+                            )
+                        )
+                    else:
+                        final.append(section.path)
+
+                    # stop early if a table failed
+                    for future in futures:
+                        if future.done() and future.exception():
+                            future.result()
+
+                for future in futures:
+                    future.result()
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+            # deferred indexes of tables without data are added here as well
+            self.execute([header, *final, *deferred.values()], progress)
+
+        counters = progress.finish()
+        return DBRestoreResult(counters.size, tables, indexes, counters.duration)
+
+
+class SQLiteDB(Reporter):
+    """Class to add a consistent snapshot of a live SQLite database to an
+    archive.
+
+    The snapshot is taken with the online backup API of SQLite: the pages
+    are copied in steps and the database is unlocked between the steps, so
+    a running server is not blocked. If the database is changed by the
+    server while copying, the copy is restarted by SQLite. A database
+    written more often than the steps take may never be copied this way,
+    so after STEP_TIMEOUT seconds the rest is copied in a single step,
+    which only holds a read transaction and doesn't block the writers of a
+    database in WAL mode.
+
+    """
+
+    # pages to copy per step and seconds to sleep between steps
+    STEP_PAGES = 1024
+    STEP_SLEEP = 0.01
+    # seconds before copying in a single step
+    STEP_TIMEOUT = 60
+
+    def __init__(self, path):
+        super().__init__()
+
+        if not path.is_file():
+            raise DBError(self, f"database '{path}' not found")
+
+        self.path = path
+
+    def __str__(self):
+        return formatkv(
+            [
+                ("DB", self.path),
+            ],
+            title="DATABASE",
+        )
+
+    def snapshot(self, destination):
+        """Copies the database into the given file and checks the copy."""
+        try:
+            source = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+            try:
+                target = sqlite3.connect(destination)
+                try:
+                    self.copy(source, target)
+                    (check,) = target.execute("PRAGMA quick_check").fetchone()
+                    if check != "ok":
+                        raise DBError(self, f"snapshot check failed: {check}")
+                    (tables,) = target.execute(
+                        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+                    ).fetchone()
+                finally:
+                    target.close()
+            finally:
+                source.close()
+        except sqlite3.Error as e:
+            raise DBError(self, f"can't snapshot database: {e}") from e
+
+        return tables
+
+    def copy(self, source, target):
+        """Copies the database in steps, or in a single step when the steps
+        take longer than STEP_TIMEOUT."""
+        deadline = time.monotonic() + self.STEP_TIMEOUT
+
+        def progress(status, remaining, total):
+            if time.monotonic() > deadline:
+                raise TimeoutError()
+
+        try:
+            source.backup(
+                target,
+                pages=self.STEP_PAGES,
+                progress=progress,
+                sleep=self.STEP_SLEEP,
+            )
+        except TimeoutError:
+            source.backup(target)
+
+    @reporter_check_result
+    def dump_to_archive(self, archive):
+        handle, destination = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        try:
+            tables = self.snapshot(destination)
+            tarinfo = archive.add_entry(destination, f"{archive.name}-db.sqlite3")
+            return DBResult(tarinfo.size, tables)
+        finally:
+            os.remove(destination)
+
+
+def restore_snapshot(snapshot: Path, path: Path) -> DBResult:
+    """Puts a snapshot written by SQLiteDB.dump_to_archive back as the database
+    at path.
+
+    The write-ahead log and shared memory files of the replaced database
+    are removed, otherwise SQLite would apply the stale log to the snapshot.
+    The server must be stopped while the database is replaced.
+
+    """
+    try:
+        connection = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+        try:
+            (check,) = connection.execute("PRAGMA quick_check").fetchone()
+            if check != "ok":
+                raise DBError(None, f"snapshot check failed: {check}")
+            (tables,) = connection.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+            ).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        raise DBError(None, f"can't read snapshot '{snapshot}': {e}") from e
+
+    for suffix in ("-wal", "-shm"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+    size = snapshot.stat().st_size
+    os.replace(snapshot, path)
+    return DBResult(size, tables)
@@ -0,0 +1,207 @@
+"""
+######## ##     ##  ######  ##       ##     ##  ######  ####  #######  ##    ##
+##        ##   ##  ##    ## ##       ##     ## ##    ##  ##  ##     ## ###   ##
+##         ## ##   ##       ##       ##     ## ##        ##  ##     ## ####  ##
+######      ###    ##       ##       ##     ##  ######   ##  ##     ## ## ## ##
+##         ## ##   ##       ##       ##     ##       ##  ##  ##     ## ##  ####
+##        ##   ##  ##    ## ##       ##     ## ##    ##  ##  ##     ## ##   ###
+######## ##     ##  ######  ########  #######   ######  ####  #######  ##    ##
+"""
+
+from __future__ import annotations
+
+import re
+from collections import namedtuple
+from collections.abc import Iterable
+
+import humanfriendly
+
+
+class ExclusionRule(namedtuple("Rule", ["pattern", "regex", "negate", "dironly"])):
+    """Class for a single compiled gitignore-style rule."""
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, pattern: str) -> ExclusionRule | None:
+        """Parses a gitignore-style pattern into a rule.
+
+        Returns None for empty patterns and comments.
+
+        """
+        line = pattern.rstrip("\n")
+        # trailing spaces are ignored unless escaped
+        if not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            return None
+
+        negate = False
+        if line.startswith("!"):
+            negate = True
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dironly = False
+        if line.endswith("/"):
+            dironly = True
+            line = line.rstrip("/")
+        if not line:
+            return None
+
+        # patterns with a slash at the beginning or in the middle are anchored
+        # at the root, all others match at any level
+        anchored = "/" in line
+        line = line.lstrip("/")
+
+        regex = _translate(line)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+
+        return cls(pattern, regex, negate, dironly)
+
+
+def _translate(pattern: str) -> str:
+    """Translates a gitignore-style glob into a regular expression."""
+    i, n = 0, len(pattern)
+    out = []
+    a = out.append
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                leading = i == 0 or pattern[i - 1] == "/"
+                trailing = i + 2 == n or pattern[i + 2] == "/"
+                if leading and trailing:
+                    if i + 2 == n:
+                        # "foo/**" matches everything inside foo
+                        a(".*")
+                        i += 2
+                    else:
+                        # "**/foo" and "foo/**/bar" match zero or more directories
+                        a("(?:.*/)?")
+                        i += 3
+                    continue
+            # other asterisks never match a slash
+            while i < n and pattern[i] == "*":
+                i += 1
+            a("[^/]*")
+            continue
+        if c == "?":
+            a("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                a(re.escape(c))
+            else:
+                chars = pattern[i + 1 : j].replace("\\", "\\\\")
+                if chars[0] in "!^":
+                    chars = "^" + chars[1:]
+                a(f"[{chars}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            a(re.escape(pattern[i]))
+        else:
+            a(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class Exclusion:
+    """Class to decide which paths to exclude from a filesystem backup.
+
+    Patterns follow the gitignore syntax: a leading '!' re-includes a path,
+    a trailing '/' matches directories only and the last matching pattern
+    wins. All patterns are compiled into one regular expression for files
+    and one for directories, so each path costs a single match.
+
+    Regular files larger than max_size (if given) are excluded, too.
+
+    If defaults is False, the default profile of a source will be ignored.
+
+    """
+
+    def __init__(
+        self,
+        patterns: Iterable[str] = (),
+        max_size: int | None = None,
+        defaults: bool = True,
+    ) -> None:
+        super().__init__()
+
+        self.patterns = tuple(patterns)
+        self.max_size = max_size
+        self.defaults = defaults
+
+        rules = [ExclusionRule.parse(pattern) for pattern in self.patterns]
+        self.rules = [rule for rule in rules if rule]
+
+        self._files = self._compile([rule for rule in self.rules if not rule.dironly])
+        self._directories = self._compile(self.rules)
+
+    @staticmethod
+    def _compile(rules: list[ExclusionRule]) -> re.Pattern | None:
+        # the last matching rule wins: alternatives are tried in reversed
+        # order and the name of the matching group tells about negation
+        if not rules:
+            return None
+        alternatives = []
+        for index, rule in reversed(list(enumerate(rules))):
+            group = f"{'i' if rule.negate else 'x'}{index}"
+            alternatives.append(f"(?P<{group}>{rule.regex})")
+        return re.compile(r"\A(?:" + "|".join(alternatives) + r")\Z", re.DOTALL)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Exclusion):
+            return NotImplemented
+        return (self.patterns, self.max_size, self.defaults) == (
+            other.patterns,
+            other.max_size,
+            other.defaults,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"Exclusion(patterns={list(self.patterns)!r}, "
+            f"max_size={self.max_size!r}, defaults={self.defaults!r})"
+        )
+
+    def __str__(self) -> str:
+        out = [f"{len(self.rules)} rules"]
+        if self.max_size:
+            out.append(f"max size {humanfriendly.format_size(self.max_size)}")
+        if not self.defaults:
+            out.append("no defaults")
+        return ", ".join(out)
+
+    def profile(self, defaults: Iterable[str]) -> Exclusion:
+        """Returns an exclusion with the given default patterns prepended.
+
+        The patterns of this exclusion come last and win over the defaults.
+
+        """
+        if not self.defaults:
+            return self
+        return Exclusion([*defaults, *self.patterns], max_size=self.max_size)
+
+    def excludes(self, path: str, is_dir: bool = False, size: int = 0) -> bool:
+        """Returns True if the given relative path should be excluded.
+
+        Uses slashes as separators and no leading slash.
+
+        """
+        if not is_dir and self.max_size is not None and size > self.max_size:
+            return True
+        regex = self._directories if is_dir else self._files
+        if regex is None:
+            return False
+        m = regex.match(path)
+        return m is not None and m.lastgroup is not None and m.lastgroup[0] == "x"
@@ -8,11 +8,25 @@
 ##       #### ######## ########  ######     ##     ######     ##    ######## ##     ##
 """
 
+import collections
+import hashlib
+import itertools
+import json
 import logging
+import os
+import stat as statmodule
+import tarfile
+from collections.abc import Iterator
 from pathlib import Path
 
+import humanfriendly
+
 from backup.archive import Archive
-from backup.reporter import Reporter, reporter_check
+from backup.exclusion import Exclusion
+from backup.index import FileIndex, HashingReader, hash_file
+from backup.journal import Journal
+from backup.partition import Partition, PartitionArchive
+from backup.reporter import Reporter, reporter_check_result
 from backup.utils import formatkv
 
 
@@ -29,11 +43,77 @@ class FSNotFoundError(FSError):
     pass
 
 
+class FSResult(
+    collections.namedtuple(
+        "Result",
+        ["files", "directories", "excluded", "size", "unchanged", "pristine"],
+        defaults=[0, 0],
+    )
+):
+    """Class for results of filesystem operations with proper formatting."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        return (
+            f"Result(files={self.files}, directories={self.directories},"
+            f" excluded={self.excluded}, size={size}, unchanged={self.unchanged},"
+            f" pristine={self.pristine})"
+        )
+
+
 class FS(Reporter):
-    def __init__(self, path: Path) -> None:
+    """Class to add a filesystem to an archive.
+
+    If a file index is given, the content hash of each archived file is
+    recorded in the index and listed in the member FILES of the archive.
+
+    In incremental mode regular files which are unchanged according to
+    the file index are not archived again. The member FILES then refers
+    to the archive which contains the unchanged file. If a journal is
+    given, only the entries recorded as changed will be looked at.
+
+    The given partitions are left out of the filesystem and have to be
+    added to partition archives of their own.
+
+    The given generated files (mapped to the files they are generated
+    from) are left out, too, and listed in the member GENERATED of the
+    archive, so they can be generated again after a restore.
+
+    The given pristine files (mapped to their content hash and release in
+    a reference store) are not archived if their content matches. They are
+    listed in the member PRISTINE of the archive instead.
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        exclusion: Exclusion | None = None,
+        index: FileIndex | None = None,
+        incremental: bool = False,
+        journal: Journal | None = None,
+        partitions: list[Partition] | None = None,
+        generated: dict[str, str] | None = None,
+        pristine: dict[str, tuple[str, str]] | None = None,
+    ) -> None:
         super().__init__()
 
         self.path = path
+        self.exclusion = exclusion or Exclusion()
+        self.excluded = 0
+
+        if incremental and index is None:
+            raise FSError(self, "incremental mode needs a file index")
+
+        self.index = index
+        self.incremental = incremental
+        self.journal = journal
+        self.partitions = partitions or []
+        self.partition_paths = {partition.path for partition in self.partitions}
+        self.generated = generated or {}
+        self.pristine = pristine or {}
 
         if not path.exists():
             raise FSNotFoundError(self, f"path '{self.path}' not found")
@@ -42,11 +122,330 @@ class FS(Reporter):
         return formatkv(
             [
                 ("FS", self.path),
+                ("FS(Exclusion)", self.exclusion),
+                ("FS(Index)", self.index),
+                ("FS(Journal)", self.journal),
+                ("FS(Mode)", "incremental" if self.incremental else "full"),
+                ("FS(Partitions)", len(self.partitions)),
+                ("FS(Generated)", len(self.generated)),
+                ("FS(Pristine)", len(self.pristine)),
             ],
             title="FILESYSTEM",
         )
 
-    @reporter_check
-    def add_to_archive(self, archive: Archive) -> None:
+    def walk(self) -> Iterator[tuple[Path, str, os.stat_result]]:
+        """Walks the filesystem in sorted order and yields the path, the
+        relative name and the stat result of each entry not excluded.
+
+        Excluded directories are not descended into.
+
+        """
+        self.excluded = 0
+        yield from self._walk(self.path, "")
+
+    def _walk(
+        self, directory: Path, prefix: str
+    ) -> Iterator[tuple[Path, str, os.stat_result]]:
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as e:
+            raise FSError(self, f"can't read directory '{directory}': {e}") from e
+
+        for entry in entries:
+            name = prefix + entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and name in self.partition_paths:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if self.exclusion.excludes(name, is_dir, stat.st_size) or (
+                not is_dir and name in self.generated
+            ):
+                logging.debug("exclude '%s'", name)
+                self.excluded += 1
+                continue
+            path = Path(entry.path)
+            yield path, name, stat
+            if is_dir:
+                yield from self._walk(path, name + "/")
+
+    def excluded_path(self, name: str, is_dir: bool, size: int) -> bool:
+        """Returns True if the given name or one of its parents is excluded."""
+        parts = name.split("/")
+        for i in range(1, len(parts)):
+            if self.exclusion.excludes("/".join(parts[:i]), True):
+                return True
+        if not is_dir and name in self.generated:
+            return True
+        return self.exclusion.excludes(name, is_dir, size)
+
+    def walk_changes(
+        self, names: set[str]
+    ) -> Iterator[tuple[Path, str, os.stat_result]]:
+        """Yields the path, the relative name and the stat result of each
+        entry for the given changed names which still exists and is not
+        excluded. Directories are walked completely.
+
+        Entries which no longer exist are removed from the file index.
+
+        """
+        assert self.index is not None, "file index needed"
+        self.excluded = 0
+        walked: list[str] = []
+        for name in sorted(names):
+            if any(name.startswith(prefix) for prefix in walked):
+                continue
+            if any(partition.contains(name) for partition in self.partitions):
+                continue
+            path = self.path / name
+            try:
+                stat = path.lstat()
+            except FileNotFoundError:
+                self.index.remove(name)
+                continue
+            is_dir = statmodule.S_ISDIR(stat.st_mode)
+            if self.excluded_path(name, is_dir, stat.st_size):
+                self.index.remove(name)
+                self.excluded += 1
+                continue
+            yield path, name, stat
+            if is_dir:
+                walked.append(name + "/")
+                yield from self._walk(path, name + "/")
+
+    def walk_nodes(self) -> Iterator[tuple[Path, str, os.stat_result]]:
+        """Yields the path, the relative name and the stat result of each
+        entry other than a regular file known to the file index which still
+        exists and is not excluded.
+
+        Entries which no longer exist are removed from the file index.
+
+        """
+        assert self.index is not None, "file index needed"
+        for name in self.index.nodes():
+            path = self.path / name
+            try:
+                stat = path.lstat()
+            except FileNotFoundError:
+                self.index.remove(name)
+                continue
+            if statmodule.S_ISREG(stat.st_mode):
+                # replaced by a file: listed as changed by the journal
+                continue
+            is_dir = statmodule.S_ISDIR(stat.st_mode)
+            if self.excluded_path(name, is_dir, stat.st_size):
+                continue
+            yield path, name, stat
+
+    def walk_partition(
+        self, partition: Partition
+    ) -> Iterator[tuple[Path, str, os.stat_result]]:
+        """Yields the path, the relative name and the stat result of each
+        entry of the given partition not excluded.
+
+        """
+        path = self.path / partition.path
+        yield path, partition.path, path.lstat()
+        yield from self._walk(path, partition.path + "/")
+
+    def partition_digest(
+        self, partition: Partition
+    ) -> tuple[str, list[tuple[str, os.stat_result, str]]]:
+        """Returns the content hash of the given partition and the name,
+        stat result and content hash of each regular file of the partition.
+
+        The content hashes of unchanged files are taken from the file index
+        if any, so for an unchanged partition this costs a stat per file.
+
+        """
+        h = hashlib.sha256()
+        files = []
+        for path, name, stat in self.walk_partition(partition):
+            if statmodule.S_ISREG(stat.st_mode):
+                if self.index:
+                    digest = self.index.digest(path, name, stat)
+                else:
+                    digest = hash_file(path)
+                files.append((name, stat, digest))
+                h.update(f"{name}\0{digest}\n".encode())
+            else:
+                h.update(f"{name}\0{stat.st_mode:o}\n".encode())
+        return h.hexdigest(), files
+
+    @reporter_check_result
+    def add_partition_to_archive(self, archive: PartitionArchive) -> FSResult:
+        """Adds the partition of the given partition archive."""
+        files, directories, size = 0, 0, 0
+        for path, name, _stat in self.walk_partition(archive.partition):
+            tarinfo = archive.add_entry(path, f"{archive.name}/{name}")
+            if tarinfo is None:
+                continue
+            if tarinfo.isdir():
+                directories += 1
+            else:
+                files += 1
+                size += tarinfo.size
+        return FSResult(files, directories, self.excluded, size)
+
+    def record_partition(
+        self,
+        archive: PartitionArchive,
+        files: list[tuple[str, os.stat_result, str]],
+    ) -> None:
+        """Records the given partition archive for the given files."""
+        if self.index:
+            for name, stat, digest in files:
+                self.index.update(name, stat, digest, archive.name)
+        logging.debug(
+            "partition '%s' in '%s'", archive.partition.path, archive.filename
+        )
+
+    def is_pristine(self, path: Path, name: str, stat: os.stat_result) -> bool:
+        """Returns True if the given file matches its release and records
+        the release for the file in the file index.
+
+        """
+        digest, release = self.pristine[name]
+        entry = self.index.lookup(name, stat) if self.index else None
+        if (entry.digest if entry else hash_file(path)) != digest:
+            return False
+        if self.index:
+            self.index.update(name, stat, digest, release)
+        return True
+
+    def add_file(
+        self,
+        archive: Archive,
+        path: Path,
+        name: str,
+        stat: os.stat_result,
+    ) -> tarfile.TarInfo | None:
+        """Adds the given regular file to the archive and records its hash
+        in the file index.
+
+        In incremental mode unchanged files are not added: returns None.
+
+        """
+        assert self.index is not None, "file index needed"
+        entry = self.index.lookup(name, stat)
+        if self.incremental and entry is not None and entry.archive:
+            # unchanged since archived before: just keep the entry
+            self.index.update(name, stat, entry.digest)
+            return None
+        with open(path, "rb") as f:
+            reader = HashingReader(f)
+            tarinfo = archive.add_entry(path, f"{archive.name}/{name}", reader)
+        self.index.update(name, stat, reader.hexdigest(), archive.name)
+        return tarinfo
+
+    @reporter_check_result
+    def add_to_archive(self, archive: Archive) -> FSResult:
+        """Adds the filesystem to the archive.
+
+        In incremental mode with a journal only the entries changed since
+        the last committed run are looked at, unless the journal requires
+        a full scan. The entries other than regular files (like directories
+        and symlinks) known to the index are added anyway: they have no
+        content and the archive would be restored without them otherwise.
+
+        """
         logging.debug("add path '%s' to archive '%s'", self.path, archive.name)
-        archive.add_path(self.path, name=archive.name)
+        files, directories, size, unchanged = 0, 0, 0, 0
+        pristine: list[tuple[str, str, str]] = []
+
+        entries, sweep = None, False
+        if self.index and self.journal and self.incremental:
+            names, position = self.journal.changes(
+                self.path, self.index.get_state("journal")
+            )
+            self.index.set_state("journal", position)
+            if names is not None:
+                logging.info("journal lists %d changed entries", len(names))
+                entries = self.walk_changes(names)
+        if entries is None:
+            entries, sweep = self.walk(), True
+
+        archive.add_entry(self.path, archive.name)
+        if not sweep and self.index:
+            entries = itertools.chain(self.walk_nodes(), entries)
+        added: set[str] = set()
+        for path, name, stat in entries:
+            if not statmodule.S_ISREG(stat.st_mode):
+                if name in added:
+                    continue
+                added.add(name)
+                if self.index:
+                    self.index.add_node(name)
+            if (
+                name in self.pristine
+                and statmodule.S_ISREG(stat.st_mode)
+                and self.is_pristine(path, name, stat)
+            ):
+                pristine.append((name, *self.pristine[name]))
+                continue
+            if self.index is None or not statmodule.S_ISREG(stat.st_mode):
+                tarinfo = archive.add_entry(path, f"{archive.name}/{name}")
+            else:
+                tarinfo = self.add_file(archive, path, name, stat)
+                if tarinfo is None:
+                    unchanged += 1
+            if tarinfo is None:
+                continue
+            if tarinfo.isdir():
+                directories += 1
+            else:
+                files += 1
+                size += tarinfo.size
+
+        if self.index and sweep:
+            # entries not seen during a full walk are gone
+            self.index.sweep()
+        if self.index:
+            listing = archive.create_archive_file("FILES")
+            releases = {release for _digest, release in self.pristine.values()}
+            referenced = set()
+            for entry in self.index.entries():
+                if entry.archive and entry.archive not in releases:
+                    referenced.add(entry.archive)
+                listing.writeline(
+                    json.dumps(
+                        {
+                            "name": entry.name,
+                            "size": entry.size,
+                            "digest": entry.digest,
+                            "archive": entry.archive,
+                        }
+                    )
+                )
+            archive.add_archive_file(listing)
+            if self.incremental:
+                # thinning keeps the archives holding the unchanged files
+                self.index.add_references(archive.name, referenced)
+        if self.pristine:
+            if self.index:
+                # the index knows about pristine files not walked, too
+                releases = {release for _digest, release in self.pristine.values()}
+                pristine = [
+                    (entry.name, entry.digest, entry.archive)
+                    for entry in self.index.entries()
+                    if entry.archive in releases
+                ]
+            listing = archive.create_archive_file("PRISTINE")
+            for name, digest, release in pristine:
+                listing.writeline(
+                    json.dumps({"name": name, "digest": digest, "release": release})
+                )
+            archive.add_archive_file(listing)
+            archive.manifest.append(("Pristine", str(len(pristine))))
+        if self.generated:
+            listing = archive.create_archive_file("GENERATED")
+            for name, original in sorted(self.generated.items()):
+                listing.writeline(json.dumps({"name": name, "original": original}))
+            archive.add_archive_file(listing)
+            archive.manifest.append(("Generated", str(len(self.generated))))
+        if self.incremental:
+            archive.manifest.append(("Mode", "incremental"))
+
+        return FSResult(
+            files, directories, self.excluded, size, unchanged, len(pristine)
+        )
@@ -0,0 +1,310 @@
+"""
+#### ##    ## ########  ######## ##     ##
+ ##  ###   ## ##     ## ##        ##   ##
+ ##  ####  ## ##     ## ##         ## ##
+ ##  ## ## ## ##     ## ######      ###
+ ##  ##  #### ##     ## ##         ## ##
+ ##  ##   ### ##     ## ##        ##   ##
+#### ##    ## ########  ######## ##     ##
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+
+class FileIndexError(Exception):
+    def __init__(self, index: FileIndex, message: str) -> None:
+        self.index = index
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"FileIndexError({self.message!r})"
+
+
+class FileEntry(
+    collections.namedtuple(
+        "FileEntry",
+        ["name", "inode", "size", "mtime_ns", "ctime_ns", "digest", "archive"],
+    )
+):
+    """Class for an entry of the file index."""
+
+    __slots__ = ()
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """Returns True if the given stat result is unchanged."""
+        return (self.inode, self.size, self.mtime_ns, self.ctime_ns) == (
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ctime_ns,
+        )
+
+
+class HashingReader:
+    """File object wrapper which hashes all data read through it."""
+
+    def __init__(self, fileobj: BinaryIO) -> None:
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """Returns the hex digest of the content of the given file."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class FileIndex:
+    """Persistent index of files with stat results and content hashes.
+
+    The index is stored in a SQLite database and is keyed by the path of
+    each file relative to the root of the source. It allows to trust the
+    recorded content hash of a file as long as inode, size, mtime and
+    ctime of the file are unchanged.
+
+    All updates of a run are made in one transaction: nothing is changed
+    if the run is rolled back. Entries not seen during a full walk can be
+    swept before committing.
+
+    Besides the files the index keeps the other entries (like directories
+    and symlinks) by name, a small key and value store for state which has
+    to be committed together with the files, and the archives each
+    incremental archive refers to for its unchanged files.
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            name TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            ctime_ns INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            archive TEXT,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS nodes (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS refs (
+            archive TEXT NOT NULL,
+            referenced TEXT NOT NULL,
+            PRIMARY KEY (archive, referenced)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+
+        self.path = path
+
+        try:
+            self.connection = sqlite3.connect(path, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(self.SCHEMA)
+            (generation,) = self.connection.execute(
+                "SELECT MAX("
+                " (SELECT COALESCE(MAX(generation), 0) FROM files),"
+                " (SELECT COALESCE(MAX(generation), 0) FROM nodes))"
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise FileIndexError(self, f"can't open index '{path}': {e}") from e
+
+        self.generation = generation + 1
+        self.hashed = 0
+        self.cached = 0
+
+        self.connection.execute("BEGIN")
+
+    def __str__(self) -> str:
+        return f"FileIndex({self.path})"
+
+    def lookup(self, name: str, stat: os.stat_result | None = None) -> FileEntry | None:
+        """Returns the entry for the given name.
+
+        If a stat result is given, the entry is only returned if unchanged.
+
+        """
+        row = self.connection.execute(
+            "SELECT name, inode, size, mtime_ns, ctime_ns, digest, archive"
+            " FROM files WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        entry = FileEntry(*row)
+        if stat is not None and not entry.matches(stat):
+            return None
+        return entry
+
+    def update(
+        self,
+        name: str,
+        stat: os.stat_result,
+        digest: str,
+        archive: str | None = None,
+    ) -> None:
+        """Records the given stat result and digest for the given name.
+
+        If no archive is given, the archive of an existing entry is kept.
+
+        """
+        self.connection.execute(
+            "INSERT INTO files"
+            " (name, inode, size, mtime_ns, ctime_ns, digest, archive, generation)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET"
+            " inode = excluded.inode, size = excluded.size,"
+            " mtime_ns = excluded.mtime_ns, ctime_ns = excluded.ctime_ns,"
+            " digest = excluded.digest,"
+            " archive = COALESCE(excluded.archive, files.archive),"
+            " generation = excluded.generation",
+            (
+                name,
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ctime_ns,
+                digest,
+                archive,
+                self.generation,
+            ),
+        )
+
+    def remove(self, name: str) -> None:
+        """Removes the entry for the given name and all entries below."""
+        # all names below start with "name/" and sort before "name0"
+        for table in ("files", "nodes"):
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE name = ? OR (name > ? AND name < ?)",
+                (name, name + "/", name + "0"),
+            )
+
+    def entries(self) -> Iterator[FileEntry]:
+        """Yields all entries sorted by name."""
+        cursor = self.connection.execute(
+            "SELECT name, inode, size, mtime_ns, ctime_ns, digest, archive"
+            " FROM files ORDER BY name"
+        )
+        for row in cursor:
+            yield FileEntry(*row)
+
+    def add_node(self, name: str) -> None:
+        """Records an entry other than a regular file for the given name."""
+        self.connection.execute(
+            "INSERT INTO nodes (name, generation) VALUES (?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET generation = excluded.generation",
+            (name, self.generation),
+        )
+
+    def nodes(self) -> list[str]:
+        """Returns the names of all entries other than regular files."""
+        return [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM nodes ORDER BY name"
+            )
+        ]
+
+    def get_state(self, key: str) -> str | None:
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def add_references(self, archive: str, referenced: Iterable[str]) -> None:
+        """Records the archives the given archive refers to in its FILES
+        (by name) or manifest (partition archives by filename).
+
+        """
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO refs (archive, referenced) VALUES (?, ?)",
+            [(archive, name) for name in referenced if name != archive],
+        )
+
+    def references(self) -> dict[str, set[str]]:
+        """Returns the archives each archive refers to in its FILES or
+        manifest.
+
+        """
+        references: dict[str, set[str]] = collections.defaultdict(set)
+        for archive, referenced in self.connection.execute(
+            "SELECT archive, referenced FROM refs"
+        ):
+            references[archive].add(referenced)
+        return dict(references)
+
+    def digest(self, path: Path, name: str, stat: os.stat_result) -> str:
+        """Returns the content hash of the given file.
+
+        The recorded hash is trusted if the stat result is unchanged,
+        otherwise the file is read and hashed. The entry is updated in
+        both cases.
+
+        """
+        entry = self.lookup(name, stat)
+        if entry is not None:
+            self.cached += 1
+            digest = entry.digest
+        else:
+            self.hashed += 1
+            digest = hash_file(path)
+        self.update(name, stat, digest)
+        return digest
+
+    def sweep(self) -> None:
+        """Removes all entries not seen during this run."""
+        for table in ("files", "nodes"):
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE generation <> ?", (self.generation,)
+            )
+
+    def commit(self) -> None:
+        """Commits all changes made during this run."""
+        if not self.connection.in_transaction:
+            return
+        self.connection.execute("COMMIT")
+        logging.info(
+            "index '%s' committed (hashed=%d, cached=%d)",
+            self.path,
+            self.hashed,
+            self.cached,
+        )
+
+    def rollback(self) -> None:
+        """Discards all changes made during this run."""
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+
+    def close(self) -> None:
+        self.rollback()
+        self.connection.close()
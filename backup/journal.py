@@ -0,0 +1,385 @@
+"""
+      ##  #######  ##     ## ########  ##    ##    ###    ##
+      ## ##     ## ##     ## ##     ## ###   ##   ## ##   ##
+      ## ##     ## ##     ## ##     ## ####  ##  ##   ##  ##
+      ## ##     ## ##     ## ########  ## ## ## ##     ## ##
+##    ## ##     ## ##     ## ##   ##   ##  #### ######### ##
+##    ## ##     ## ##     ## ##    ##  ##   ### ##     ## ##
+ ######   #######   #######  ##     ## ##    ## ##     ## ########
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import json
+import logging
+import os
+import select
+import struct
+import time
+import uuid
+from pathlib import Path
+
+# operations recorded in the journal
+CHANGED = "M"
+DELETED = "D"
+RESET = "R"
+
+# inotify constants (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+EVENT = struct.Struct("iIII")
+
+
+class JournalError(Exception):
+    def __init__(self, journal: Journal | Watcher, message: str) -> None:
+        self.journal = journal
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"JournalError({self.message!r})"
+
+
+class Journal:
+    """Durable journal of changed paths below a root directory.
+
+    The journal is a file of JSON lines. The first line identifies the
+    journal and its root directory, all following lines record a changed
+    or deleted path relative to the root or a reset. A reset means that
+    changes may have been lost and a full scan is needed.
+
+    A watcher holds an exclusive lock on the journal while running. A
+    consumer acknowledges the position it has consumed, the watcher then
+    compacts the journal to the records after that position.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+
+        self.path = path
+        self.ackpath = path.with_name(f"{path.name}.ack")
+        self.handle = None
+
+    def __str__(self) -> str:
+        return f"Journal({self.path})"
+
+    def lock(self) -> None:
+        """Locks and empties the journal: consumers do a full scan until
+        the journal is created.
+
+        """
+        if self.handle is not None:
+            self.handle.truncate(0)
+            return
+        handle = open(self.path, "ab")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            handle.close()
+            raise JournalError(self, f"journal '{self.path}' is locked") from e
+        handle.truncate(0)
+        self.handle = handle
+
+    def create(self, root: Path) -> None:
+        """Starts a new journal for the given root directory."""
+        self.lock()
+        assert self.handle is not None
+        self.id = uuid.uuid4().hex
+        self.root = str(root.resolve())
+        self._write([{"journal": self.id, "root": self.root}])
+
+    def record(self, changes: dict[str, str]) -> None:
+        """Appends the given paths with their operations durably."""
+        self._write([{"op": op, "path": path} for path, op in sorted(changes.items())])
+
+    def reset(self) -> None:
+        """Appends a reset: consumers will have to do a full scan."""
+        self._write([{"op": RESET}])
+
+    def _write(self, records: list[dict]) -> None:
+        if not records:
+            return
+        if self.handle is None:
+            raise JournalError(self, "journal not created")
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        self.handle.write(data.encode())
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def acknowledge(self, position: str) -> None:
+        """Records that the changes up to the given position are consumed."""
+        if not position:
+            return
+        temp = self.ackpath.with_name(f"{self.ackpath.name}.tmp")
+        temp.write_text(position)
+        os.replace(temp, self.ackpath)
+
+    def compact(self) -> bool:
+        """Replaces the journal by a new journal with the records after the
+        acknowledged position. Returns True if the journal was compacted.
+
+        The header of the new journal refers to the acknowledged position,
+        so the consumer continues with the first record.
+
+        """
+        try:
+            position = self.ackpath.read_text()
+            self.ackpath.unlink()
+        except FileNotFoundError:
+            return False
+        journal, _, offset = position.partition(":")
+        if self.handle is None or journal != self.id or not offset.isdigit():
+            # acknowledged for an earlier journal
+            return False
+
+        with open(self.path, "rb") as f:
+            f.seek(int(offset))
+            records = f.read()
+
+        temp = self.path.with_name(f"{self.path.name}.tmp")
+        handle = open(temp, "ab")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        handle.truncate(0)
+        identifier = uuid.uuid4().hex
+        header = {"journal": identifier, "root": self.root, "since": position}
+        handle.write((json.dumps(header) + "\n").encode() + records)
+        handle.flush()
+        os.fsync(handle.fileno())
+        os.replace(temp, self.path)
+        self.handle.close()
+        self.handle, self.id = handle, identifier
+        logging.debug("journal '%s' compacted to %d bytes", self.path, len(records))
+        return True
+
+    def close(self) -> None:
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+    def watched(self) -> bool:
+        """Returns True if a watcher is currently holding the journal."""
+        try:
+            with open(self.path, "rb") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                fcntl.flock(f, fcntl.LOCK_UN)
+                return False
+        except FileNotFoundError:
+            return False
+
+    def changes(self, root: Path, position: str | None) -> tuple[set[str] | None, str]:
+        """Returns the paths changed since the given position and the new
+        position.
+
+        Returns None instead of paths if a full scan is needed: if no
+        watcher is running, the journal isn't started yet or belongs to
+        another root, no position is given or the journal was restarted
+        since the given position or if changes were lost.
+
+        """
+        if not self.watched():
+            logging.info("journal '%s' not watched: full scan needed", self.path)
+            return None, ""
+
+        with open(self.path, "rb") as f:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                logging.info("journal '%s' not started: full scan needed", self.path)
+                return None, ""
+            header = json.loads(line)
+            if header.get("root") != str(root.resolve()):
+                logging.info("journal '%s' for other root", self.path)
+                return None, ""
+
+            if position and position == header.get("since"):
+                # compacted to the records after the given position
+                pass
+            elif not position or position.partition(":")[0] != header["journal"]:
+                # changes before this journal was started are unknown
+                logging.info("journal '%s' is new: full scan needed", self.path)
+                f.seek(0, os.SEEK_END)
+                return None, f"{header['journal']}:{f.tell()}"
+            else:
+                f.seek(int(position.partition(":")[2]))
+
+            paths: set[str] | None = set()
+            while line := f.readline():
+                if not line.endswith(b"\n"):
+                    # incomplete record: will be read next time
+                    f.seek(-len(line), os.SEEK_CUR)
+                    break
+                record = json.loads(line)
+                if record["op"] == RESET:
+                    paths = None
+                elif paths is not None:
+                    paths.add(record["path"])
+            position = f"{header['journal']}:{f.tell()}"
+
+        if paths is None:
+            logging.info("journal '%s' was reset: full scan needed", self.path)
+        return paths, position
+
+
+class Watcher:
+    """Watches a directory tree with inotify and records changes into a
+    journal.
+
+    The journal is only created once all directories are watched, so no
+    change after its start is missed. Events are collected and
+    deduplicated for the given interval before they are written to the
+    journal, which is compacted once a consumer acknowledged a position.
+    Overflows of the event queue are recorded as resets. Failing to watch
+    a directory (for example if fs.inotify.max_user_watches is exhausted)
+    ends the watcher.
+
+    """
+
+    def __init__(self, root: Path, journal: Journal, interval: float = 1.0) -> None:
+        super().__init__()
+
+        self.root = root
+        self.journal = journal
+        self.interval = interval
+
+        self.watches: dict[int, str] = {}
+        self.changes: dict[str, str] = {}
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise JournalError(self, f"inotify_init1 failed: {os.strerror(error)}")
+
+    def __str__(self) -> str:
+        return f"Watcher({self.root})"
+
+    def watch(self, name: str) -> None:
+        """Adds watches for the given directory and all directories below."""
+        path = self.root / name if name else self.root
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            # changes below this directory would get lost: give up, without
+            # a running watcher consumers will fall back to full scans
+            self.journal.reset()
+            raise JournalError(self, f"can't watch '{path}': {os.strerror(error)}")
+        self.watches[wd] = name
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.watch(f"{name}/{entry.name}" if name else entry.name)
+        except OSError as e:
+            logging.debug("can't scan '%s': %s", path, e)
+
+    def unwatch(self, name: str) -> None:
+        """Removes watches for the given directory and all directories below."""
+        prefix = name + "/"
+        for wd, watched in list(self.watches.items()):
+            if watched == name or watched.startswith(prefix):
+                del self.watches[wd]
+                self._rm_watch(self.fd, wd)
+
+    def handle(self, data: bytes) -> None:
+        """Handles the given buffer of inotify events."""
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            filename = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflow")
+                self.changes.clear()
+                self.journal.reset()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not filename:
+                continue
+
+            name = f"{directory}/{filename}" if directory else filename
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self.changes[name] = DELETED
+                if mask & IN_ISDIR:
+                    self.unwatch(name)
+            else:
+                self.changes[name] = CHANGED
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch(name)
+
+    def run(self, iterations: int | None = None) -> None:
+        """Watches and records changes until interrupted."""
+        self.journal.lock()
+        self.watch("")
+        self.journal.create(self.root)
+        logging.info("watching %d directories below '%s'", len(self.watches), self.root)
+
+        deadline = time.monotonic() + self.interval
+        while iterations is None or iterations > 0:
+            timeout = max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if readable:
+                try:
+                    self.handle(os.read(self.fd, 64 * 1024))
+                except BlockingIOError:
+                    pass
+            if time.monotonic() >= deadline:
+                self.journal.record(self.changes)
+                self.changes.clear()
+                self.journal.compact()
+                deadline = time.monotonic() + self.interval
+                if iterations is not None:
+                    iterations -= 1
+
+    def close(self) -> None:
+        os.close(self.fd)
+        self.journal.close()
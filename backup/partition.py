@@ -0,0 +1,74 @@
+"""
+########     ###    ########  ######## #### ######## ####  #######  ##    ##
+##     ##   ## ##   ##     ##    ##     ##     ##     ##  ##     ## ###   ##
+##     ##  ##   ##  ##     ##    ##     ##     ##     ##  ##     ## ####  ##
+########  ##     ## ########     ##     ##     ##     ##  ##     ## ## ## ##
+##        ######### ##   ##      ##     ##     ##     ##  ##     ## ##  ####
+##        ##     ## ##    ##     ##     ##     ##     ##  ##     ## ##   ###
+##        ##     ## ##     ##    ##    ####    ##    ####  #######  ##    ##
+"""
+
+from __future__ import annotations
+
+import collections
+
+from backup.archive import Archive
+
+
+class Partition(collections.namedtuple("Partition", ["name", "path"])):
+    """Class for a closed subtree of the filesystem of a source.
+
+    The name identifies the partition (like 'uploads-2023-01'), the path
+    is the subtree relative to the root of the source (like
+    'wp-content/uploads/2023/01').
+
+    A closed partition is not expected to change anymore. It is archived
+    on its own and only archived again if its content changes.
+
+    """
+
+    __slots__ = ()
+
+    def contains(self, name: str) -> bool:
+        """Returns True if the given relative name is inside the partition."""
+        return name == self.path or name.startswith(self.path + "/")
+
+
+class PartitionArchive(Archive):
+    """Archive for a partition identified by the hash of its content.
+
+    The filename is derived from label, partition name and content hash,
+    so an unchanged partition maps to the same filename on each run.
+
+    """
+
+    SUFFIX = ".partition.tgz"
+
+    def __init__(self, label: str, partition: Partition, digest: str) -> None:
+        super().__init__(label)
+
+        self.partition = partition
+        self.digest = digest
+
+        self.name = f"{label}.{partition.name}.{digest[:16]}"
+        self.filename = f"{self.name}{self.SUFFIX}"
+
+    def __repr__(self) -> str:
+        return f"PartitionArchive[name={self.name}, digest={self.digest}]"
+
+    @classmethod
+    def is_partition(cls, filename: str) -> bool:
+        return filename.endswith(cls.SUFFIX)
+
+    @classmethod
+    def fromfilename(cls, filename: str, path: str) -> PartitionArchive:
+        """Returns the partition archive of the given filename for the
+        partition at the given path (as listed in a manifest).
+
+        The digest is only known by its prefix in the filename.
+
+        """
+        if not cls.is_partition(filename):
+            raise ValueError(f"not a partition archive '{filename}'")
+        label, name, digest = filename[: -len(cls.SUFFIX)].rsplit(".", 2)
+        return cls(label, Partition(name, path), digest)
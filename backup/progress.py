@@ -0,0 +1,144 @@
+"""
+########  ########   #######   ######   ########  ########  ######   ######
+##     ## ##     ## ##     ## ##    ##  ##     ## ##       ##    ## ##    ##
+##     ## ##     ## ##     ## ##        ##     ## ##       ##       ##
+########  ########  ##     ## ##   #### ########  ######    ######   ######
+##        ##   ##   ##     ## ##    ##  ##   ##   ##             ##       ##
+##        ##    ##  ##     ## ##    ##  ##    ##  ##       ##    ## ##    ##
+##        ##     ##  #######   ######   ##     ## ########  ######   ######
+"""
+
+from __future__ import annotations
+
+import collections
+import logging
+import sys
+import threading
+import time
+from typing import TextIO
+
+import humanfriendly
+
+# minimum interval in seconds between two updates of the display
+PROGRESS_INTERVAL = 0.25
+
+# stalls shorter than this (in seconds) are not reported
+STALL_THRESHOLD = 1.0
+
+
+class ProgressResult(
+    collections.namedtuple("Result", ["size", "duration", "throughput", "stall"])
+):
+    """Class for the counters of a finished operation with proper formatting.
+
+    The stall is the longest time in seconds without any progress.
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        duration = humanfriendly.format_timespan(self.duration)
+        throughput = humanfriendly.format_size(self.throughput)
+        out = f"size={size}, duration={duration}, throughput={throughput}/s"
+        if self.stall >= STALL_THRESHOLD:
+            out += f", stall={humanfriendly.format_timespan(self.stall)}"
+        return f"Result({out})"
+
+
+class Progress:
+    """Thread-safe counter of the bytes processed by an operation.
+
+    On a console the bytes, the percentage, the current and the average
+    throughput and the remaining time are displayed, at most every
+    interval seconds (never if quiet). The counters are kept for the
+    report.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        total: int | None = None,
+        output: TextIO | None = None,
+        interval: float = PROGRESS_INTERVAL,
+        quiet: bool = False,
+    ) -> None:
+        self.name = name
+        self.total = total
+        self.output = output or sys.stderr
+        self.interval = interval
+        self.console = not quiet and self.output.isatty()
+
+        self.lock = threading.Lock()
+        self.done = 0
+        self.stime = time.monotonic()
+        self.etime: float | None = None
+        self.last = self.stime
+        self.stall = 0.0
+
+        # counters at the last update of the display
+        self.shown = self.stime
+        self.shown_done = 0
+        self.current = 0.0
+
+    def __str__(self) -> str:
+        return f"Progress({self.name})"
+
+    def update(self, size: int) -> None:
+        """Counts the given number of bytes as processed."""
+        with self.lock:
+            now = time.monotonic()
+            self.done += size
+            self.stall = max(self.stall, now - self.last)
+            self.last = now
+            if now - self.shown >= self.interval:
+                self.current = (self.done - self.shown_done) / (now - self.shown)
+                self.shown, self.shown_done = now, self.done
+                if self.console:
+                    self.output.write(f"\r{self.line(now)}\033[K")
+                    self.output.flush()
+
+    @property
+    def duration(self) -> float:
+        return (self.etime or time.monotonic()) - self.stime
+
+    @property
+    def throughput(self) -> int:
+        duration = self.duration
+        return int(self.done / duration) if duration > 0 else 0
+
+    def eta(self) -> float | None:
+        """Returns the remaining seconds at the current throughput."""
+        if not self.total or not self.current:
+            return None
+        return max(self.total - self.done, 0) / self.current
+
+    def line(self, now: float) -> str:
+        out = f"{self.name}: {humanfriendly.format_size(self.done)}"
+        if self.total:
+            total = humanfriendly.format_size(self.total)
+            out += f" of {total} ({100 * self.done // self.total}%)"
+        current = humanfriendly.format_size(int(self.current))
+        average = int(self.done / (now - self.stime)) if now > self.stime else 0
+        average = humanfriendly.format_size(average)
+        out += f", {current}/s (average {average}/s)"
+        if (eta := self.eta()) is not None and self.etime is None:
+            out += f", {humanfriendly.format_timespan(int(eta))} left"
+        return out
+
+    def finish(self) -> ProgressResult:
+        """Ends the operation and returns its counters."""
+        with self.lock:
+            if self.etime is None:
+                self.etime = time.monotonic()
+                line = self.line(self.etime)
+                if self.console:
+                    self.output.write(f"\r{line}\033[K\n")
+                    self.output.flush()
+                logging.info("%s", line)
+            return self.result()
+
+    def result(self) -> ProgressResult:
+        return ProgressResult(self.done, self.duration, self.throughput, self.stall)
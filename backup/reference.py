@@ -0,0 +1,189 @@
+"""
+########  ######## ######## ######## ########  ######## ##    ##  ######  ########
+##     ## ##       ##       ##       ##     ## ##       ###   ## ##    ## ##
+##     ## ##       ##       ##       ##     ## ##       ####  ## ##       ##
+########  ######   ######   ######   ########  ######   ## ## ## ##       ######
+##   ##   ##       ##       ##       ##   ##   ##       ##  #### ##       ##
+##    ##  ##       ##       ##       ##    ##  ##       ##   ### ##    ## ##
+##     ## ######## ##       ######## ##     ## ######## ##    ##  ######  ########
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from collections.abc import Iterable
+from pathlib import Path
+
+# kinds of components
+CORE = "core"
+PLUGIN = "plugin"
+THEME = "theme"
+
+
+class ReferenceStoreError(Exception):
+    def __init__(self, store: ReferenceStore, message: str) -> None:
+        self.store = store
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"ReferenceStoreError({self.message!r})"
+
+
+class Component(
+    collections.namedtuple("Component", ["kind", "slug", "version", "path"])
+):
+    """Class for an installed release of a component of a source.
+
+    The path is the directory of the component relative to the root of
+    the source (empty for the core).
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}/{self.slug}/{self.version}"
+
+
+class ReferenceStore:
+    """Local store of known-good releases of components.
+
+    For each imported release the store keeps a listing of its files with
+    their content hashes, and the content of each file once by its hash.
+    Files of a source matching a listed release don't have to be archived,
+    they can be restored from the store.
+
+    The store is a directory with the listings in 'releases' and the file
+    contents in 'objects'.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+
+        self.path = path
+
+        if not path.is_dir():
+            raise ReferenceStoreError(self, f"path '{path}' not found")
+
+    def __str__(self) -> str:
+        return f"ReferenceStore({self.path})"
+
+    def release_path(self, key: str) -> Path:
+        return self.path / "releases" / f"{key}.json"
+
+    def object_path(self, digest: str) -> Path:
+        return self.path / "objects" / digest[:2] / digest
+
+    def listing(self, key: str) -> dict[str, str] | None:
+        """Returns the files of the given release with their content hashes."""
+        try:
+            with open(self.release_path(key)) as f:
+                return json.load(f)["files"]
+        except FileNotFoundError:
+            return None
+
+    def pristine(self, components: Iterable[Component]) -> dict[str, tuple[str, str]]:
+        """Returns the files of the given components known to the store,
+        mapped to their content hash and the key of their release.
+
+        """
+        files = {}
+        for component in components:
+            listing = self.listing(component.key)
+            if listing is None:
+                logging.info("release '%s' not in reference store", component.key)
+                continue
+            for name, digest in listing.items():
+                if component.path:
+                    name = f"{component.path}/{name}"
+                files[name] = (digest, component.key)
+        return files
+
+    def import_release(self, kind: str, version: str, filename: Path) -> Component:
+        """Imports a release from a zip file with a single top directory
+        (like the official downloads of Wordpress, plugins and themes).
+
+        The slug of the component is the name of the top directory.
+
+        """
+        try:
+            with zipfile.ZipFile(filename) as z:
+                members = [info for info in z.infolist() if not info.is_dir()]
+                tops = {info.filename.split("/", 1)[0] for info in members}
+                if len(tops) != 1 or not all("/" in m.filename for m in members):
+                    raise ReferenceStoreError(
+                        self, f"'{filename}' has no single top directory"
+                    )
+                slug = tops.pop()
+
+                files = {}
+                for info in members:
+                    with z.open(info) as f:
+                        digest = self.add_object(f)
+                    files[info.filename.split("/", 1)[1]] = digest
+        except (OSError, zipfile.BadZipFile) as e:
+            raise ReferenceStoreError(self, f"can't import '{filename}': {e}") from e
+
+        component = Component(kind, slug, version, "")
+        self._write_atomic(
+            self.release_path(component.key),
+            json.dumps({"files": files}, sort_keys=True).encode(),
+        )
+        logging.info("imported release '%s' (%d files)", component.key, len(files))
+        return component
+
+    def add_object(self, fileobj) -> str:
+        """Stores the content of the given file object and returns its hash."""
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as tmp:
+            try:
+                h = hashlib.sha256()
+                while data := fileobj.read(1024 * 1024):
+                    h.update(data)
+                    tmp.write(data)
+                tmp.close()
+                digest = h.hexdigest()
+                path = self.object_path(digest)
+                if path.exists():
+                    os.unlink(tmp.name)
+                else:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(tmp.name, path)
+                return digest
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def restore(self, entries: Iterable[dict], root: Path) -> int:
+        """Restores the given entries of a PRISTINE listing below root.
+
+        Returns the number of restored files.
+
+        """
+        count = 0
+        for entry in entries:
+            source = self.object_path(entry["digest"])
+            if not source.is_file():
+                raise ReferenceStoreError(
+                    self, f"content of '{entry['name']}' not in reference store"
+                )
+            destination = root / entry["name"]
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, destination)
+            count += 1
+        return count
@@ -0,0 +1,160 @@
+"""
+########  ########  ######  ########  #######  ########  ########
+##     ## ##       ##    ##    ##    ##     ## ##     ## ##
+##     ## ##       ##          ##    ##     ## ##     ## ##
+########  ######    ######     ##    ##     ## ########  ######
+##   ##   ##             ##    ##    ##     ## ##   ##   ##
+##    ##  ##       ##    ##    ##    ##     ## ##    ##  ##
+##     ## ########  ######     ##     #######  ##     ## ########
+"""
+
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import tarfile
+from pathlib import Path
+from typing import BinaryIO
+
+import humanfriendly
+
+
+class RestoreError(Exception):
+    def __init__(self, archive: str, message: str) -> None:
+        self.archive = archive
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"RestoreError({self.message!r})"
+
+
+class RestoreResult(
+    collections.namedtuple(
+        "Result", ["files", "size", "partitions", "referenced"], defaults=[0, 0]
+    )
+):
+    """Class for results of restore operations with proper formatting.
+
+    Partitions is the number of partition archives restored as well,
+    referenced the number of archives holding unchanged files of an
+    incremental archive.
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        out = f"files={self.files}, size={size}"
+        if self.partitions:
+            out += f", partitions={self.partitions}"
+        if self.referenced:
+            out += f", referenced={self.referenced}"
+        return f"Result({out})"
+
+
+def inside(path: str, subtree: str | None) -> bool:
+    """Returns True if the given relative path is inside the given subtree
+    (always True without a subtree).
+
+    """
+    if not subtree:
+        return True
+    path, subtree = path.strip("/"), subtree.strip("/")
+    return path == subtree or path.startswith(subtree + "/")
+
+
+def overlaps(path: str, subtree: str | None) -> bool:
+    """Returns True if the given relative path is inside the given subtree
+    or contains it.
+
+    """
+    return inside(path, subtree) or inside(subtree or "", path)
+
+
+def extract_archive(
+    fileobj: BinaryIO,
+    root: Path,
+    subtree: str | None = None,
+    members: bool = True,
+    names: set[str] | None = None,
+) -> tuple[RestoreResult, dict[str, str], dict[str, set[str]]]:
+    """Extracts the given gzip-compressed tar stream into root while it is
+    read.
+
+    The tree below the top directory of the archive is restored into root
+    (with a subtree only the entries inside the subtree, with names only
+    the given files). The other members like MANIFEST and database dumps
+    are restored into root if requested and without a subtree. Entries
+    leaving root are rejected.
+
+    Returns the result, the partitions listed in the MANIFEST of the
+    archive (mapped from their path to the filename of their archive) and
+    for an incremental archive the files listed in its FILES which are
+    held by earlier archives (mapped from the name of these archives).
+
+    """
+    files, size, partitions = 0, 0, {}
+    top, incremental = None, False
+    listings: dict[str, list[dict]] = {}
+    root.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            _, _, name = member.name.partition("/")
+            if member.name in ("MANIFEST", "FILES", "PRISTINE"):
+                f = tar.extractfile(member)
+                data = f.read() if f else b""
+                if member.name == "MANIFEST":
+                    for line in data.decode().splitlines():
+                        key, _, value = line.partition(": ")
+                        if key == "Partition" and " " in value:
+                            path, filename = value.rsplit(" ", 1)
+                            partitions[path] = filename
+                        if key == "Mode":
+                            incremental = value == "incremental"
+                else:
+                    listings[member.name] = [
+                        json.loads(line) for line in data.splitlines() if line.strip()
+                    ]
+                if members and not subtree:
+                    (root / member.name).write_bytes(data)
+                continue
+
+            if names is not None:
+                # only the given files of the tree
+                if not member.isreg() or name not in names:
+                    continue
+                member.name = name
+            elif "/" not in member.name:
+                if member.isdir() and top is None:
+                    top = member.name
+                # the top directory itself or a member next to it
+                if member.isdir() or subtree or not members:
+                    continue
+            elif not inside(name, subtree):
+                continue
+            else:
+                member.name = name
+                if member.islnk():
+                    member.linkname = member.linkname.partition("/")[2]
+
+            # the data filter drops the modes of directories
+            tar.extract(member, root, filter="tar" if member.isdir() else "data")
+            if member.isreg():
+                files += 1
+                size += member.size
+
+    references: dict[str, set[str]] = {}
+    if incremental:
+        # pristine files are restored from a reference store
+        pristine = {entry["name"] for entry in listings.get("PRISTINE", [])}
+        for entry in listings.get("FILES", []):
+            held = entry.get("archive")
+            if not held or held == top or entry["name"] in pristine:
+                continue
+            if inside(entry["name"], subtree):
+                references.setdefault(held, set()).add(entry["name"])
+
+    logging.info("restored %d files into '%s'", files, root)
+    return RestoreResult(files, size), partitions, references
@@ -7,6 +7,8 @@ This module defines the common interface that all backup sources must implement.
 from pathlib import Path
 from typing import Protocol, TypedDict, runtime_checkable
 
+from backup.partition import Partition
+from backup.reference import Component
 from backup.reporter import Reporter
 from backup.utils import formatkv
 
@@ -28,6 +30,7 @@ class SourceProtocol(Protocol):
 
     fspath: Path
     fsconfig: Path
+    fsexcludes: list[str]
 
     title: str
     slug: str
@@ -41,9 +44,17 @@ class SourceProtocol(Protocol):
     dbpass: str | None
     dbprefix: str | None
     dbcharset: str
+    dbfile: Path | None
+    dbexcludes: list[str]
 
     def __str__(self) -> str: ...
 
+    def partitions(self) -> list[Partition]: ...
+
+    def generated_files(self) -> dict[str, str]: ...
+
+    def components(self) -> list[Component]: ...
+
 
 class Source(Reporter, SourceProtocol):
     """Base class for all backup sources implementing the SourceProtocol."""
@@ -53,6 +64,7 @@ class Source(Reporter, SourceProtocol):
 
         self.fspath = fspath
         self.fsconfig = fsconfig
+        self.fsexcludes: list[str] = []
 
         self.title = ""
         self.slug = ""
@@ -67,6 +79,11 @@ class Source(Reporter, SourceProtocol):
         self.dbprefix = None
         self.dbcharset = "utf8mb4"
 
+        # file of a SQLite database (instead of a database server) and
+        # patterns for its live files to exclude from the filesystem
+        self.dbfile: Path | None = None
+        self.dbexcludes: list[str] = []
+
     def __str__(self) -> str:
         return formatkv(
             [
@@ -83,6 +100,24 @@ class Source(Reporter, SourceProtocol):
             title=self.__class__.__name__.upper(),
         )
 
+    def partitions(self) -> list[Partition]:
+        """Returns the closed partitions of the filesystem (if any)."""
+        return []
+
+    def generated_files(self) -> dict[str, str]:
+        """Returns the files which can be generated from other files (if
+        any) mapped to the files they are generated from.
+
+        """
+        return {}
+
+    def components(self) -> list[Component]:
+        """Returns the installed releases of core, plugins and themes (if
+        any) detected in the filesystem.
+
+        """
+        return []
+
     def _build_configuration(self, config: SourceConfig | None):
         if config:
             if dbname := config.get("dbname"):
@@ -47,9 +47,18 @@ class HHDatabaseError(HHError):
 
 
 class HH(Source):
+    # regenerable files: runtime caches and published assets
+    EXCLUDES = [
+        "/protected/runtime/",
+        "/assets/",
+        "node_modules/",
+    ]
+
     def __init__(self, path: Path, config: SourceConfig | None = None):
         super().__init__(path, path / "protected/config/dynamic.php")
 
+        self.fsexcludes = list(self.EXCLUDES)
+
         if not self._check_configuration():
             raise HHNotFoundError(self, f"no humhub instance found at '{self.fspath}'")
 
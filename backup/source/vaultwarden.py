@@ -33,9 +33,24 @@ class VWNotFoundError(VWError):
 
 
 class VW(Source):
+    # regenerable files: cached website icons and temporary files
+    EXCLUDES = [
+        "/icon_cache/",
+        "/tmp/",
+    ]
+
+    # the database with its write-ahead log and shared memory files
+    DBFILE = "db.sqlite3"
+    DBEXCLUDES = [
+        "/db.sqlite3",
+        "/db.sqlite3-*",
+    ]
+
     def __init__(self, path: Path, config: SourceConfig | None = None):
         super().__init__(path, path / "config.json")
 
+        self.fsexcludes = list(self.EXCLUDES)
+
         if not self._check_configuration():
             raise VWNotFoundError(
                 self, f"no vaultwarden instance found at '{self.fspath}'"
@@ -45,6 +60,8 @@ class VW(Source):
 
         self.dbname = None
         self.dbhost = None
+        self.dbfile = self.fspath / self.DBFILE
+        self.dbexcludes = list(self.DBEXCLUDES)
 
         self.slug = slugify(self.title)
 
@@ -8,13 +8,19 @@
  ###  ###   #######  ##     ## ########  ##        ##     ## ########  ######   ######
 """
 
+import logging
+import posixpath
 import re
+from datetime import date
 from pathlib import Path
 
 import pymysql as mysql
 
+from backup.partition import Partition
+from backup.reference import CORE, PLUGIN, THEME, Component
 from backup.reporter import reporter_check
-from backup.utils import slugify
+from backup.utils import codec4charset, slugify
+from backup.utils.php import PHPUnserializeError, unserialize
 
 from ._base import Source, SourceConfig
 from .errors import SourceError
@@ -39,9 +45,31 @@ class WPDatabaseError(WPError):
 
 
 class WP(Source):
+    # regenerable files: caches, update leftovers and archives of backup plugins
+    EXCLUDES = [
+        "/wp-content/cache/",
+        "/wp-content/upgrade/",
+        "/wp-content/upgrade-temp-backup/",
+        "/wp-content/updraft/",
+        "/wp-content/ai1wm-backups/",
+        "/wp-content/backups-dup-lite/",
+        "/wp-content/backups-dup-pro/",
+        "/wp-content/uploads/backwpup-*/",
+        "/wp-content/uploads/backup-guard/",
+        "node_modules/",
+    ]
+
+    # media files are organized in folders by year and month
+    UPLOADS = "wp-content/uploads"
+
+    # number of months (including the current one) still open for changes
+    UPLOADS_OPEN_MONTHS = 2
+
     def __init__(self, path: Path, config: SourceConfig | None = None):
         super().__init__(path, path / "wp-config.php")
 
+        self.fsexcludes = list(self.EXCLUDES)
+
         if not self._check_configuration():
             raise WPNotFoundError(
                 self, f"no wordpress instance found at '{self.fspath}'"
@@ -57,6 +85,139 @@ class WP(Source):
 
         self.slug = slugify(self.title)
 
+    def partitions(self, today: date | None = None) -> list[Partition]:
+        """Returns a partition for each closed month of uploads."""
+        if today is None:
+            today = date.today()
+        months = today.year * 12 + today.month - 1
+        closed = months - self.UPLOADS_OPEN_MONTHS
+
+        uploads = self.fspath / self.UPLOADS
+        if not uploads.is_dir():
+            return []
+
+        partitions = []
+        for year in sorted(uploads.iterdir()):
+            if not (year.is_dir() and re.fullmatch(r"\d{4}", year.name)):
+                continue
+            for month in sorted(year.iterdir()):
+                if not (month.is_dir() and re.fullmatch(r"\d{2}", month.name)):
+                    continue
+                if int(year.name) * 12 + int(month.name) - 1 > closed:
+                    continue
+                partitions.append(
+                    Partition(
+                        f"uploads-{year.name}-{month.name}",
+                        f"{self.UPLOADS}/{year.name}/{month.name}",
+                    )
+                )
+        return partitions
+
+    def generated_files(self) -> dict[str, str]:
+        """Returns the resized copies of uploaded images (thumbnails, scaled
+        and WebP variants) mapped to the original uploads.
+
+        The copies are taken from the attachment metadata in the database.
+        Copies of originals which don't exist are not returned.
+
+        """
+        generated = {}
+        for value in self._query_attachments():
+            try:
+                metadata = unserialize(value, codec4charset(self.dbcharset))
+            except PHPUnserializeError as e:
+                logging.debug("invalid attachment metadata: %s", e)
+                continue
+            if not isinstance(metadata, dict) or not metadata.get("file"):
+                continue
+
+            directory, filename = posixpath.split(str(metadata["file"]))
+            original = str(metadata.get("original_image") or filename)
+            copies = set() if original == filename else {filename}
+            for size in [metadata, *(metadata.get("sizes") or {}).values()]:
+                if not isinstance(size, dict):
+                    continue
+                if size is not metadata and size.get("file"):
+                    copies.add(str(size["file"]))
+                for source in (size.get("sources") or {}).values():
+                    if isinstance(source, dict) and source.get("file"):
+                        copies.add(str(source["file"]))
+            copies.discard(original)
+
+            prefix = posixpath.join(self.UPLOADS, directory)
+            original = posixpath.join(prefix, original)
+            if not (self.fspath / original).is_file():
+                continue
+            for copy in copies:
+                if "/" not in copy:
+                    generated[posixpath.join(prefix, copy)] = original
+        return generated
+
+    def components(self) -> list[Component]:
+        """Returns the release of Wordpress and the releases of all plugins
+        and themes with a version in their headers.
+
+        """
+        components = []
+
+        try:
+            with open(self.fspath / "wp-includes" / "version.php") as f:
+                if m := re.search(
+                    r"^\$wp_version\s*=\s*[\'\"]([^\'\"]+)[\'\"]", f.read(), re.M
+                ):
+                    components.append(Component(CORE, "wordpress", m.group(1), ""))
+        except OSError as e:
+            logging.debug("no wordpress version: %s", e)
+
+        plugins = self.fspath / "wp-content" / "plugins"
+        for directory in sorted(plugins.iterdir()) if plugins.is_dir() else []:
+            if not directory.is_dir():
+                continue
+            for filename in sorted(directory.glob("*.php")):
+                headers = self._file_headers(filename)
+                if "Plugin Name" in headers and "Version" in headers:
+                    components.append(
+                        Component(
+                            PLUGIN,
+                            directory.name,
+                            headers["Version"],
+                            f"wp-content/plugins/{directory.name}",
+                        )
+                    )
+                    break
+
+        themes = self.fspath / "wp-content" / "themes"
+        for directory in sorted(themes.iterdir()) if themes.is_dir() else []:
+            headers = self._file_headers(directory / "style.css")
+            if "Version" in headers:
+                components.append(
+                    Component(
+                        THEME,
+                        directory.name,
+                        headers["Version"],
+                        f"wp-content/themes/{directory.name}",
+                    )
+                )
+
+        return components
+
+    @staticmethod
+    def _file_headers(filename: Path) -> dict[str, str]:
+        # headers are read from the first 8 KiB like Wordpress does
+        try:
+            with open(filename, encoding="utf-8", errors="replace") as f:
+                data = f.read(8192)
+        except OSError:
+            return {}
+        headers = {}
+        for key in ["Plugin Name", "Theme Name", "Version"]:
+            if m := re.search(
+                rf"^[ \t/*#@]*{key}:(.*)$", data, re.MULTILINE | re.IGNORECASE
+            ):
+                if value := m.group(1).strip().removesuffix("*/").strip():
+                    headers[key] = value
+        return headers
+
     def _check_configuration(self) -> bool:
         return self.fspath.exists() and self.fsconfig.is_file()
 
@@ -116,24 +277,27 @@ class WP(Source):
                 self.dbhost = host
                 self.dbport = int(port) if port else self.dbport
 
-    @reporter_check
-    def _query_database(self) -> tuple[str, str]:
+    def _connect(self) -> mysql.Connection:
         assert self.dbname, "database name not set"
         assert self.dbhost, "database host not set"
         assert self.dbuser, "database user not set"
         assert self.dbpass, "database password not set"
         assert self.dbprefix, "database prefix not set"
 
+        return mysql.connect(
+            db=self.dbname,
+            host=self.dbhost,
+            port=self.dbport,
+            user=self.dbuser,
+            password=self.dbpass,
+            charset=self.dbcharset,
+        )
+
+    @reporter_check
+    def _query_database(self) -> tuple[str, str]:
         connection = None
         try:
-            connection = mysql.connect(
-                db=self.dbname,
-                host=self.dbhost,
-                port=self.dbport,
-                user=self.dbuser,
-                password=self.dbpass,
-                charset=self.dbcharset,
-            )
+            connection = self._connect()
             cursor = connection.cursor()
             cursor.execute(
                 f"SELECT option_value FROM {self.dbprefix}options"
@@ -160,3 +324,21 @@ class WP(Source):
         finally:
             if connection:
                 connection.close()
+
+    def _query_attachments(self) -> list[str]:
+        connection = None
+        try:
+            connection = self._connect()
+            cursor = connection.cursor()
+            cursor.execute(
+                f"SELECT meta_value FROM {self.dbprefix}postmeta"
+                f" WHERE meta_key = '_wp_attachment_metadata'"
+            )
+            return [row[0] for row in cursor.fetchall() if row[0]]
+
+        except mysql.Error as e:
+            raise WPDatabaseError(self, repr(e)) from e
+
+        finally:
+            if connection:
+                connection.close()
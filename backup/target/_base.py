@@ -1,8 +1,12 @@
 from collections.abc import Callable
-from typing import Protocol
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Protocol
 
 from backup.archive import Archive
-from backup.reporter import Reporter
+from backup.partition import PartitionArchive
+from backup.reporter import Reporter, reporter_check_result
+from backup.restore import RestoreError, RestoreResult, extract_archive, overlaps
 
 
 class TargetProtocol(Protocol):
@@ -10,15 +14,137 @@ class TargetProtocol(Protocol):
 
     label: str
     description: str
+    partsize: int | None
+    mirrors_source: bool
 
-    def list_archives(self, label: str | None = None) -> list[Archive]: ...
+    def list_archives(
+        self, label: str | None = None, since: datetime | None = None
+    ) -> list[Archive]: ...
+
+    def contains_archive(self, archive: Archive) -> bool: ...
+
+    def open_stream(self, archive: Archive) -> Any: ...
+
+    def open_archive(self, archive: Archive) -> BinaryIO: ...
+
+    def restore_archive(
+        self, archive: Archive, root: Path, subtree: str | None = None
+    ) -> RestoreResult: ...
 
     def transfer_archive(self, archive: Archive, dry: bool = False): ...
 
     def perform_thinning(
-        self, label: str, thin_archives: Callable, dry: bool = False
+        self,
+        label: str,
+        thin_archives: Callable,
+        dry: bool = False,
+        since: datetime | None = None,
     ): ...
 
+    def thinning_marker(self, label: str) -> str | None: ...
+
+    def thin_out_partitions(
+        self, label: str, obsolete: set[str], dry: bool = False
+    ) -> Any: ...
+
+    def mark_thinning(self, label: str, strategy: str) -> None: ...
+
 
 class Target(Reporter, TargetProtocol):
     """Base class for all backup targets implementing the TargetProtocol."""
+
+    # size of the parts the target transfers archives in (if any)
+    partsize: int | None = None
+
+    # True if the target copies the current files of the source instead of
+    # the archive (it can't take archives of an earlier state)
+    mirrors_source: bool = False
+
+    def open_stream(self, archive: Archive) -> Any:
+        """Returns a writable stream transferring the given archive while it
+        is written, or None if the target can't transfer streams.
+
+        """
+        return None
+
+    def open_archive(self, archive: Archive) -> BinaryIO:
+        """Returns a readable stream of the given archive at the target."""
+        raise NotImplementedError(f"{self.label} can't read archives")
+
+    def thin_out_partitions(
+        self, label: str, obsolete: set[str], dry: bool = False
+    ) -> Any:
+        """Deletes the given partition archives (by filename) of the given
+        label if the target stores them (not supported by default).
+
+        """
+        return None
+
+    def thinning_marker(self, label: str) -> str | None:
+        """Returns the strategy of the last complete thinning of the
+        archives of the given label (None if not recorded).
+
+        """
+        return None
+
+    def mark_thinning(self, label: str, strategy: str) -> None:
+        """Records a complete thinning of the archives of the given label
+        with the given strategy (not recorded by default: each thinning
+        looks at all archives).
+
+        """
+
+    @reporter_check_result
+    def restore_archive(
+        self, archive: Archive, root: Path, subtree: str | None = None
+    ) -> RestoreResult:
+        """Restores the given archive into root while it is read from the
+        target (with a subtree only the entries inside the subtree).
+
+        The partitions listed in the manifest of the archive are restored
+        from their archives if they overlap the subtree, the others are
+        not read at all.
+
+        The unchanged files of an incremental archive are restored from the
+        earlier archives holding them. The restore fails if one of these
+        archives is missing at the target or lacks a file.
+
+        """
+        with self.open_archive(archive) as f:
+            result, partitions, references = extract_archive(f, root, subtree)
+
+        files, size, restored = result.files, result.size, 0
+        for path, filename in partitions.items():
+            if not overlaps(path, subtree):
+                continue
+            partarchive = PartitionArchive.fromfilename(filename, path)
+            with self.open_archive(partarchive) as f:
+                result, _, _ = extract_archive(f, root, subtree, members=False)
+            files, size, restored = (
+                files + result.files,
+                size + result.size,
+                restored + 1,
+            )
+
+        if references:
+            available = {a.name: a for a in self.list_archives(archive.label)}
+            missing = sorted(set(references) - set(available))
+            if missing:
+                raise RestoreError(
+                    archive.name,
+                    f"archives referenced by '{archive.name}' not found:"
+                    f" {', '.join(missing)}",
+                )
+        for name, names in sorted(references.items()):
+            with self.open_archive(available[name]) as f:
+                result, _, _ = extract_archive(
+                    f, root, subtree, members=False, names=names
+                )
+            if result.files < len(names):
+                raise RestoreError(
+                    archive.name,
+                    f"{len(names) - result.files} files referenced by"
+                    f" '{archive.name}' missing in '{name}'",
+                )
+            files, size = files + result.files, size + result.size
+        return RestoreResult(files, size, restored, len(references))
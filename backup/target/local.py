@@ -0,0 +1,339 @@
+"""
+Keep backup archives in a directory of the local filesystem.
+
+##        #######   ######     ###    ##
+##       ##     ## ##    ##   ## ##   ##
+##       ##     ## ##        ##   ##  ##
+##       ##     ## ##       ##     ## ##
+##       ##     ## ##       ######### ##
+##       ##     ## ##    ## ##     ## ##
+########  #######   ######  ##     ## ########
+"""
+
+import datetime
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from collections import namedtuple
+from collections.abc import Callable
+from pathlib import Path
+from typing import BinaryIO, override
+
+import humanfriendly
+
+from backup.archive import Archive
+from backup.partition import PartitionArchive
+from backup.reporter import reporter_check_result
+from backup.target._base import Target
+from backup.utils import formatkv
+
+# name of the cached index of the archives in the directory, the index is
+# rebuilt from a listing when it is older than this (in seconds)
+INDEX_FILENAME = ".sitebackup-index.json"
+INDEX_MAX_AGE = 7 * 24 * 60 * 60
+
+# methods of transferring an archive into the directory
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+COPY = "copy"
+
+# ioctl sharing the extents of a file with another file (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+# size of blocks copied at once by the kernel
+COPY_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+class LocalError(Exception):
+    """Base Exception for errors while using a local directory."""
+
+    def __init__(self, target, message):
+        super().__init__()
+        self.target = target
+        self.message = message
+
+    def __str__(self):
+        return f"LocalError({self.message!r})"
+
+
+class LocalResult(namedtuple("Result", ["size", "duration", "method"])):
+    """Class for results of local transfers with proper formatting."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        duration = humanfriendly.format_timespan(self.duration)
+        return f"Result(size={size}, duration={duration}, method={self.method})"
+
+
+class LocalThinningResult(
+    namedtuple("ThinningResult", ["archivesRetained", "archivesDeleted"])
+):
+    """Class for results of local thinning operations with proper formatting."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return (
+            f"Result(retained={self.archivesRetained}, deleted={self.archivesDeleted})"
+        )
+
+
+class LocalTarget(Target):
+    """Class keeping archives in a directory of the local filesystem.
+
+    Archives are hardlinked into the directory if it is on the same
+    filesystem, otherwise they are cloned if the filesystem supports
+    reflinks or copied by the kernel.
+
+    The names of the archives are cached in an index file in the
+    directory. The index is only rebuilt if the directory was changed by
+    someone else (its modification time differs from the one recorded)
+    or after INDEX_MAX_AGE, so a directory with tens of thousands of
+    archives is not listed on each run.
+
+    """
+
+    def __init__(self, path: Path, label: str = "Local") -> None:
+        super().__init__()
+
+        if not path.is_dir():
+            raise LocalError(self, f"directory '{path}' not found")
+
+        self.path = path
+
+        self.label = label
+        self.description = f"{self.label} Directory {self.path}"
+
+        # the index as last read or written
+        self.index: dict | None = None
+
+    def __str__(self):
+        return formatkv([("Local(Path)", self.path)], title="LOCAL")
+
+    def index_path(self) -> Path:
+        return self.path / INDEX_FILENAME
+
+    def read_index(self) -> list[str]:
+        """Returns the names of the archive files in the directory."""
+        mtime = self.path.stat().st_mtime_ns
+        if self.index is None or self.index["mtime"] != mtime:
+            try:
+                with open(self.index_path()) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = None
+
+        index = self.index
+        if (
+            not isinstance(index, dict)
+            or index.get("mtime") != mtime
+            or time.time() - index.get("listed", 0) >= INDEX_MAX_AGE
+            or not isinstance(index.get("names"), list)
+        ):
+            with os.scandir(self.path) as entries:
+                names = sorted(
+                    entry.name
+                    for entry in entries
+                    if entry.name.endswith(".tgz") and entry.is_file()
+                )
+            logging.info("rebuild index of '%s' (%d archives)", self.path, len(names))
+            self.write_index(names, listed=time.time())
+        assert self.index is not None
+        return self.index["names"]
+
+    def write_index(self, names: list[str], listed: float | None = None) -> None:
+        """Writes the given names of archive files as index.
+
+        The index file is rewritten in place: only creating it changes the
+        directory, so its modification time is taken afterwards.
+
+        """
+        if listed is None:
+            listed = self.index["listed"] if self.index else time.time()
+        path = self.index_path()
+        try:
+            path.touch()
+            index = {
+                "mtime": self.path.stat().st_mtime_ns,
+                "listed": listed,
+                "names": sorted(names),
+            }
+            with open(path, "w") as f:
+                json.dump(index, f)
+            self.index = index
+        except OSError as e:
+            logging.warning("can't write index of '%s': %s", self.path, e)
+            self.index = None
+
+    @override
+    def list_archives(
+        self, label: str | None = None, since: datetime.datetime | None = None
+    ) -> list[Archive]:
+        """Returns the archives in the directory (with the given label and
+        not older than since).
+
+        """
+        try:
+            names = self.read_index()
+        except OSError as e:
+            raise LocalError(self, f"can't list '{self.path}': {e}") from e
+
+        archives = []
+        for name in names:
+            if label and not name.startswith(f"{label}-"):
+                continue
+            if PartitionArchive.is_partition(name):
+                continue
+            try:
+                archive = Archive.fromfilename(name, check_label=label)
+            except ValueError:
+                continue
+            if not since or archive.ctime >= since:
+                archive.path = str(self.path)
+                archives.append(archive)
+        return archives
+
+    @override
+    def contains_archive(self, archive: Archive) -> bool:
+        """Returns True if the given archive is stored in the directory."""
+        return (self.path / archive.filename).is_file()
+
+    @override
+    def open_archive(self, archive: Archive) -> BinaryIO:
+        return open(self.path / archive.filename, "rb")
+
+    @override
+    @reporter_check_result
+    def transfer_archive(self, archive: Archive, dry: bool = False):
+        """Transfers the given archive into the directory.
+
+        Returns the size, duration and method of the transfer.
+
+        """
+        if dry:
+            return LocalResult(0, 0, None)
+
+        source = Path(archive.tarname())
+        destination = self.path / archive.filename
+        try:
+            names = self.read_index()
+            stime = time.monotonic()
+            size = source.stat().st_size
+            if destination.exists() and destination.samefile(source):
+                method = None
+            else:
+                method = self.copy(source, destination)
+            self.write_index([*names, archive.filename])
+            return LocalResult(size, time.monotonic() - stime, method)
+        except OSError as e:
+            raise LocalError(self, f"can't transfer '{archive.filename}': {e}") from e
+
+    def copy(self, source: Path, destination: Path) -> str:
+        """Copies source to destination by the cheapest method available.
+
+        Returns the method used.
+
+        """
+        tmp = destination.with_name(f".{destination.name}.tmp")
+        tmp.unlink(missing_ok=True)
+        try:
+            try:
+                os.link(source, tmp)
+                method = HARDLINK
+            except OSError as e:
+                if e.errno not in (
+                    errno.EXDEV,
+                    errno.EPERM,
+                    errno.EMLINK,
+                    errno.ENOTSUP,
+                ):
+                    raise
+                with open(source, "rb") as fsrc, open(tmp, "wb") as fdst:
+                    try:
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                        method = REFLINK
+                    except OSError:
+                        method = COPY
+                        try:
+                            while os.copy_file_range(
+                                fsrc.fileno(), fdst.fileno(), COPY_BLOCK_SIZE
+                            ):
+                                pass
+                        except OSError:
+                            # not supported between these filesystems
+                            fsrc.seek(0)
+                            fdst.seek(0)
+                            fdst.truncate()
+                            shutil.copyfileobj(fsrc, fdst, COPY_BLOCK_SIZE)
+                    os.fsync(fdst.fileno())
+            os.replace(tmp, destination)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return method
+
+    @override
+    @reporter_check_result
+    def perform_thinning(
+        self,
+        label: str,
+        thin_archives: Callable,
+        dry: bool = False,
+        since: datetime.datetime | None = None,
+    ):
+        """Deletes obsolete archives from the directory.
+
+        Collects all archives in the directory (not older than since) and
+        decides which archives to keep according the given strategy. Then
+        deletes the obsolete archives.
+
+        """
+        try:
+            names = self.read_index()
+            archives = self.list_archives(label, since=since)
+
+            to_retain, to_delete = thin_archives(archives)
+
+            if not dry:
+                for archive in to_delete:
+                    (self.path / archive.filename).unlink(missing_ok=True)
+                deleted = {archive.filename for archive in to_delete}
+                self.write_index([name for name in names if name not in deleted])
+            return LocalThinningResult(len(to_retain), len(to_delete))
+
+        except OSError as e:
+            raise LocalError(self, f"can't thin out '{self.path}': {e}") from e
+
+    @override
+    @reporter_check_result
+    def thin_out_partitions(
+        self, label: str, obsolete: set[str], dry: bool = False
+    ) -> LocalThinningResult:
+        """Deletes the given partition archives (by filename) of the given
+        label from the directory.
+
+        """
+        try:
+            names = self.read_index()
+            partitions = [
+                name
+                for name in names
+                if PartitionArchive.is_partition(name)
+                and PartitionArchive.fromfilename(name, "").label == label
+            ]
+            to_delete = [name for name in partitions if name in obsolete]
+
+            if not dry:
+                for name in to_delete:
+                    (self.path / name).unlink(missing_ok=True)
+                self.write_index([name for name in names if name not in to_delete])
+            return LocalThinningResult(len(partitions) - len(to_delete), len(to_delete))
+
+        except OSError as e:
+            raise LocalError(self, f"can't thin out '{self.path}': {e}") from e
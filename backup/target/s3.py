@@ -10,26 +10,46 @@ Transfer a backup archive to a cloud service using the S3 API.
    ##    ##     ## ##     ##  ######   ########    ##                ######   #######
 """
 
+import base64
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
 import os
+import random
 import socket
-import sys
+import tarfile
+import threading
 import time
-from collections import namedtuple
-from collections.abc import Callable
+import urllib.parse
+import uuid
+import zlib
+from collections import deque, namedtuple
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 from typing import override
 
 import boto3
 import humanfriendly
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import (
+    BotoCoreError,
     ClientError,
     EndpointConnectionError,
     NoCredentialsError,
     SSLError,
 )
 
-from backup.archive import Archive
+from backup.archive import Archive, ArchiveChecksums
+from backup.partition import PartitionArchive
+from backup.progress import STALL_THRESHOLD, Progress
 from backup.reporter import reporter_check_result
 from backup.target._base import Target
+from backup.thinning import ThinOutStrategy
 from backup.utils import formatkv
 
 
@@ -45,43 +65,480 @@ class S3Error(Exception):
         return f"S3Error({self.message!r})"
 
 
-class S3Result(namedtuple("Result", ["size", "duration"])):
-    """Class for results of s3 operations with proper formatting."""
+class S3Result(
+    namedtuple(
+        "Result",
+        ["size", "duration", "throughput", "stall"],
+        defaults=[0, 0],
+    )
+):
+    """Class for results of s3 operations with proper formatting.
+
+    The stall is the longest time in seconds without progress.
+
+    """
 
     __slots__ = ()
 
     def __str__(self):
         size = humanfriendly.format_size(self.size)
         duration = humanfriendly.format_timespan(self.duration)
-        return f"Result(size={size}, duration={duration})"
+        throughput = humanfriendly.format_size(self.throughput)
+        out = f"size={size}, duration={duration}, throughput={throughput}/s"
+        if self.stall >= STALL_THRESHOLD:
+            out += f", stall={humanfriendly.format_timespan(self.stall)}"
+        return f"Result({out})"
+
+
+class S3Tuning(
+    namedtuple(
+        "Tuning",
+        ["chunksize", "concurrency", "pool_connections", "io_chunksize"],
+        defaults=[8 * 1024**2, 10, None, 256 * 1024],
+    )
+):
+    """Class for the settings of multipart transfers.
+
+    The defaults are the defaults of boto3. Without a given number of pool
+    connections there will be one connection for each thread (at least
+    ten, the default of botocore).
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return (
+            f"Tuning(chunksize={humanfriendly.format_size(self.chunksize)},"
+            f" concurrency={self.concurrency},"
+            f" pool_connections={self.max_pool_connections},"
+            f" io_chunksize={humanfriendly.format_size(self.io_chunksize)})"
+        )
+
+    @property
+    def max_pool_connections(self) -> int:
+        return self.pool_connections or max(self.concurrency, 10)
+
+    def transfer_config(self) -> TransferConfig:
+        return TransferConfig(
+            multipart_threshold=self.chunksize,
+            multipart_chunksize=self.chunksize,
+            max_concurrency=self.concurrency,
+            io_chunksize=self.io_chunksize,
+        )
+
+
+# settings tried by a calibration: chunk sizes and numbers of threads (the
+# probe holds enough parts to keep all threads busy)
+CALIBRATION_CANDIDATES = [
+    S3Tuning(8 * 1024**2, 2),
+    S3Tuning(8 * 1024**2, 4),
+    S3Tuning(8 * 1024**2, 8),
+    S3Tuning(16 * 1024**2, 4),
+]
+CALIBRATION_PROBE_SIZE = 64 * 1024**2
+# bytes a calibration uploads at most, further candidates are skipped
+CALIBRATION_BUDGET = 256 * 1024**2
+CALIBRATION_MAX_AGE = 30 * 24 * 60 * 60
+
+# maximum number of keys per request to delete objects
+DELETE_BATCH_SIZE = 1000
+
+# attempts and initial delay in seconds (doubled per attempt) for each part
+PART_ATTEMPTS = 5
+PART_BACKOFF = 1.0
+
+# multipart uploads of our labels older than this (in seconds) are aborted
+STALE_UPLOAD_AGE = 24 * 60 * 60
+
+# size of parts copied server-side (a single copy is limited to 5 GiB)
+COPY_PART_SIZE = 128 * 1024**2
+
+# layouts of keys: archives at the root of the bucket or below the label,
+# the year and the month of their timestamp
+FLAT = "flat"
+DATED = "dated"
+
+# the catalog of a label is repaired from a listing when it is older than
+# this (in seconds), concurrent updates are retried this often
+CATALOG_MAX_AGE = 7 * 24 * 60 * 60
+CATALOG_ATTEMPTS = 3
+
+# tag of archives expired by lifecycle rules of the bucket: its value is
+# the label and the retention tier of the archive
+RETENTION_TAG = "sitebackup-retention"
+
+# retention tier of archives kept forever, other tiers name the days after
+# which the archives expire (e.g. "8d")
+YEARLY = "yearly"
+
+# days the lifecycle rules may fall behind before an archive is overdue
+LIFECYCLE_GRACE = 2
+
+# levels of verification after a transfer: size and ETag of the object,
+# additionally random byte ranges compared with the local file, or the whole
+# object read, decompressed and compared with the digest of the archive
+VERIFY_ETAG = "etag"
+VERIFY_SAMPLE = "sample"
+VERIFY_FULL = "full"
+
+# sampled ranges cost at most this fraction of the archive (but each range
+# is at least SAMPLE_MIN_SIZE and at most SAMPLE_MAX_SIZE bytes)
+SAMPLE_FRACTION = 0.01
+SAMPLE_MIN_SIZE = 4 * 1024
+SAMPLE_MAX_SIZE = 1024**2
 
 
 class S3ThinningResult(
-    namedtuple("ThinningResult", ["archivesRetained", "archivesDeleted"])
+    namedtuple(
+        "ThinningResult",
+        [
+            "archivesRetained",
+            "archivesDeleted",
+            "errors",
+            "archivesExpiring",
+            "archivesOverdue",
+        ],
+        defaults=[(), 0, 0],
+    )
 ):
-    """Class for results of s3 thinning operations with proper formatting."""
+    """Class for results of s3 thinning operations with proper formatting.
+
+    The errors are pairs of key and message for archives not deleted.
+    Expiring archives are left to the lifecycle rules of the bucket,
+    overdue archives should have been expired by them already.
+
+    """
 
     __slots__ = ()
 
     def __str__(self):
+        out = f"retained={self.archivesRetained}, deleted={self.archivesDeleted}"
+        if self.archivesExpiring:
+            out += f", expiring={self.archivesExpiring}"
+        if self.archivesOverdue:
+            out += f", overdue={self.archivesOverdue}"
+        if self.errors:
+            errors = ", ".join(f"{key}: {message}" for key, message in self.errors)
+            out += f", errors=[{errors}]"
+        return f"Result({out})"
+
+
+class S3ReplicaResult(
+    namedtuple("ReplicaResult", ["bucket", "size", "duration", "parts"])
+):
+    """Class for results of server-side copies with proper formatting."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        duration = humanfriendly.format_timespan(self.duration)
         return (
-            f"Result(retained={self.archivesRetained}, deleted={self.archivesDeleted})"
+            f"Result(bucket={self.bucket}, size={size},"
+            f" duration={duration}, parts={self.parts})"
         )
 
 
+class S3Download:
+    """Readable stream of an object downloaded with concurrent ranged GETs.
+
+    Parts of the chunksize are fetched by concurrency threads ahead of the
+    reader and handed out in order. At most twice concurrency parts are
+    buffered: if the reader falls behind, no further parts are fetched.
+    Each part is retried with exponential backoff. At the end the SHA-256
+    digest of the data is compared with the digest stored with the object
+    (if any).
+
+    """
+
+    def __init__(self, s3: "S3", key: str, size: int, sha256: str | None = None):
+        self.s3 = s3
+        self.key = key
+        self.size = size
+        self.sha256 = sha256
+        self.chunksize = s3.tuning.chunksize
+
+        self.executor = ThreadPoolExecutor(max_workers=s3.tuning.concurrency)
+        self.window = 2 * s3.tuning.concurrency
+        self.futures: deque[Future] = deque()
+        self.offset = 0
+        self.buffer = memoryview(b"")
+        self.hash = hashlib.sha256()
+        self.progress = Progress(f"{s3.label} {key}", size)
+        self._schedule()
+
+    def __enter__(self) -> "S3Download":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+
+    def _schedule(self) -> None:
+        while len(self.futures) < self.window and self.offset < self.size:
+            length = min(self.chunksize, self.size - self.offset)
+            self.futures.append(self.executor.submit(self._get, self.offset, length))
+            self.offset += length
+
+    def _get(self, offset: int, length: int) -> bytes:
+        attempt, delay = 1, PART_BACKOFF
+        while True:
+            try:
+                response = self.s3.s3_client.get_object(
+                    Bucket=self.s3.bucket,
+                    Key=self.key,
+                    Range=f"bytes={offset}-{offset + length - 1}",
+                )
+                data = response["Body"].read()
+                if len(data) != length:
+                    raise OSError(f"got {len(data)} of {length} bytes")
+                self.progress.update(length)
+                return data
+            except (BotoCoreError, ClientError, OSError) as e:
+                if attempt >= PART_ATTEMPTS:
+                    raise
+                logging.warning(
+                    "bytes %d+%d of '%s' failed (%s), retry in %.1fs",
+                    offset,
+                    length,
+                    self.key,
+                    e,
+                    delay,
+                )
+                time.sleep(delay)
+                attempt, delay = attempt + 1, delay * 2
+
+    def read(self, size: int = -1) -> bytes:
+        out = bytearray()
+        while size < 0 or len(out) < size:
+            if not self.buffer:
+                if not self.futures:
+                    self._verify()
+                    break
+                try:
+                    self.buffer = memoryview(self.futures.popleft().result())
+                except (BotoCoreError, ClientError, OSError) as e:
+                    raise S3Error(self.s3, repr(e)) from e
+                self.hash.update(self.buffer)
+                self._schedule()
+            n = len(self.buffer) if size < 0 else min(size - len(out), len(self.buffer))
+            out += self.buffer[:n]
+            self.buffer = self.buffer[n:]
+        return bytes(out)
+
+    def _verify(self) -> None:
+        if self.sha256 and self.hash.hexdigest() != self.sha256:
+            raise S3Error(self.s3, f"SHA-256 of '{self.key}' doesn't match")
+        self.sha256 = None
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+        self.progress.finish()
+
+
+class S3VerifyResult(
+    namedtuple("VerifyResult", ["level", "size", "checked", "duration"])
+):
+    """Class for results of verifications with proper formatting.
+
+    Checked is the number of bytes read back from the cloud service.
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        checked = humanfriendly.format_size(self.checked)
+        duration = humanfriendly.format_timespan(self.duration)
+        return (
+            f"Result(level={self.level}, size={size},"
+            f" checked={checked}, duration={duration})"
+        )
+
+
+class S3Stream:
+    """Writable stream uploading an archive to the cloud service while it
+    is written.
+
+    The data is cut into parts of the chunksize which are uploaded by
+    concurrency threads. At most concurrency parts are buffered: if the
+    uploads fall behind, writes block until a buffer is free again. Data
+    smaller than one part is uploaded as a single object on close.
+
+    A failing upload is aborted and doesn't interrupt the writer (which
+    may feed other streams as well): further data is dropped and the error
+    is reported by the transfer of the archive.
+
+    """
+
+    def __init__(self, s3: "S3", key: str, tagging: dict | None = None) -> None:
+        self.s3 = s3
+        self.key = key
+        self.tagging = tagging or {}
+        self.chunksize = s3.tuning.chunksize
+
+        self.buffer = bytearray()
+        self.slots = threading.Semaphore(s3.tuning.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=s3.tuning.concurrency)
+        self.futures: list[Future] = []
+        self.digests: list[bytes] = []
+        self.upload_id: str | None = None
+        self.error: BaseException | None = None
+
+        # the progress of the archive is displayed by its writer
+        self.size = 0
+        self.progress = Progress(f"{s3.label} {key}", quiet=True)
+        self.result: S3Result | None = None
+
+    def write(self, data: bytes) -> int:
+        if self.error:
+            return len(data)
+        self.buffer += data
+        self.size += len(data)
+        try:
+            while len(self.buffer) >= self.chunksize and not self.error:
+                self._submit(bytes(self.buffer[: self.chunksize]))
+                del self.buffer[: self.chunksize]
+        except (BotoCoreError, ClientError, OSError) as e:
+            self.fail(e)
+        if self.error:
+            self.abort()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _submit(self, data: bytes) -> None:
+        if self.upload_id is None:
+            response = self.s3.s3_client.create_multipart_upload(
+                Bucket=self.s3.bucket, Key=self.key, **self.tagging
+            )
+            self.upload_id = response["UploadId"]
+
+        # backpressure: wait until a buffer is free
+        self.slots.acquire()
+        digest = hashlib.md5(data, usedforsecurity=False).digest()
+        self.digests.append(digest)
+        number = len(self.digests)
+        self.futures.append(self.executor.submit(self._upload, number, data, digest))
+
+    def _upload(self, number: int, data: bytes, digest: bytes) -> str:
+        try:
+            assert self.upload_id is not None
+            etag = self.s3._upload_part(self.upload_id, self.key, number, data, digest)
+            self.progress.update(len(data))
+            return etag
+        except BaseException as e:
+            self.fail(e)
+            raise
+        finally:
+            self.slots.release()
+
+    def fail(self, error: BaseException) -> None:
+        if self.error is None:
+            logging.warning(
+                "%s: upload of '%s' failed: %r", self.s3.label, self.key, error
+            )
+            self.error = error
+
+    def close(self) -> None:
+        """Uploads the remaining data and completes the upload.
+
+        The ETag of the uploaded object is verified, a corrupted object is
+        deleted again.
+
+        """
+        if self.error:
+            self.abort()
+            return
+        try:
+            if self.upload_id is None:
+                digest = hashlib.md5(self.buffer, usedforsecurity=False).digest()
+                response = self.s3.s3_client.put_object(
+                    Bucket=self.s3.bucket,
+                    Key=self.key,
+                    Body=bytes(self.buffer),
+                    ContentMD5=base64.b64encode(digest).decode(),
+                    **self.tagging,
+                )
+                self.progress.update(len(self.buffer))
+                expected = digest.hex()
+            else:
+                if self.buffer:
+                    self._submit(bytes(self.buffer))
+                etags = [future.result() for future in self.futures]
+                response = self.s3.s3_client.complete_multipart_upload(
+                    Bucket=self.s3.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={
+                        "Parts": [
+                            {"PartNumber": number, "ETag": etag}
+                            for number, etag in enumerate(etags, start=1)
+                        ]
+                    },
+                )
+                digest = hashlib.md5(b"".join(self.digests), usedforsecurity=False)
+                expected = f"{digest.hexdigest()}-{len(self.digests)}"
+            self.buffer.clear()
+
+            etag = response["ETag"].strip('"')
+            if etag != expected:
+                self.s3.s3_client.delete_object(Bucket=self.s3.bucket, Key=self.key)
+                raise S3Error(
+                    self.s3, f"ETag of '{self.key}' is {etag}, expected {expected}"
+                )
+
+        except (BotoCoreError, ClientError, OSError, S3Error) as e:
+            self.fail(e)
+            self.abort()
+            return
+        finally:
+            self.executor.shutdown()
+
+        counters = self.progress.finish()
+        self.result = S3Result(
+            self.size,
+            int(counters.duration),
+            counters.throughput,
+            counters.stall,
+        )
+
+    def abort(self) -> None:
+        """Cancels the upload: the parts uploaded so far are discarded."""
+        self.executor.shutdown(cancel_futures=True)
+        self.s3._abort_upload(self.key, self.upload_id)
+        self.upload_id = None
+        self.buffer.clear()
+
+
 class S3(Target):
     """Class using a cloud service with the S3 API to transfer an archive.
 
     To use initialize with the configuration of a compatible cloud service
     and call transferArchive with an archive object.
 
-    If stdout is bound to a console a progress indicator will be displayed.
+    If stderr is bound to a console the progress of uploads is displayed.
 
     Uses the reporter mixin and decorators to generate a results report.
 
     """
 
-    def __init__(self, host, accesskey, secretkey, bucket, port=None, is_secure=True):
+    def __init__(
+        self,
+        host,
+        accesskey,
+        secretkey,
+        bucket,
+        port=None,
+        is_secure=True,
+        tuning: S3Tuning | None = None,
+        label: str = "S3",
+        replicas: list[str] | None = None,
+        layout: str = FLAT,
+        lifecycle: ThinOutStrategy | None = None,
+    ):
         super().__init__()
 
         self.host = host
@@ -90,7 +547,7 @@ class S3(Target):
         self.secretkey = secretkey
         self.bucket = bucket
 
-        self.label = "S3"
+        self.label = label
         self.description = f"{self.label} Service at {self.host}"
 
         # Configure endpoint URL for custom S3-compatible services
@@ -98,75 +555,455 @@ class S3(Target):
             endpoint_url = f"{'https' if is_secure else 'http'}://{host}:{port}"
         else:
             endpoint_url = f"{'https' if is_secure else 'http'}://{host}"
+        self.endpoint_url = endpoint_url
+        self.is_secure = is_secure
 
-        # Initialize boto3 client
-        self.s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=self.accesskey,
-            aws_secret_access_key=self.secretkey,
-            endpoint_url=endpoint_url,
-            use_ssl=is_secure,
-        )
+        # layout of the keys of new archives (archives are found in any layout)
+        self.layout = layout
+
+        # buckets at the same service each archive is copied to
+        self.replicas = replicas or []
+
+        # strategy whose retention is left to lifecycle rules of the bucket
+        # and the retention tiers of new archives
+        self.lifecycle = lifecycle
+        self.tiers: dict[str, str] = {}
+
+        # streams of archives uploaded while they are written
+        self.streams: dict[str, S3Stream] = {}
+
+        # level of verification after each transfer and number of ranges
+        # sampled (no verification if None)
+        self.verification: str | None = None
+        self.samples = 8
+
+        self.tune(tuning or S3Tuning())
 
     def __str__(self):
         return formatkv(
             [
                 ("S3(Host)", self.host),
                 ("S3(Bucket)", self.bucket),
+                *[("S3(Replica)", bucket) for bucket in self.replicas],
+                ("S3(Tuning)", self.tuning),
             ],
             title="S3",
         )
 
-    def boto_progress_start(self):
-        self.progress_stime = 0
-        self.progress_etime = 0
+    def tune(self, tuning: S3Tuning) -> None:
+        """Applies the given settings for transfers."""
+        self.tuning = tuning
+        self.partsize = tuning.chunksize
+        self.transfer_config = tuning.transfer_config()
 
-    def boto_progress_duration(self):
-        return int(self.progress_etime - self.progress_stime)
+        # Initialize boto3 client
+        self.s3_client = boto3.client(
+            "s3",
+            aws_access_key_id=self.accesskey,
+            aws_secret_access_key=self.secretkey,
+            endpoint_url=self.endpoint_url,
+            use_ssl=self.is_secure,
+            config=Config(max_pool_connections=tuning.max_pool_connections),
+        )
+
+    def calibrate(
+        self,
+        statedir: Path | None = None,
+        candidates: list[S3Tuning] | None = None,
+        probe_size: int = CALIBRATION_PROBE_SIZE,
+    ) -> S3Tuning:
+        """Applies the settings with the best throughput for this endpoint.
+
+        Each candidate is tried by uploading a probe object, as long as
+        the uploads stay within CALIBRATION_BUDGET. The probe object and
+        uploads of it left behind are removed afterwards, even if the
+        calibration fails. If a state directory is given, the result is
+        cached per endpoint and reused for CALIBRATION_MAX_AGE seconds.
+
+        """
+        cache = Path(statedir) / "s3-tuning.json" if statedir else None
+        results = {}
+        if cache and cache.is_file():
+            with open(cache) as f:
+                results = json.load(f)
+        cached = results.get(self.endpoint_url)
+        if cached and time.time() - cached["time"] < CALIBRATION_MAX_AGE:
+            tuning = S3Tuning(**cached["tuning"])
+            logging.info("using cached %s for '%s'", tuning, self.endpoint_url)
+            self.tune(tuning)
+            return tuning
+
+        probe = os.urandom(probe_size)
+        key = f".sitebackup-probe-{uuid.uuid4().hex}"
+        best, best_throughput = None, 0.0
+        uploaded = 0
+        try:
+            for tuning in candidates or CALIBRATION_CANDIDATES:
+                if best is not None and uploaded + probe_size > CALIBRATION_BUDGET:
+                    logging.warning("calibration: %s skipped (budget)", tuning)
+                    continue
+                uploaded += probe_size
+                self.tune(tuning)
+                stime = time.monotonic()
+                self.s3_client.upload_fileobj(
+                    io.BytesIO(probe), self.bucket, key, Config=self.transfer_config
+                )
+                throughput = probe_size / max(time.monotonic() - stime, 1e-6)
+                logging.info(
+                    "calibration: %s: %s/s",
+                    tuning,
+                    humanfriendly.format_size(throughput),
+                )
+                if throughput > best_throughput:
+                    best, best_throughput = tuning, throughput
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+        finally:
+            self._remove_probe(key)
+
+        assert best is not None, "no candidates given"
+        self.tune(best)
+        if cache:
+            results[self.endpoint_url] = {
+                "tuning": best._asdict(),
+                "throughput": best_throughput,
+                "time": time.time(),
+            }
+            tmp = cache.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(results, f, indent=2)
+            os.replace(tmp, cache)
+        return best
+
+    def _remove_probe(self, key: str) -> None:
+        """Deletes the probe object of a calibration and aborts the uploads
+        of it left behind by a failure.
+
+        """
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+            response = self.s3_client.list_multipart_uploads(
+                Bucket=self.bucket, Prefix=key
+            )
+            for upload in response.get("Uploads", []):
+                self._abort_upload(upload["Key"], upload["UploadId"])
+        except (BotoCoreError, ClientError) as e:
+            logging.warning("%s: can't remove probe '%s': %r", self.label, key, e)
+
+    def layout_key(self, archive: Archive) -> str:
+        """Returns the key of the given archive in the configured layout."""
+        if self.layout == DATED and not isinstance(archive, PartitionArchive):
+            year, month = archive.timestamp[:4], archive.timestamp[4:6]
+            return f"{archive.label}/{year}/{month}/{archive.filename}"
+        return archive.filename
+
+    def object_key(self, archive: Archive) -> str:
+        """Returns the key of the given archive in the bucket: the key it
+        was listed with or its key in the configured layout.
 
-    def boto_progress(self, complete, total):
-        """Progress handler for boto library.
+        """
+        key = getattr(archive, "key", None)
+        return key if isinstance(key, str) else self.layout_key(archive)
+
+    def _archive(self, key: str, label: str | None = None) -> Archive:
+        archive = Archive.fromfilename(os.path.basename(key), check_label=label)
+        archive.key = key
+        return archive
+
+    @override
+    def list_archives(
+        self, label: str | None = None, since: datetime.datetime | None = None
+    ) -> list[Archive]:
+        """Returns the archives in the bucket (with the given label and not
+        older than since).
 
-        Prints a progress indicator to the console.
+        With a label the archives are read from the catalog of the label.
+        If the catalog is missing or older than CATALOG_MAX_AGE, the bucket
+        is listed (only the months since the given date in the dated
+        layout) and the catalog is repaired from a complete listing.
 
-        If stdout is NOT bound to a console nothing will be displayed.
+        The catalog is a hint: archives past the expiration of their
+        retention tier are looked up, archives already expired by lifecycle
+        rules are left out and removed from the catalog.
 
         """
-        if sys.stdin.isatty():
-            if complete == 0:
-                self.progress_stime = time.monotonic()
-                sys.stdout.write("|" + "-" * 10 + "|")
-                sys.stdout.write("\n")
-                sys.stdout.write("|")
-            sys.stdout.write(".")
-            if complete == total:
-                self.progress_etime = time.monotonic()
-                sys.stdout.write("|")
-                sys.stdout.write("\n")
-                seconds = self.boto_progress_duration()
-                sys.stdout.write(f"{seconds} seconds")
-                sys.stdout.write("\n")
-            sys.stdout.flush()
+        if not label:
+            return list(self.iter_archives())
+
+        try:
+            catalog, etag = self.read_catalog(label)
+            if catalog and time.time() - catalog["listed"] < CATALOG_MAX_AGE:
+                archives, gone = [], []
+                for key in sorted(catalog["archives"], key=os.path.basename):
+                    archive = self._archive(key, label)
+                    if since and archive.ctime < since:
+                        continue
+                    tier = catalog["archives"][key].get("tier")
+                    if self.expired(archive, tier) and not self.contains_archive(
+                        archive
+                    ):
+                        gone.append(key)
+                        continue
+                    archives.append(archive)
+
+                if gone:
+                    logging.info("%d archives of '%s' expired", len(gone), label)
+
+                    def remove(entries):
+                        for key in gone:
+                            entries.pop(key, None)
+
+                    self.update_catalog(label, remove)
+                return archives
+
+            if since:
+                return [
+                    archive
+                    for archive, _ in self._iter_objects(label, since)
+                    if archive.ctime >= since
+                ]
+
+            archives, entries = [], {}
+            for archive, obj in self._iter_objects(label):
+                archives.append(archive)
+                entries[obj["Key"]] = {
+                    **(catalog or {"archives": {}})["archives"].get(obj["Key"], {}),
+                    "size": obj["Size"],
+                    "timestamp": archive.timestamp,
+                }
+            logging.info("repair catalog of '%s' (%d archives)", label, len(entries))
+            try:
+                self._write_catalog(
+                    label,
+                    {"label": label, "listed": time.time(), "archives": entries},
+                    etag,
+                )
+            except ClientError as e:
+                logging.warning("can't write catalog of '%s': %s", label, e)
+            return archives
+
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+
+    def catalog_key(self, label: str) -> str:
+        return f".sitebackup-catalog-{label}.json"
+
+    def thinning_key(self, label: str) -> str:
+        return f".sitebackup-thinning-{label}.json"
+
+    @override
+    def thinning_marker(self, label: str) -> str | None:
+        """Returns the strategy of the last complete thinning of the given
+        label as recorded in the bucket."""
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.thinning_key(label)
+            )
+            return json.loads(response["Body"].read())["strategy"]
+        except (BotoCoreError, ClientError, ValueError, KeyError, TypeError) as e:
+            logging.info("no complete thinning of '%s' recorded: %s", label, e)
+            return None
 
     @override
-    def list_archives(self, label: str | None = None) -> list[Archive]:
+    def mark_thinning(self, label: str, strategy: str) -> None:
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.thinning_key(label),
+                Body=json.dumps({"strategy": strategy, "thinned": time.time()}),
+                ContentType="application/json",
+            )
+        except (BotoCoreError, ClientError) as e:
+            logging.warning("can't record thinning of '%s': %s", label, e)
+
+    def read_catalog(self, label: str) -> tuple[dict | None, str | None]:
+        """Returns the catalog of the given label and its ETag.
+
+        The catalog is None if it is missing or corrupted, the ETag is None
+        if there is no catalog object at all.
+
+        """
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.catalog_key(label)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None, None
+            raise
+        try:
+            catalog = json.loads(response["Body"].read())
+            if not isinstance(catalog.get("archives"), dict):
+                raise ValueError("no archives")
+            return catalog, response["ETag"]
+        except (ValueError, AttributeError) as e:
+            logging.warning("catalog of '%s' is corrupted: %s", label, e)
+            return None, response["ETag"]
+
+    def _write_catalog(self, label: str, catalog: dict, etag: str | None) -> None:
+        """Writes the catalog of the given label if it is still the one with
+        the given ETag (or still missing).
+
+        Raises a ClientError with code PreconditionFailed otherwise.
+
+        """
+        parameters = {
+            "Bucket": self.bucket,
+            "Key": self.catalog_key(label),
+            "Body": json.dumps(catalog, sort_keys=True).encode(),
+            "ContentType": "application/json",
+        }
+        try:
+            if etag:
+                self.s3_client.put_object(**parameters, IfMatch=etag)
+            else:
+                self.s3_client.put_object(**parameters, IfNoneMatch="*")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NotImplemented":
+                raise
+            # conditional writes are not supported by the cloud service
+            self.s3_client.put_object(**parameters)
+
+    def update_catalog(self, label: str, update: Callable[[dict], None]) -> None:
+        """Applies the given update to the archives in the catalog of the
+        given label.
+
+        Concurrent updates are detected and retried. If the catalog can't
+        be updated, it is deleted: the next listing will repair it. Without
+        a catalog there is nothing to update.
+
+        """
         try:
-            archives = []
+            for _ in range(CATALOG_ATTEMPTS):
+                catalog, etag = self.read_catalog(label)
+                if catalog is None:
+                    return
+                update(catalog["archives"])
+                try:
+                    self._write_catalog(label, catalog, etag)
+                    return
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in (
+                        "PreconditionFailed",
+                        "ConditionalRequestConflict",
+                    ):
+                        raise
+            raise RuntimeError("too many concurrent updates")
+        except (BotoCoreError, ClientError, RuntimeError) as e:
+            logging.warning("can't update catalog of '%s': %s", label, e)
+            try:
+                self.s3_client.delete_object(
+                    Bucket=self.bucket, Key=self.catalog_key(label)
+                )
+            except (BotoCoreError, ClientError) as e:
+                logging.warning("can't delete catalog of '%s': %s", label, e)
+
+    def iter_archives(self, label: str | None = None) -> Iterator[Archive]:
+        """Yields the archives in the bucket (with the given label).
+
+        The bucket is listed page by page. With a label only the keys
+        starting with the label are listed by the cloud service. Keys not
+        written by this tool (or for another label) are skipped.
+
+        """
+        try:
+            for archive, _ in self._iter_objects(label):
+                yield archive
+
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
 
-            # List objects in the bucket
-            response = self.s3_client.list_objects_v2(Bucket=self.bucket)
+    def _iter_objects(
+        self, label: str | None = None, since: datetime.datetime | None = None
+    ) -> Iterator[tuple[Archive, dict]]:
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for prefix in self._prefixes(label, since):
+            parameters = {"Bucket": self.bucket}
+            if prefix:
+                parameters["Prefix"] = prefix
 
-            if "Contents" in response:
-                for obj in response["Contents"]:
+            for page in paginator.paginate(**parameters):
+                for obj in page.get("Contents", []):
+                    if PartitionArchive.is_partition(obj["Key"]):
+                        continue
+                    if label and obj["Key"][len(label) : len(label) + 1] not in "-/":
+                        continue
                     try:
-                        archive = Archive.fromfilename(obj["Key"], check_label=label)
+                        yield self._archive(obj["Key"], label), obj
                     except ValueError as e:
-                        raise S3Error(self, str(e)) from e
+                        logging.debug("skip foreign key '%s': %s", obj["Key"], e)
 
-                    if archive:
-                        archives.append(archive)
+    def _prefixes(
+        self, label: str | None, since: datetime.datetime | None = None
+    ) -> list[str]:
+        """Returns the prefixes to list the archives of the given label
+        (since the given date) in both layouts.
 
-            return archives
+        """
+        if not label:
+            return [""]
+        if not since:
+            return [label]
+
+        # months of the first year, whole years afterwards
+        today = datetime.date.today()
+        prefixes = [f"{label}-"]
+        last = today.month if since.year == today.year else 12
+        for month in range(since.month, last + 1):
+            prefixes.append(f"{label}/{since.year:04}/{month:02}/")
+        for year in range(since.year + 1, today.year + 1):
+            prefixes.append(f"{label}/{year:04}/")
+        return prefixes
+
+    def migrate_layout(self, label: str) -> int:
+        """Moves the archives of the given label into the configured layout
+        with server-side copies.
+
+        Returns the number of archives moved.
+
+        """
+        try:
+            moved = []
+            for archive, obj in list(self._iter_objects(label)):
+                key = self.layout_key(archive)
+                if obj["Key"] == key:
+                    continue
+                logging.info("move '%s' to '%s'", obj["Key"], key)
+                self.copy_object(obj["Key"], self.bucket, key, obj["Size"])
+                moved.append(obj["Key"])
+            errors = self.delete_keys(moved)
+            for key, message in errors:
+                logging.warning("can't delete '%s': %s", key, message)
+
+            # the catalog still lists the old keys: the next listing repairs it
+            self.s3_client.delete_object(
+                Bucket=self.bucket, Key=self.catalog_key(label)
+            )
+            return len(moved)
 
         except ClientError as e:
             raise S3Error(self, repr(e)) from e
@@ -178,46 +1015,176 @@ class S3(Target):
             raise S3Error(self, repr(e)) from e
         except socket.gaierror as e:
             raise S3Error(self, repr(e)) from e
+        except BotoCoreError as e:
+            raise S3Error(self, repr(e)) from e
+
+    @override
+    def contains_archive(self, archive: Archive) -> bool:
+        """Returns True if the given archive is stored at the cloud service."""
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.object_key(archive))
+            return True
+
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NoSuchBucket"):
+                return False
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+
+    def ensure_bucket(self, bucket: str | None = None) -> None:
+        """Creates the given (or the configured) bucket if it does not exist."""
+        bucket = bucket or self.bucket
+        try:
+            self.s3_client.head_bucket(Bucket=bucket)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "404":
+                # Bucket doesn't exist, create it
+                self.s3_client.create_bucket(Bucket=bucket)
+            else:
+                raise
+
+    @override
+    def open_stream(self, archive: Archive) -> S3Stream:
+        """Returns a stream uploading the given archive while it is written.
+
+        The result of the upload is reported by transfer_archive.
+
+        """
+        try:
+            self.ensure_bucket()
+            self.abort_stale_uploads(archive.label)
+            tagging = self.tagging(archive)
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+
+        stream = S3Stream(self, self.object_key(archive), tagging)
+        self.streams[archive.filename] = stream
+        return stream
 
     @override
-    @reporter_check_result
     def transfer_archive(self, archive: Archive, dry: bool = False):
-        """Transfers the given archive to the configured cloud service.
+        """Transfers the given archive to the configured cloud service and
+        copies it to the replica buckets.
+
+        Returns the result of the transfer. A failing copy doesn't stop the
+        copies to the other replicas, the first error is raised after all
+        copies.
 
-        If the configured bucket does not exist it will be created.
+        """
+        result = self._transfer_archive(archive, dry=dry)
+        if not dry and self.verification:
+            self.verify_archive(archive)
+        if not dry and not isinstance(archive, PartitionArchive):
+            checksums = getattr(archive, "checksums", None)
+            entry = {
+                "size": result.size,
+                "timestamp": archive.timestamp,
+                "sha256": (
+                    checksums.sha256
+                    if isinstance(checksums, ArchiveChecksums)
+                    else None
+                ),
+                "codec": "gzip",
+            }
+            if tier := self.tiers.get(archive.filename):
+                entry["tier"] = tier
+            self.update_catalog(
+                archive.label,
+                lambda archives: archives.__setitem__(self.object_key(archive), entry),
+            )
+        if not dry:
+            errors = []
+            for bucket in self.replicas:
+                try:
+                    self.replicate_archive(self.object_key(archive), bucket)
+                except S3Error as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+        return result
+
+    @reporter_check_result
+    def _transfer_archive(self, archive: Archive, dry: bool = False):
+        """Uploads the given archive to the configured cloud service.
+
+        If the configured bucket does not exist it will be created. If the
+        archive was streamed to the cloud service while it was written,
+        only the result of the upload is returned.
 
         Returns the size of the transferred file on success.
 
         """
-        try:
-            self.boto_progress_start()
+        stream = self.streams.pop(archive.filename, None)
+        if stream:
+            if stream.error:
+                raise S3Error(self, repr(stream.error)) from stream.error
+            if stream.result is None:
+                raise S3Error(self, f"upload of '{archive.filename}' not completed")
+            return stream.result
 
-            # Check if bucket exists, create if not
-            try:
-                self.s3_client.head_bucket(Bucket=self.bucket)
-            except ClientError as e:
-                if e.response["Error"]["Code"] == "404":
-                    # Bucket doesn't exist, create it
-                    self.s3_client.create_bucket(Bucket=self.bucket)
-                else:
-                    raise
+        try:
+            self.ensure_bucket()
 
             if not dry:
-                # Upload the file with progress callback
                 file_size = os.path.getsize(archive.filename)
 
-                def progress_callback(bytes_transferred):
-                    self.boto_progress(bytes_transferred, file_size)
+                self.abort_stale_uploads(archive.label)
+                checksums = self.archive_checksums(archive, file_size)
 
-                self.s3_client.upload_file(
-                    archive.filename,
-                    self.bucket,
-                    archive.filename,
-                    Callback=progress_callback,
+                # the callbacks report the bytes sent since the last call
+                progress = Progress(f"{self.label} {archive.filename}", file_size)
+                progress_callback = progress.update
+                if file_size > self.tuning.chunksize:
+                    self.multipart_upload(archive, progress_callback, checksums)
+                elif checksums:
+                    with open(archive.filename, "rb") as f:
+                        response = self.s3_client.put_object(
+                            Bucket=self.bucket,
+                            Key=self.object_key(archive),
+                            Body=f,
+                            ContentMD5=base64.b64encode(checksums.parts[0]).decode(),
+                            Metadata={"sha256": checksums.sha256},
+                            **self.tagging(archive),
+                        )
+                    self.verify_etag(
+                        self.object_key(archive), response["ETag"], checksums
+                    )
+                    progress_callback(file_size)
+                else:
+                    self.s3_client.upload_file(
+                        archive.filename,
+                        self.bucket,
+                        self.object_key(archive),
+                        Callback=progress_callback,
+                        Config=self.transfer_config,
+                        **(
+                            {"ExtraArgs": tagging}
+                            if (tagging := self.tagging(archive))
+                            else {}
+                        ),
+                    )
+                counters = progress.finish()
+                return S3Result(
+                    file_size,
+                    int(counters.duration),
+                    counters.throughput,
+                    counters.stall,
                 )
-
-                self.progress_etime = time.monotonic()
-                return S3Result(file_size, self.boto_progress_duration())
             else:
                 return S3Result(0, 0)
 
@@ -231,30 +1198,771 @@ class S3(Target):
             raise S3Error(self, repr(e)) from e
         except socket.gaierror as e:
             raise S3Error(self, repr(e)) from e
+        except BotoCoreError as e:
+            raise S3Error(self, repr(e)) from e
+
+    @override
+    def open_archive(self, archive: Archive) -> S3Download:
+        """Returns a stream downloading the given archive with concurrent
+        ranged GETs.
+
+        An archive deleted behind the back of the catalog is removed from
+        the catalog. The download is verified with the SHA-256 digest stored
+        with the object or, for streamed archives, in the catalog.
+
+        """
+        key = self.object_key(archive)
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            digest = self.stored_digest(archive, head)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey") and (
+                not isinstance(archive, PartitionArchive)
+            ):
+                self.update_catalog(
+                    archive.label, lambda archives: archives.pop(key, None)
+                )
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+        except BotoCoreError as e:
+            raise S3Error(self, repr(e)) from e
+        return S3Download(self, key, head["ContentLength"], digest)
+
+    def stored_digest(self, archive: Archive, head: dict) -> str | None:
+        """Returns the SHA-256 digest of the given archive from the metadata
+        of its object (as given by a HEAD request) or from the catalog.
+
+        Streamed archives are uploaded before their digest is known, only
+        the catalog holds it.
+
+        """
+        digest = head.get("Metadata", {}).get("sha256")
+        if digest or isinstance(archive, PartitionArchive):
+            return digest
+        catalog, _ = self.read_catalog(archive.label)
+        entry = (catalog or {"archives": {}})["archives"].get(
+            self.object_key(archive), {}
+        )
+        return entry.get("sha256")
+
+    @reporter_check_result
+    def verify_archive(self, archive: Archive) -> S3VerifyResult:
+        """Verifies the transferred archive at the configured level.
+
+        Size, ETag and the stored SHA-256 digest of the object are compared
+        with the archive. Sampling needs the local file of the archive,
+        without it only the ETag is verified. The level reached is reported.
+
+        """
+        key = self.object_key(archive)
+        checksums = getattr(archive, "checksums", None)
+        if not isinstance(checksums, ArchiveChecksums):
+            checksums = None
+        local = archive.filename if os.path.isfile(archive.filename) else None
+        try:
+            stime = time.monotonic()
+            head = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            size = head["ContentLength"]
+
+            expected = (
+                checksums.size
+                if checksums
+                else os.path.getsize(local) if local else None
+            )
+            if expected is not None and size != expected:
+                raise S3Error(self, f"size of '{key}' is {size}, expected {expected}")
+            if checksums and checksums.partsize == self.tuning.chunksize:
+                self.verify_etag(key, head["ETag"], checksums)
+            digest = self.stored_digest(archive, head)
+            if checksums and digest and digest != checksums.sha256:
+                raise S3Error(self, f"SHA-256 of '{key}' doesn't match")
+
+            level, checked = VERIFY_ETAG, 0
+            if self.verification == VERIFY_SAMPLE and local:
+                level, checked = VERIFY_SAMPLE, self.verify_samples(key, local, size)
+            elif self.verification == VERIFY_FULL:
+                sha256 = checksums.sha256 if checksums else digest
+                level, checked = VERIFY_FULL, self.verify_content(key, sha256)
+            elif self.verification == VERIFY_SAMPLE:
+                logging.info("no local file of '%s' to sample", archive.filename)
+
+            return S3VerifyResult(level, size, checked, time.monotonic() - stime)
+
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+        except BotoCoreError as e:
+            raise S3Error(self, repr(e)) from e
+
+    def verify_samples(self, key: str, path: str, size: int) -> int:
+        """Compares random byte ranges of the object with the local file,
+        several ranges at once.
+
+        Returns the number of bytes read back.
+
+        """
+        length = int(size * SAMPLE_FRACTION / max(self.samples, 1))
+        length = min(max(length, SAMPLE_MIN_SIZE), SAMPLE_MAX_SIZE, size)
+        if not length:
+            return 0
+        offsets = sorted(
+            {random.randrange(size - length + 1) for _ in range(self.samples)}
+        )
+
+        def check(offset):
+            response = self.s3_client.get_object(
+                Bucket=self.bucket,
+                Key=key,
+                Range=f"bytes={offset}-{offset + length - 1}",
+            )
+            remote = hashlib.sha256(response["Body"].read()).digest()
+            with open(path, "rb") as f:
+                f.seek(offset)
+                if hashlib.sha256(f.read(length)).digest() != remote:
+                    raise S3Error(self, f"bytes {offset}+{length} of '{key}' differ")
+            return length
+
+        with ThreadPoolExecutor(max_workers=self.tuning.concurrency) as executor:
+            return sum(executor.map(check, offsets))
+
+    def verify_content(self, key: str, sha256: str | None = None) -> int:
+        """Reads the whole object, decompresses and reads each member and
+        compares the digest of the object with the given digest.
+
+        Returns the number of bytes read back.
+
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        body = response["Body"]
+        h = hashlib.sha256()
+
+        class Reader:
+            def __init__(self):
+                self.size = 0
+
+            def read(self, size=-1):
+                data = body.read(size)
+                h.update(data)
+                self.size += len(data)
+                return data
+
+        reader = Reader()
+        try:
+            # the gzip file verifies length and CRC of the data at its end
+            with gzip.GzipFile(fileobj=reader, mode="rb") as gz:
+                with tarfile.open(fileobj=gz, mode="r|") as tar:
+                    for member in tar:
+                        f = tar.extractfile(member)
+                        while f and f.read(1024**2):
+                            pass
+                while gz.read(1024**2):
+                    pass
+        except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+            raise S3Error(self, f"'{key}' is not a readable archive: {e}") from e
+
+        if sha256 and h.hexdigest() != sha256:
+            raise S3Error(self, f"SHA-256 of '{key}' doesn't match")
+        return reader.size
+
+    @reporter_check_result
+    def replicate_archive(self, key: str, bucket: str) -> S3ReplicaResult:
+        """Copies the given object server-side into the given bucket."""
+        try:
+            self.ensure_bucket(bucket)
+            stime = time.monotonic()
+            size = self.s3_client.head_object(Bucket=self.bucket, Key=key)[
+                "ContentLength"
+            ]
+            parts = self.copy_object(key, bucket, key, size)
+            return S3ReplicaResult(bucket, size, time.monotonic() - stime, parts)
+
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+        except BotoCoreError as e:
+            raise S3Error(self, repr(e)) from e
+
+    def copy_object(self, source: str, bucket: str, key: str, size: int) -> int:
+        """Copies the given object of the configured bucket server-side to
+        the given bucket and key.
+
+        Objects up to COPY_PART_SIZE are copied at once, larger objects in
+        parts copied concurrently. No data passes through this host.
+
+        Returns the number of parts copied.
+
+        """
+        copysource = {"Bucket": self.bucket, "Key": source}
+        if size <= COPY_PART_SIZE:
+            self.s3_client.copy_object(Bucket=bucket, Key=key, CopySource=copysource)
+            return 1
+
+        response = self.s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        upload_id = response["UploadId"]
+
+        def copy(number):
+            start = (number - 1) * COPY_PART_SIZE
+            end = min(start + COPY_PART_SIZE, size) - 1
+            response = self.s3_client.upload_part_copy(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource=copysource,
+                CopySourceRange=f"bytes={start}-{end}",
+            )
+            return response["CopyPartResult"]["ETag"]
+
+        numbers = range(1, (size + COPY_PART_SIZE - 1) // COPY_PART_SIZE + 1)
+        try:
+            with ThreadPoolExecutor(self.tuning.concurrency) as executor:
+                etags = list(executor.map(copy, numbers))
+            self.s3_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": number, "ETag": etag}
+                        for number, etag in zip(numbers, etags, strict=True)
+                    ]
+                },
+            )
+        except (BotoCoreError, ClientError):
+            self.s3_client.abort_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id
+            )
+            raise
+        return len(numbers)
+
+    @property
+    def target_id(self) -> str:
+        """Short identifier of endpoint and bucket for local state files."""
+        target = f"{self.endpoint_url}/{self.bucket}"
+        return hashlib.sha256(target.encode()).hexdigest()[:8]
+
+    def upload_state_path(self, archive: Archive) -> Path:
+        """Returns the path of the upload state of the given archive."""
+        return Path(f"{archive.tarname()}.{self.target_id}.upload.json")
+
+    def archive_checksums(self, archive: Archive, size: int) -> ArchiveChecksums | None:
+        """Returns the checksums computed while writing the given archive
+        if they match its file and the chunksize of the transfers.
+
+        """
+        checksums = getattr(archive, "checksums", None)
+        if (
+            isinstance(checksums, ArchiveChecksums)
+            and checksums.partsize == self.tuning.chunksize
+            and checksums.size == size
+        ):
+            return checksums
+        logging.debug("no matching checksums for '%s'", archive.filename)
+        return None
+
+    def verify_etag(self, key: str, etag: str, checksums: ArchiveChecksums) -> None:
+        """Raises an S3Error if the ETag of the uploaded object doesn't
+        match the checksums of the archive.
+
+        """
+        etag = etag.strip('"')
+        if etag != checksums.etag():
+            raise S3Error(
+                self, f"ETag of '{key}' is {etag}, expected {checksums.etag()}"
+            )
+
+    def multipart_upload(
+        self,
+        archive: Archive,
+        callback: Callable | None = None,
+        checksums: ArchiveChecksums | None = None,
+    ) -> None:
+        """Uploads the given archive in parts.
+
+        The upload id and the ETags of the completed parts are stored next
+        to the archive after each part. If an upload of the same archive
+        was interrupted, only the missing parts are uploaded. Each part is
+        retried with exponential backoff.
+
+        With the checksums of the archive each part is sent with its MD5
+        digest and the ETag of the completed object is verified.
+
+        """
+        path = self.upload_state_path(archive)
+        key = self.object_key(archive)
+        stat = os.stat(archive.filename)
+        identity = {
+            "bucket": self.bucket,
+            "key": key,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "chunksize": self.tuning.chunksize,
+        }
+
+        state = self._resume_upload(path, identity)
+        if state is None:
+            parameters = {"Bucket": self.bucket, "Key": key}
+            if checksums:
+                parameters["Metadata"] = {"sha256": checksums.sha256}
+            parameters.update(self.tagging(archive))
+            response = self.s3_client.create_multipart_upload(**parameters)
+            state = {**identity, "upload_id": response["UploadId"], "parts": {}}
+            self._save_upload_state(path, state)
+        else:
+            logging.info(
+                "resume upload of '%s' (%d parts done)",
+                archive.filename,
+                len(state["parts"]),
+            )
+
+        chunksize = self.tuning.chunksize
+        numbers = range(1, (stat.st_size + chunksize - 1) // chunksize + 1)
+        missing = [number for number in numbers if str(number) not in state["parts"]]
+        lock = threading.Lock()
+
+        def upload(number):
+            with open(archive.filename, "rb") as f:
+                f.seek((number - 1) * chunksize)
+                data = f.read(chunksize)
+            etag = self._upload_part(
+                state["upload_id"],
+                key,
+                number,
+                data,
+                checksums.parts[number - 1] if checksums else None,
+            )
+            with lock:
+                state["parts"][str(number)] = etag
+                self._save_upload_state(path, state)
+            if callback:
+                callback(len(data))
+
+        with ThreadPoolExecutor(max_workers=self.tuning.concurrency) as executor:
+            for _ in executor.map(upload, missing):
+                pass
+
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=state["upload_id"],
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": state["parts"][str(number)]}
+                    for number in numbers
+                ]
+            },
+        )
+        path.unlink()
+        if checksums:
+            self.verify_etag(key, response["ETag"], checksums)
+
+    def _resume_upload(self, path: Path, identity: dict) -> dict | None:
+        """Returns the state of an interrupted upload with the given
+        identity, with the parts known to the cloud service.
+
+        """
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if {key: state.get(key) for key in identity} != identity:
+            # the archive has changed: the upload can't be resumed
+            self._abort_upload(state.get("key"), state.get("upload_id"))
+            return None
+
+        try:
+            paginator = self.s3_client.get_paginator("list_parts")
+            parts = {}
+            for page in paginator.paginate(
+                Bucket=self.bucket, Key=state["key"], UploadId=state["upload_id"]
+            ):
+                for part in page.get("Parts", []):
+                    parts[str(part["PartNumber"])] = part["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            return None
+        state["parts"] = parts
+        return state
+
+    def _save_upload_state(self, path: Path, state: dict) -> None:
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _upload_part(
+        self,
+        upload_id: str,
+        key: str,
+        number: int,
+        data: bytes,
+        digest: bytes | None = None,
+    ) -> str:
+        parameters = {}
+        if digest:
+            # the cloud service rejects the part if it was corrupted in transit
+            parameters["ContentMD5"] = base64.b64encode(digest).decode()
+        attempt, delay = 1, PART_BACKOFF
+        while True:
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=data,
+                    **parameters,
+                )
+                return response["ETag"]
+            except (BotoCoreError, ClientError, OSError) as e:
+                if attempt >= PART_ATTEMPTS:
+                    raise
+                logging.warning(
+                    "part %d of '%s' failed (%s), retry in %.1fs", number, key, e, delay
+                )
+                time.sleep(delay)
+                attempt, delay = attempt + 1, delay * 2
+
+    def _abort_upload(self, key: str | None, upload_id: str | None) -> None:
+        if not key or not upload_id:
+            return
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+        except ClientError as e:
+            logging.debug("can't abort upload of '%s': %s", key, e)
+
+    def abort_stale_uploads(self, label: str) -> int:
+        """Aborts multipart uploads of archives with the given label which
+        are older than STALE_UPLOAD_AGE and can't be resumed from here.
+
+        Returns the number of aborted uploads.
+
+        """
+        suffix = f".{self.target_id}.upload.json"
+        resumable = set()
+        for path in Path(".").glob(f"{label}*{suffix}"):
+            if not self.has_label(path.name.removesuffix(suffix), label):
+                continue
+            try:
+                with open(path) as f:
+                    resumable.add(json.load(f)["upload_id"])
+            except (OSError, ValueError, KeyError):
+                continue
+
+        limit = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+            seconds=STALE_UPLOAD_AGE
+        )
+        aborted = 0
+        paginator = self.s3_client.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=label):
+            for upload in page.get("Uploads", []):
+                key = upload["Key"]
+                if not self.has_label(key, label):
+                    continue
+                if upload["UploadId"] in resumable or upload["Initiated"] > limit:
+                    continue
+                logging.info("abort stale upload of '%s'", key)
+                self._abort_upload(key, upload["UploadId"])
+                aborted += 1
+        return aborted
+
+    @staticmethod
+    def has_label(key: str, label: str) -> bool:
+        """Returns True if the given key is an archive or a partition archive
+        of exactly the given label.
+
+        """
+        filename = os.path.basename(key)
+        try:
+            if PartitionArchive.is_partition(filename):
+                return PartitionArchive.fromfilename(filename, "").label == label
+            Archive.fromfilename(filename, check_label=label)
+            return True
+        except ValueError:
+            return False
+
+    def retention_tier(self, archive: Archive) -> str | None:
+        """Returns the retention tier of the given archive if its expiration
+        is left to lifecycle rules.
+
+        The tier is the expiration of the archive by the thinning strategy,
+        given the older archives in the bucket.
+
+        """
+        if self.lifecycle is None or isinstance(archive, PartitionArchive):
+            return None
+        if archive.filename not in self.tiers:
+            dates = [a.ctime for a in self.list_archives(archive.label)]
+            days = self.lifecycle.expiration(archive.ctime, dates)
+            # lifecycle rules expire objects one day after their upload at
+            # the earliest
+            tier = YEARLY if days is None else f"{max(days, 1)}d"
+            self.tiers[archive.filename] = tier
+        return self.tiers[archive.filename]
+
+    def tagging(self, archive: Archive) -> dict:
+        """Returns the parameters to tag the given archive with its label and
+        retention tier (empty if not expired by lifecycle rules).
+
+        """
+        tier = self.retention_tier(archive)
+        if tier is None:
+            return {}
+        value = f"{archive.label}.{tier}"
+        return {"Tagging": urllib.parse.urlencode({RETENTION_TAG: value})}
+
+    @staticmethod
+    def tier_days(tier: str) -> int | None:
+        """Returns the days after which archives of the given retention tier
+        expire, None if they are kept forever.
+
+        """
+        if tier == YEARLY:
+            return None
+        return int(tier.removesuffix("d"))
+
+    def expired(self, archive: Archive, tier: str | None) -> bool:
+        """Returns True if the given archive of the given retention tier may
+        have been expired by lifecycle rules.
+
+        """
+        days = None if tier is None else self.tier_days(tier)
+        if days is None:
+            return False
+        return datetime.datetime.now() - archive.ctime > datetime.timedelta(days=days)
+
+    def lifecycle_rules(self, label: str) -> list[dict]:
+        """Returns the lifecycle rules expiring the tagged archives of the
+        given label: one per retention tier of its archives in the catalog.
+
+        """
+        assert self.lifecycle is not None
+        catalog, _ = self.read_catalog(label)
+        tiers = {
+            entry["tier"]
+            for entry in (catalog or {"archives": {}})["archives"].values()
+            if "tier" in entry
+        }
+        days = sorted(filter(None, map(self.tier_days, tiers - {YEARLY})))
+        return [
+            {
+                "ID": f"sitebackup-{label}-{n}d",
+                "Status": "Enabled",
+                "Filter": {"Tag": {"Key": RETENTION_TAG, "Value": f"{label}.{n}d"}},
+                "Expiration": {"Days": n},
+            }
+            for n in days
+        ]
+
+    def apply_lifecycle(self, label: str) -> bool:
+        """Installs the lifecycle rules of the given label in the bucket.
+
+        Rules of other labels and foreign rules are kept, rules of tiers no
+        longer in use are removed. Returns True if the configuration of the
+        bucket was changed.
+
+        """
+        rules = self.lifecycle_rules(label)
+        prefix = f"sitebackup-{label}-"
+        try:
+            response = self.s3_client.get_bucket_lifecycle_configuration(
+                Bucket=self.bucket
+            )
+            existing = response.get("Rules", [])
+        except ClientError as e:
+            if (
+                e.response.get("Error", {}).get("Code")
+                != "NoSuchLifecycleConfiguration"
+            ):
+                raise
+            existing = []
+
+        ours = sorted(
+            (rule for rule in existing if rule.get("ID", "").startswith(prefix)),
+            key=lambda rule: rule.get("Expiration", {}).get("Days", 0),
+        )
+        if ours == rules:
+            return False
+        others = [rule for rule in existing if rule not in ours]
+        self.s3_client.put_bucket_lifecycle_configuration(
+            Bucket=self.bucket, LifecycleConfiguration={"Rules": others + rules}
+        )
+        logging.info("%s: lifecycle rules for '%s' installed", self.label, label)
+        return True
+
+    def check_expiration(
+        self, label: str, archives: list[Archive], dry: bool = False
+    ) -> tuple[list[Archive], list[Archive], list[Archive], list[Archive]]:
+        """Splits the given archives to be thinned out into archives to be
+        deleted, archives retained forever (of the yearly tier), archives
+        expired by lifecycle rules in time and overdue archives.
+
+        Archives without a retention tier in the catalog are deleted.
+        Archives older than the expiration of their tier are looked up:
+        archives already gone are removed from the catalog.
+
+        """
+        catalog, _ = self.read_catalog(label)
+        entries = (catalog or {"archives": {}})["archives"]
+        now = datetime.datetime.now()
+
+        to_delete, retained, expiring, overdue = [], [], [], []
+        gone = set()
+        for archive in archives:
+            key = self.object_key(archive)
+            tier = entries.get(key, {}).get("tier")
+            if tier is None:
+                to_delete.append(archive)
+                continue
+            days = self.tier_days(tier)
+            if days is None:
+                retained.append(archive)
+                continue
+            if now - archive.ctime <= datetime.timedelta(days=days + LIFECYCLE_GRACE):
+                expiring.append(archive)
+                continue
+            try:
+                self.s3_client.head_object(Bucket=self.bucket, Key=key)
+                logging.warning("%s: '%s' not expired in time", self.label, key)
+                overdue.append(archive)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                    raise
+                gone.add(key)
+
+        if gone and not dry:
+
+            def remove(archives):
+                for key in gone:
+                    archives.pop(key, None)
+
+            self.update_catalog(label, remove)
+        return to_delete, retained, expiring, overdue
 
     @override
     @reporter_check_result
-    def perform_thinning(self, label: str, thin_archives: Callable, dry: bool = False):
+    def perform_thinning(
+        self,
+        label: str,
+        thin_archives: Callable,
+        dry: bool = False,
+        since: datetime.datetime | None = None,
+    ):
         """Deletes obsolete archives from the configured cloud service.
 
-        Collects all archives in the configured bucket and decides which
-        archives to keep according the given strategy. Then deletes the
-        obsolete archives.
+        Collects all archives in the configured bucket (not older than
+        since) and decides which archives to keep according the given
+        strategy. Then deletes the obsolete archives.
+
+        If the retention is left to lifecycle rules, the rules are installed
+        and only archives without a retention tier are deleted. Archives of
+        the yearly tier are retained.
 
         """
         try:
-            archives = self.list_archives(label)
+            archives = self.list_archives(label, since=since)
 
             to_retain, to_delete = thin_archives(archives)
 
+            expiring, overdue = [], []
+            if self.lifecycle:
+                if not dry:
+                    self.apply_lifecycle(label)
+                to_delete, retained, expiring, overdue = self.check_expiration(
+                    label, to_delete, dry=dry
+                )
+                to_retain = [*to_retain, *retained]
+
             if not dry:
-                for archive in to_delete:
-                    self.s3_client.delete_object(
-                        Bucket=self.bucket, Key=archive.filename
-                    )
-                return S3ThinningResult(len(to_retain), len(to_delete))
+                errors = self.delete_keys([self.object_key(a) for a in to_delete])
+                failed = {key for key, _ in errors}
+                deleted = {self.object_key(a) for a in to_delete} - failed
+
+                def remove(archives):
+                    for key in deleted:
+                        archives.pop(key, None)
+
+                if deleted:
+                    self.update_catalog(label, remove)
+                return S3ThinningResult(
+                    len(to_retain),
+                    len(to_delete) - len(errors),
+                    tuple(errors),
+                    len(expiring),
+                    len(overdue),
+                )
             else:
-                return S3ThinningResult(len(to_retain), len(to_delete))
+                return S3ThinningResult(
+                    len(to_retain), len(to_delete), (), len(expiring), len(overdue)
+                )
+
+        except ClientError as e:
+            raise S3Error(self, repr(e)) from e
+        except NoCredentialsError as e:
+            raise S3Error(self, repr(e)) from e
+        except EndpointConnectionError as e:
+            raise S3Error(self, repr(e)) from e
+        except SSLError as e:
+            raise S3Error(self, repr(e)) from e
+        except socket.gaierror as e:
+            raise S3Error(self, repr(e)) from e
+
+    @override
+    @reporter_check_result
+    def thin_out_partitions(
+        self, label: str, obsolete: set[str], dry: bool = False
+    ) -> S3ThinningResult:
+        """Deletes the given partition archives (by filename) of the given
+        label from the bucket.
+
+        Partition archives are stored in the root of the bucket in both
+        layouts.
+
+        """
+        try:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            keys = [
+                obj["Key"]
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{label}.")
+                for obj in page.get("Contents", [])
+                if PartitionArchive.is_partition(obj["Key"])
+                and PartitionArchive.fromfilename(obj["Key"], "").label == label
+            ]
+            to_delete = [key for key in keys if key in obsolete]
+            errors = [] if dry else self.delete_keys(to_delete)
+            return S3ThinningResult(
+                len(keys) - len(to_delete),
+                len(to_delete) - len(errors),
+                tuple(errors),
+            )
 
         except ClientError as e:
             raise S3Error(self, repr(e)) from e
@@ -266,3 +1974,32 @@ class S3(Target):
             raise S3Error(self, repr(e)) from e
         except socket.gaierror as e:
             raise S3Error(self, repr(e)) from e
+
+    def delete_keys(self, keys: list[str]) -> list[tuple[str, str]]:
+        """Deletes the given keys in batches, several batches at once.
+
+        Returns the keys which couldn't be deleted with the error messages.
+
+        """
+        batches = [
+            keys[i : i + DELETE_BATCH_SIZE]
+            for i in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]
+
+        def delete_batch(batch):
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            return [
+                (error["Key"], error.get("Message") or error.get("Code", "unknown"))
+                for error in response.get("Errors", [])
+            ]
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.tuning.concurrency) as executor:
+            for result in executor.map(delete_batch, batches):
+                errors.extend(result)
+        for key, message in errors:
+            logging.warning("can't delete '%s': %s", key, message)
+        return errors
@@ -0,0 +1,340 @@
+"""
+Keep browsable snapshots of a filesystem in a local directory.
+
+ ######  ##    ##    ###    ########   ######  ##     ##  #######  ########
+##    ## ###   ##   ## ##   ##     ## ##    ## ##     ## ##     ##    ##
+##       ####  ##  ##   ##  ##     ## ##       ##     ## ##     ##    ##
+ ######  ## ## ## ##     ## ########   ######  ######### ##     ##    ##
+      ## ##  #### ######### ##              ## ##     ## ##     ##    ##
+##    ## ##   ### ##     ## ##        ##    ## ##     ## ##     ##    ##
+ ######  ##    ## ##     ## ##         ######  ##     ##  #######     ##
+"""
+
+import datetime
+import errno
+import json
+import os
+import shutil
+import stat as statmodule
+import tarfile
+import time
+from collections import namedtuple
+from collections.abc import Callable
+from pathlib import Path
+from typing import override
+
+import humanfriendly
+
+from backup.archive import Archive
+from backup.exclusion import Exclusion
+from backup.filesystem import FS, FSError
+from backup.index import HashingReader, hash_file
+from backup.partition import PartitionArchive
+from backup.reporter import reporter_check_result
+from backup.target._base import Target
+from backup.target.local import LocalError, LocalThinningResult
+from backup.utils import formatkv
+
+# name of the listing of the files of a snapshot, written last
+LISTING_FILENAME = ".sitebackup-snapshot.json"
+
+# size of blocks copied at once
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class SnapshotResult(
+    namedtuple("Result", ["files", "linked", "copied", "size", "duration"])
+):
+    """Class for results of snapshots with proper formatting.
+
+    Linked files are shared with the previous snapshot, the size is the
+    number of bytes copied.
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        size = humanfriendly.format_size(self.size)
+        duration = humanfriendly.format_timespan(self.duration)
+        return (
+            f"Result(files={self.files}, linked={self.linked}, copied={self.copied},"
+            f" size={size}, duration={duration})"
+        )
+
+
+class SnapshotTarget(Target):
+    """Class keeping uncompressed snapshots of the filesystem of a source.
+
+    Each archive is kept as a mirror of the filesystem in the directory
+    <path>/<label>/<timestamp>, with the members of the archive next to
+    the tree (like the database dump). Regular files unchanged since the
+    previous snapshot (same size, modification time, mode and content
+    hash) are hardlinked to it, so a snapshot only takes the space of the
+    changed files. The content hashes are only compared if the inode or
+    the change time of the file differ from the previous snapshot, which
+    catches contents replaced with the modification time kept. Without
+    checksum the content hashes are not compared at all.
+
+    Restoring a snapshot is a copy of its directory.
+
+    """
+
+    mirrors_source = True
+
+    def __init__(
+        self,
+        path: Path,
+        source: Path,
+        exclusion: Exclusion | None = None,
+        checksum: bool = True,
+        label: str = "Snapshot",
+    ) -> None:
+        super().__init__()
+
+        if not path.is_dir():
+            raise LocalError(self, f"directory '{path}' not found")
+
+        self.path = path
+        self.source = source
+        self.exclusion = exclusion
+        self.checksum = checksum
+
+        self.label = label
+        self.description = f"{self.label} Directory {self.path}"
+
+    def __str__(self):
+        return formatkv(
+            [
+                ("Snapshot(Path)", self.path),
+                ("Snapshot(Source)", self.source),
+                ("Snapshot(Checksum)", self.checksum),
+            ],
+            title="SNAPSHOT",
+        )
+
+    def snapshot_path(self, archive: Archive) -> Path:
+        return self.path / archive.label / archive.timestamp
+
+    @override
+    def list_archives(
+        self, label: str | None = None, since: datetime.datetime | None = None
+    ) -> list[Archive]:
+        """Returns the complete snapshots in the directory (with the given
+        label and not older than since) as archives.
+
+        """
+        try:
+            if label:
+                labels = [label]
+            else:
+                labels = sorted(p.name for p in self.path.iterdir() if p.is_dir())
+            archives = []
+            for name in labels:
+                directory = self.path / name
+                if not directory.is_dir():
+                    continue
+                for snapshot in sorted(directory.iterdir()):
+                    if not (snapshot / LISTING_FILENAME).is_file():
+                        continue
+                    try:
+                        archive = Archive(name, snapshot.name)
+                    except ValueError:
+                        continue
+                    if not since or archive.ctime >= since:
+                        archives.append(archive)
+            return archives
+        except OSError as e:
+            raise LocalError(self, f"can't list '{self.path}': {e}") from e
+
+    @override
+    def contains_archive(self, archive: Archive) -> bool:
+        """Returns True if a snapshot of the given archive exists.
+
+        Partitions are part of the mirrored tree: they are always contained.
+
+        """
+        if isinstance(archive, PartitionArchive):
+            return True
+        return (self.snapshot_path(archive) / LISTING_FILENAME).is_file()
+
+    def read_listing(self, snapshot: Path) -> dict[str, list]:
+        """Returns the regular files of the given snapshot with their size,
+        modification time, mode, content hash, inode and change time.
+
+        """
+        try:
+            with open(snapshot / LISTING_FILENAME) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def previous(self, archive: Archive) -> Path | None:
+        """Returns the latest snapshot older than the given archive."""
+        older = [
+            a for a in self.list_archives(archive.label) if a.ctime < archive.ctime
+        ]
+        if not older:
+            return None
+        return self.snapshot_path(max(older, key=lambda a: a.ctime))
+
+    @override
+    @reporter_check_result
+    def transfer_archive(self, archive: Archive, dry: bool = False):
+        """Takes a snapshot of the filesystem for the given archive.
+
+        The snapshot is built next to the others and renamed into place when
+        complete. The tree is only mirrored if the archive contains one.
+
+        """
+        if dry or isinstance(archive, PartitionArchive):
+            return SnapshotResult(0, 0, 0, 0, 0)
+
+        destination = self.snapshot_path(archive)
+        tmp = destination.with_name(f".{destination.name}.tmp")
+        try:
+            stime = time.monotonic()
+            previous = self.previous(archive)
+            listing = self.read_listing(previous) if previous else {}
+
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            files: dict[str, list] = {}
+            linked, copied, size = 0, 0, 0
+            if self.extract_members(archive, tmp):
+                directories = []
+                for path, name, stat in FS(self.source, self.exclusion).walk():
+                    target = tmp / name
+                    if statmodule.S_ISDIR(stat.st_mode):
+                        target.mkdir()
+                        directories.append((target, stat))
+                    elif statmodule.S_ISLNK(stat.st_mode):
+                        os.symlink(os.readlink(path), target)
+                    elif statmodule.S_ISREG(stat.st_mode):
+                        entry = listing.get(name)
+                        if (
+                            previous
+                            and entry
+                            and self.unchanged(path, stat, entry)
+                            and self.link(previous / name, target)
+                        ):
+                            files[name] = self.entry(stat, entry[3])
+                            linked += 1
+                        else:
+                            digest = self.copy(path, target, stat)
+                            files[name] = self.entry(stat, digest)
+                            copied += 1
+                            size += stat.st_size
+                # restrictive modes are set after the directories are filled
+                for target, stat in reversed(directories):
+                    os.chmod(target, statmodule.S_IMODE(stat.st_mode))
+                    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            with open(tmp / LISTING_FILENAME, "w") as f:
+                json.dump(files, f)
+            if destination.exists():
+                shutil.rmtree(destination)
+            os.rename(tmp, destination)
+
+            return SnapshotResult(
+                len(files), linked, copied, size, time.monotonic() - stime
+            )
+        except (OSError, tarfile.TarError, FSError) as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise LocalError(self, f"can't snapshot '{archive.name}': {e}") from e
+
+    def extract_members(self, archive: Archive, directory: Path) -> bool:
+        """Extracts the members of the archive before its tree (like the
+        database dump) into the given directory.
+
+        Returns True if the archive contains a tree. The rest of the
+        archive is not read.
+
+        """
+        with tarfile.open(archive.tarname(), mode="r|gz") as tar:
+            for member in tar:
+                if member.name == archive.name or "/" in member.name:
+                    return True
+                if member.isfile():
+                    tar.extract(member, directory, filter="data")
+        return False
+
+    def unchanged(self, path: Path, stat: os.stat_result, entry: list) -> bool:
+        """Returns True if the given file matches its entry of the listing
+        of the previous snapshot.
+
+        """
+        size, mtime, mode, digest = entry[:4]
+        if (stat.st_size, stat.st_mtime_ns, stat.st_mode) != (size, mtime, mode):
+            return False
+        if not self.checksum or entry[4:] == [stat.st_ino, stat.st_ctime_ns]:
+            return True
+        return hash_file(path) == digest
+
+    def entry(self, stat: os.stat_result, digest: str) -> list:
+        """Returns the entry of the listing for a file with the given stat
+        result and content hash.
+
+        """
+        return [
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_mode,
+            digest,
+            stat.st_ino,
+            stat.st_ctime_ns,
+        ]
+
+    def link(self, source: Path, target: Path) -> bool:
+        """Hardlinks the file of the previous snapshot, returns False if it
+        can't be linked (anymore).
+
+        """
+        try:
+            os.link(source, target)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            if e.errno == errno.EMLINK:
+                return False
+            raise
+
+    def copy(self, path: Path, target: Path, stat: os.stat_result) -> str:
+        """Copies the given file and returns the hash of its content."""
+        with open(path, "rb") as fsrc, open(target, "wb") as fdst:
+            reader = HashingReader(fsrc)
+            shutil.copyfileobj(reader, fdst, COPY_BLOCK_SIZE)
+        os.chmod(target, statmodule.S_IMODE(stat.st_mode))
+        os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        return reader.hexdigest()
+
+    @override
+    @reporter_check_result
+    def perform_thinning(
+        self,
+        label: str,
+        thin_archives: Callable,
+        dry: bool = False,
+        since: datetime.datetime | None = None,
+    ):
+        """Deletes obsolete snapshots from the directory.
+
+        Collects all snapshots (not older than since) and decides which
+        snapshots to keep according the given strategy. Then deletes the
+        directories of the obsolete snapshots.
+
+        """
+        archives = self.list_archives(label, since=since)
+
+        to_retain, to_delete = thin_archives(archives)
+
+        if not dry:
+            try:
+                for archive in to_delete:
+                    # the listing goes first: the snapshot is incomplete now
+                    (self.snapshot_path(archive) / LISTING_FILENAME).unlink()
+                    shutil.rmtree(self.snapshot_path(archive))
+            except OSError as e:
+                raise LocalError(self, f"can't thin out '{self.path}': {e}") from e
+        return LocalThinningResult(len(to_retain), len(to_delete))
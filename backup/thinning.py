@@ -11,7 +11,7 @@
 import logging
 import re
 from abc import ABC, abstractmethod
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
 from datetime import datetime, timedelta
 from operator import add, attrgetter
 from typing import Protocol, override
@@ -19,6 +19,10 @@ from typing import Protocol, override
 from dateutil.relativedelta import relativedelta
 
 
+def _quiet(*args) -> None:
+    pass
+
+
 class SupportsLessThan(Protocol):
     def __lt__(self, other: object) -> bool: ...
 
@@ -82,6 +86,13 @@ class ThinningStrategy(ABC):
         dates = list(reversed(dates))
         return self.__execute__(dates, attr=attr, fix=fix)
 
+    def horizon(self, fix: datetime | None = None) -> datetime | None:
+        """Returns the date before which the strategy doesn't discard dates
+        anymore (None if it depends on all dates).
+
+        """
+        return None
+
 
 class LatestStrategy(ThinningStrategy):
     """Keep the x most recent dates. Discard all others."""
@@ -128,19 +139,72 @@ class ThinOutStrategy(ThinningStrategy):
     def __str__(self):
         return f"THIN OUT {self.days}D{self.weeks}W{self.months}M"
 
+    @override
+    def horizon(self, fix: datetime | None = None) -> datetime | None:
+        """Returns the start of the first span of a year.
+
+        Dates before have been thinned out to one per year by earlier
+        executions. As the spans of a year move with the fix date, this
+        may keep an additional date in some years before the horizon.
+
+        """
+        if fix is None:
+            fix = datetime.now()
+        fix = fix.replace(microsecond=0, second=0, minute=0, hour=0)
+        weeks_end = fix - timedelta(days=self.days, weeks=self.weeks)
+        year_end = weeks_end.replace(day=1) - relativedelta(months=self.months)
+        return year_end - relativedelta(years=1)
+
+    def expiration(self, date: datetime, dates: Iterable[datetime]) -> int | None:
+        """Returns the days after which the given date is discarded by daily
+        executions of the strategy, None if it is kept forever.
+
+        Newer dates never change whether an older date is kept (spans keep
+        their oldest date), so the daily executions are simulated on the
+        given date and the given dates before it only.
+
+        """
+        remaining = sorted({d for d in dates if d < date} | {date}, reverse=True)
+        start = date.replace(microsecond=0, second=0, minute=0, hour=0)
+        # a date outliving all spans and the following year is kept forever
+        limit = self.days + 7 * (self.weeks + 1) + 31 * (self.months + 1) + 2 * 366
+        for n in range(0, limit + 1):
+            fix = start + timedelta(days=n)
+            # a newer date keeps the given date from being the newest one
+            newest = fix + timedelta(days=1)
+            kept, _ = self.thin_out([newest, *remaining], fix=fix, log=_quiet)
+            if date not in kept:
+                return n
+            remaining = sorted(kept - {newest}, reverse=True)
+        return None
+
     @override
     def __execute__(
         self, dates: list[DateLike], attr=None, fix=None
     ) -> tuple[set[DateLike], set[DateLike]]:
+        return self.thin_out(dates, attr=attr, fix=fix)
+
+    def thin_out(
+        self,
+        dates: list[DateLike],
+        attr: str | None = None,
+        fix: datetime | None = None,
+        log: Callable[..., None] = logging.info,
+    ) -> tuple[set[DateLike], set[DateLike]]:
+        """Thins out the given dates (sorted from newest to oldest) with
+        spans ending at the given fix date, logging each decision with the
+        given function.
+
+        """
         assert isinstance(dates, list)
         assert fix is not None
 
         fix = fix.replace(microsecond=0, second=0, minute=0, hour=0)
 
-        logging.info("THINNING BY THIN OUT DAILY FOR %s DAYS", self.days)
-        logging.info("THINNING BY THIN OUT WEEKLY FOR %s WEEKS", self.weeks)
-        logging.info("THINNING BY THIN OUT MONTHLY FOR %s MONTHS", self.months)
-        logging.info("THINNING BY THIN OUT YEARLY FOREVER")
+        log("THINNING BY THIN OUT DAILY FOR %s DAYS", self.days)
+        log("THINNING BY THIN OUT WEEKLY FOR %s WEEKS", self.weeks)
+        log("THINNING BY THIN OUT MONTHLY FOR %s MONTHS", self.months)
+        log("THINNING BY THIN OUT YEARLY FOREVER")
 
         def head(dates):
             d = next(iter(dates), None)
@@ -173,9 +237,9 @@ class ThinOutStrategy(ThinningStrategy):
                 in_dates.append(in_date)
                 out_dates = dates_in_span[:-1]
             for in_date in in_dates:
-                logging.info("KEEP: %r", in_date)
+                log("KEEP: %r", in_date)
             for out_date in out_dates:
-                logging.info("DROP: %r", out_date)
+                log("DROP: %r", out_date)
             return in_dates, out_dates
 
         in_dates = []
@@ -186,69 +250,69 @@ class ThinOutStrategy(ThinningStrategy):
             in_dates.append(dates.pop(0))
         # keep all dates which are newer than the fix date
         in_dates = in_dates + [d for d in dates if date_is_after(d, fix)]
-        logging.info("BEGIN FUTURE AND LATEST")
+        log("BEGIN FUTURE AND LATEST")
         for date in in_dates:
-            logging.info("KEEP: %r", date)
-        logging.info("END FUTURE AND LATEST")
+            log("KEEP: %r", date)
+        log("END FUTURE AND LATEST")
 
         # next, keep one date per day for self.days
         for d in range(0, self.days):
             day = fix - timedelta(days=d + 1)
-            logging.info("BEGIN DAY %s", day.date())
+            log("BEGIN DAY %s", day.date())
             day_dates = [d for d in dates if date_is_same_day(d, day)]
             if len(day_dates):
                 in_date = day_dates[-1]
                 in_dates.append(in_date)
-                logging.info("KEEP: %r", in_date)
+                log("KEEP: %r", in_date)
                 other_dates = day_dates[:-1]
                 for out_date in other_dates:
-                    logging.info("DROP: %r", out_date)
+                    log("DROP: %r", out_date)
                 out_dates = out_dates + other_dates
-            logging.info("END DAY %s", day.date())
+            log("END DAY %s", day.date())
 
         # next keep one date per week for self.weeks
         for w in range(0, self.weeks):
             week_end = fix - timedelta(days=self.days, weeks=w)
             week_start = week_end - timedelta(weeks=1)
-            logging.info("BEGIN WEEK %s - %s", week_start.date(), week_end.date())
+            log("BEGIN WEEK %s - %s", week_start.date(), week_end.date())
             in_dates, out_dates = map(
                 add, [in_dates, out_dates], split_dates_in_span(week_start, week_end)
             )
-            logging.info("END WEEK %s - %s", week_start.date(), week_end.date())
+            log("END WEEK %s - %s", week_start.date(), week_end.date())
 
         # this is tricky: adjust to months (keep all dates inbetween)
         weeks_end = fix - timedelta(days=self.days, weeks=self.weeks)
         fix_month = weeks_end.replace(day=1)
-        logging.info("BEGIN ADJUSTMENT %s - %s", fix_month, weeks_end)
+        log("BEGIN ADJUSTMENT %s - %s", fix_month, weeks_end)
         adjustment_dates = [
             d for d in dates if date_is_in_span(d, fix_month, weeks_end)
         ]
         if len(adjustment_dates):
             for in_date in adjustment_dates:
-                logging.info("KEEP: %r", in_date)
+                log("KEEP: %r", in_date)
             in_dates = in_dates + adjustment_dates
-        logging.info("END ADJUSTMENT %s - %s", fix_month, weeks_end)
+        log("END ADJUSTMENT %s - %s", fix_month, weeks_end)
 
         # next keep one date per month for self.months
         for m in range(0, self.months):
             month_end = fix_month - relativedelta(months=m)
             month_start = month_end - relativedelta(months=1)
-            logging.info("BEGIN MONTH %s - %s", month_start.date(), month_end.date())
+            log("BEGIN MONTH %s - %s", month_start.date(), month_end.date())
             in_dates, out_dates = map(
                 add, [in_dates, out_dates], split_dates_in_span(month_start, month_end)
             )
-            logging.info("END MONTH %s - %s", month_start.date(), month_end.date())
+            log("END MONTH %s - %s", month_start.date(), month_end.date())
 
         # finally keep one date per year forever
         year_end = fix_month - relativedelta(months=self.months)
         year_start = year_end - relativedelta(years=1)
         last_date = tail(dates)
         while last_date and last_date < year_end:
-            logging.info("BEGIN YEAR %s - %s", year_start.date(), year_end.date())
+            log("BEGIN YEAR %s - %s", year_start.date(), year_end.date())
             in_dates, out_dates = map(
                 add, [in_dates, out_dates], split_dates_in_span(year_start, year_end)
             )
-            logging.info("END YEAR %s - %s", year_start.date(), year_end.date())
+            log("END YEAR %s - %s", year_start.date(), year_end.date())
             year_end = year_end - relativedelta(years=1)
             year_start = year_end - relativedelta(years=1)
 
@@ -29,6 +29,15 @@ FULLWIDTH = dict(
 
 TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
 
+# Python codecs of the character sets of MySQL (latin1 of MySQL is cp1252)
+CODECS = {
+    "utf8": "utf-8",
+    "utf8mb3": "utf-8",
+    "utf8mb4": "utf-8",
+    "latin1": "cp1252",
+    "ascii": "ascii",
+}
+
 
 def timestamp4now(now: datetime | None = None) -> str:
     if now is None:
@@ -40,6 +49,14 @@ def timestamp2date(timestamp: str) -> datetime:
     return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
 
 
+def codec4charset(charset: str | None) -> str:
+    """Returns the Python codec of the given MySQL character set (utf-8
+    for unknown character sets).
+
+    """
+    return CODECS.get((charset or "").lower(), "utf-8")
+
+
 def slugify(value: str) -> str:
     assert value is not None, "value must not be None"
     assert value != "", "value must not be empty"
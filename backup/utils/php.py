@@ -0,0 +1,64 @@
+import re
+from typing import Any
+
+# scalar values: N; b:1; i:42; d:0.5;
+RE_SCALAR = re.compile(rb"([Nbid])(?::([^;]*))?;")
+# headers of compound values: s:5:"...  a:2:{
+RE_STRING = re.compile(rb's:(\d+):"')
+RE_ARRAY = re.compile(rb"a:(\d+):\{")
+
+
+class PHPUnserializeError(ValueError):
+    pass
+
+
+def unserialize(data: str | bytes, charset: str = "utf-8") -> Any:
+    """Returns the value of the given PHP-serialized data.
+
+    Supports null, booleans, numbers, strings and arrays (as dicts with
+    the keys in their original order), which covers the metadata stored
+    by Wordpress. Objects and references are rejected.
+
+    """
+    if isinstance(data, str):
+        data = data.encode(charset)
+    value, offset = _unserialize(data, 0, charset)
+    if offset != len(data):
+        raise PHPUnserializeError(f"trailing data at offset {offset}")
+    return value
+
+
+def _unserialize(data: bytes, offset: int, charset: str) -> tuple[Any, int]:
+    if m := RE_SCALAR.match(data, offset):
+        kind, value = m.groups()
+        if kind == b"N":
+            return None, m.end()
+        if value is None:
+            raise PHPUnserializeError(f"missing value at offset {offset}")
+        if kind == b"b":
+            return value == b"1", m.end()
+        if kind == b"i":
+            return int(value), m.end()
+        return float(value), m.end()
+
+    if m := RE_STRING.match(data, offset):
+        # the length is given in bytes, not in characters
+        start = m.end()
+        end = start + int(m.group(1))
+        if data[end : end + 2] != b'";':
+            raise PHPUnserializeError(f"invalid string at offset {offset}")
+        return data[start:end].decode(charset, errors="replace"), end + 2
+
+    if m := RE_ARRAY.match(data, offset):
+        array = {}
+        offset = m.end()
+        for _ in range(int(m.group(1))):
+            key, offset = _unserialize(data, offset, charset)
+            if not isinstance(key, int | str):
+                raise PHPUnserializeError(f"invalid array key at offset {offset}")
+            array[key], offset = _unserialize(data, offset, charset)
+        if data[offset : offset + 1] != b"}":
+            raise PHPUnserializeError(f"unterminated array at offset {offset}")
+        return array, offset + 1
+
+    raise PHPUnserializeError(f"unsupported value at offset {offset}")
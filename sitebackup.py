@@ -16,10 +16,22 @@ from pathlib import Path
 from typing import Any
 
 from backup import Backup
+from backup.exclusion import Exclusion
 from backup.source import SourceFactory, SourceMultipleError
 from backup.target import Target
-from backup.target.s3 import S3
-from backup.thinning import ThinningStrategy
+from backup.target.local import LocalError, LocalTarget
+from backup.target.s3 import (
+    DATED,
+    FLAT,
+    S3,
+    VERIFY_ETAG,
+    VERIFY_FULL,
+    VERIFY_SAMPLE,
+    S3Error,
+    S3Tuning,
+)
+from backup.target.snapshot import SnapshotTarget
+from backup.thinning import ThinningStrategy, ThinOutStrategy
 from backup.utils.mail import Mailer, Recipient, Sender
 
 """
@@ -103,6 +115,38 @@ def dir_argument(string: str) -> str:
     return string
 
 
+def size_argument(string: str) -> int:
+    """Helper for argparse
+    to convert the given argument into a number of bytes.
+    """
+    import humanfriendly
+
+    try:
+        return humanfriendly.parse_size(string, binary=True)
+    except humanfriendly.InvalidSize as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def patterns_argument(string: str) -> list[str]:
+    """Helper for argparse
+    to read exclusion patterns from the given file.
+    """
+    try:
+        with open(string) as f:
+            return f.read().splitlines()
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"can't read {string!r}: {e}") from e
+
+
+def nth_argument(values: list[str] | None, n: int) -> str | None:
+    """Helper for repeated arguments
+    to get the value for the n-th occurrence (defaults to the last value).
+    """
+    if not values:
+        return None
+    return values[n] if n < len(values) else values[-1]
+
+
 class ArgumentParser(argparse.ArgumentParser):
     """ArgumentParser with human friendly help."""
 
@@ -172,7 +216,7 @@ def main(args: list[str] | None = None) -> None:
         action="store",
         metavar="STRATEGY",
         type=functools.partial(value_argument, callee=ThinningStrategy.from_argument),
-        help="thin out backups at targets (except local target) using the specified strategy",
+        help="thin out backups at targets using the specified strategy",
     )
 
     group_db = parser.add_argument_group("database backup options", "")
@@ -202,6 +246,60 @@ def main(args: list[str] | None = None) -> None:
         help="prefix for table names in wordpress db",
     )
 
+    group_fs = parser.add_argument_group("filesystem backup options", "")
+    group_fs.add_argument(
+        "--exclude",
+        action="append",
+        dest="patterns",
+        metavar="PATTERN",
+        help="exclude files matching the gitignore-style pattern",
+    )
+    group_fs.add_argument(
+        "--include",
+        action="append",
+        dest="patterns",
+        metavar="PATTERN",
+        type=lambda pattern: "!" + pattern,
+        help="include files matching the pattern even if excluded before",
+    )
+    group_fs.add_argument(
+        "--exclude-from",
+        action="extend",
+        dest="patterns",
+        metavar="FILE",
+        type=patterns_argument,
+        help="read exclude patterns from file",
+    )
+    group_fs.add_argument(
+        "--max-file-size",
+        action="store",
+        metavar="SIZE",
+        type=size_argument,
+        help="exclude files larger than the given size",
+    )
+    group_fs.add_argument(
+        "--no-default-excludes",
+        action="store_true",
+        help="do not exclude regenerable files known for the instance",
+    )
+    group_fs.add_argument(
+        "--partitions",
+        action="store_true",
+        help="store closed parts (like uploads of past months) in archives of their own",
+    )
+    group_fs.add_argument(
+        "--skip-generated",
+        action="store_true",
+        help="leave out files which can be generated again (like image thumbnails)",
+    )
+    group_fs.add_argument(
+        "--reference-store",
+        action="store",
+        metavar="DIR",
+        type=dir_argument,
+        help="leave out files of core, plugins and themes matching a release in the store",
+    )
+
     group_local = parser.add_argument_group(
         "local target", "options for storing the backup archive on local filesystem"
     )
@@ -215,21 +313,138 @@ def main(args: list[str] | None = None) -> None:
         type=dir_argument,
         help="local directory to store backup archive",
     )
+    group_local.add_argument(
+        "--snapshot",
+        action="store",
+        metavar="DIR",
+        type=dir_argument,
+        help="local directory to keep hardlinked snapshots of the filesystem in",
+    )
+    group_local.add_argument(
+        "--snapshot-quick",
+        action="store_true",
+        help="share files with the last snapshot by size and time, without hashes",
+    )
+
+    group_state = parser.add_argument_group(
+        "state options", "options for keeping state between backups"
+    )
+    group_state.add_argument(
+        "--statedir",
+        action="store",
+        metavar="DIR",
+        type=dir_argument,
+        help="directory to keep the file index in (defaults to attic)",
+    )
+    group_state.add_argument(
+        "--incremental",
+        action="store_true",
+        help="archive only files changed since they were archived before",
+    )
+    group_state.add_argument(
+        "--journal",
+        action="store",
+        metavar="FILE",
+        help="journal of changed files written by sitewatch (for incremental mode)",
+    )
 
     group_s3 = parser.add_argument_group(
-        "s3 target", "options for copying the backup archive to a s3 service"
+        "s3 target",
+        "options for copying the backup archive to s3 services (repeat for several)",
     )
     group_s3.add_argument(
-        "--s3", action="store", metavar="HOST", help="host for s3 server"
+        "--s3", action="append", metavar="HOST", help="host for s3 server"
     )
     group_s3.add_argument(
-        "--s3accesskey", action="store", metavar="KEY", help="access key for s3 server"
+        "--s3accesskey",
+        action="append",
+        metavar="KEY",
+        help="access key for s3 server",
     )
     group_s3.add_argument(
-        "--s3secretkey", action="store", metavar="KEY", help="secret key for s3 server"
+        "--s3secretkey",
+        action="append",
+        metavar="KEY",
+        help="secret key for s3 server",
     )
     group_s3.add_argument(
-        "--s3bucket", action="store", metavar="BUCKET", help="bucket at s3 server"
+        "--s3bucket", action="append", metavar="BUCKET", help="bucket at s3 server"
+    )
+    group_s3.add_argument(
+        "--s3-replica",
+        action="append",
+        metavar="BUCKET[@HOST]",
+        help="bucket to copy the archive to (server-side at the first s3 server)",
+    )
+    group_s3.add_argument(
+        "--s3-chunk-size",
+        action="store",
+        metavar="SIZE",
+        type=size_argument,
+        help="size of parts for multipart uploads (default 8 MiB)",
+    )
+    group_s3.add_argument(
+        "--s3-concurrency",
+        action="store",
+        metavar="N",
+        type=int,
+        help="number of threads for multipart uploads (default 10)",
+    )
+    group_s3.add_argument(
+        "--s3-pool-connections",
+        action="store",
+        metavar="N",
+        type=int,
+        help="size of connection pool (default one per thread)",
+    )
+    group_s3.add_argument(
+        "--s3-io-chunk-size",
+        action="store",
+        metavar="SIZE",
+        type=size_argument,
+        help="size of buffers for reading and sending data (default 256 KiB)",
+    )
+    group_s3.add_argument(
+        "--s3-calibrate",
+        action="store_true",
+        help="probe the s3 server for the fastest settings "
+        "(uploads up to 256 MiB, cached in statedir)",
+    )
+    group_s3.add_argument(
+        "--s3-stream",
+        action="store_true",
+        help="upload the archive while it is written (local file only with --attic)",
+    )
+    group_s3.add_argument(
+        "--s3-verify",
+        action="store",
+        choices=[VERIFY_ETAG, VERIFY_SAMPLE, VERIFY_FULL],
+        help="verify archives after upload: size and etag, random ranges or all",
+    )
+    group_s3.add_argument(
+        "--s3-verify-samples",
+        action="store",
+        metavar="N",
+        type=int,
+        default=8,
+        help="number of random ranges read back by --s3-verify sample (default 8)",
+    )
+    group_s3.add_argument(
+        "--s3-layout",
+        action="store",
+        choices=[FLAT, DATED],
+        default=FLAT,
+        help="keys of new archives: in the bucket root or below label/year/month",
+    )
+    group_s3.add_argument(
+        "--s3-lifecycle",
+        action="store_true",
+        help="expire archives by lifecycle rules of the bucket instead of thinning",
+    )
+    group_s3.add_argument(
+        "--s3-migrate-layout",
+        action="store_true",
+        help="move existing archives into the layout of --s3-layout first",
     )
 
     group_report = parser.add_argument_group("report options", "")
@@ -253,6 +468,25 @@ def main(args: list[str] | None = None) -> None:
 
     arguments = parser.parse_args() if args is None else parser.parse_args(args)
 
+    statedir = arguments.statedir or arguments.attic
+    if arguments.incremental and not statedir:
+        parser.error("--incremental requires --statedir or --attic")
+    if arguments.incremental and not (arguments.attic or arguments.s3):
+        # the file index refers to archives which must be kept somewhere
+        parser.error("--incremental requires --attic or --s3")
+    if arguments.partitions and not arguments.s3:
+        parser.error("--partitions requires --s3")
+    if arguments.partitions and not statedir:
+        # the file index records the partition archives for thinning
+        parser.error("--partitions requires --statedir or --attic")
+    if arguments.s3_replica and not arguments.s3:
+        parser.error("--s3-replica requires --s3")
+    if arguments.s3_lifecycle and arguments.incremental:
+        # lifecycle rules would expire archives incremental archives refer to
+        parser.error("--s3-lifecycle can't be combined with --incremental")
+    if arguments.s3_lifecycle and not isinstance(arguments.thinning, ThinOutStrategy):
+        parser.error("--s3-lifecycle requires --thinning with days, weeks and months")
+
     # logging
     import coloredlogs
 
@@ -285,21 +519,104 @@ def main(args: list[str] | None = None) -> None:
 
     targets: list[Target] = []
 
-    if arguments.s3:
+    # replicas at the service of the first --s3 are copied there, replicas
+    # at other services are uploaded to like further targets
+    hosts = list(arguments.s3 or [])
+    replicas, buckets = [], {}
+    for replica in arguments.s3_replica or []:
+        bucket, _, host = replica.partition("@")
+        if host and host != hosts[0]:
+            hosts.append(host)
+            buckets[len(hosts) - 1] = bucket
+        else:
+            replicas.append(bucket)
+
+    for n, host in enumerate(hosts):
         # transfer backup to s3 service
+        tuning = S3Tuning(
+            **{
+                key: value
+                for key, value in [
+                    ("chunksize", arguments.s3_chunk_size),
+                    ("concurrency", arguments.s3_concurrency),
+                    ("pool_connections", arguments.s3_pool_connections),
+                    ("io_chunksize", arguments.s3_io_chunk_size),
+                ]
+                if value is not None
+            }
+        )
         s3target = S3(
-            arguments.s3,
-            arguments.s3accesskey,
-            arguments.s3secretkey,
-            arguments.s3bucket if arguments.s3bucket else source.slug,
+            host,
+            nth_argument(arguments.s3accesskey, n),
+            nth_argument(arguments.s3secretkey, n),
+            buckets.get(n) or nth_argument(arguments.s3bucket, n) or source.slug,
+            tuning=tuning,
+            **({"label": f"S3-{n + 1}"} if len(hosts) > 1 else {}),
         )
+        if n == 0 and replicas:
+            s3target.replicas = replicas
+        s3target.layout = arguments.s3_layout
+        s3target.verification = arguments.s3_verify
+        s3target.samples = arguments.s3_verify_samples
+        if arguments.s3_lifecycle:
+            s3target.lifecycle = arguments.thinning
+        if arguments.s3_calibrate:
+            try:
+                s3target.calibrate(Path(statedir) if statedir else None)
+            except S3Error as exception:
+                logging.warning(f"Site-Backup: calibration failed: {exception}")
         targets.append(s3target)
 
     for target in targets:
         logging.info(f"Site-Backup: Target is {target}")
 
+    if arguments.s3_migrate_layout:
+        for target in targets:
+            try:
+                moved = target.migrate_layout(source.slug)
+                logging.info(f"Site-Backup: Moved {moved} archives on {target}")
+            except S3Error as exception:
+                logging.error(f"Site-Backup: {exception}")
+                sys.exit(1)
+
+    if arguments.attic:
+        # keep archives in a local directory, thinned out like at the services
+        try:
+            localtarget = LocalTarget(Path(arguments.attic))
+        except LocalError as exception:
+            logging.error(f"Site-Backup: {exception}")
+            sys.exit(1)
+        logging.info(f"Site-Backup: Target is {localtarget}")
+        targets.append(localtarget)
+
+    # an archive written into the local directory itself is kept there
+    attic = arguments.attic
+    if attic and Path(attic).resolve() != Path.cwd():
+        attic = None
+
     # initialize options
 
+    exclusion = Exclusion(
+        arguments.patterns or [],
+        max_size=arguments.max_file_size,
+        defaults=not arguments.no_default_excludes,
+    )
+
+    if arguments.snapshot:
+        # mirror the filesystem with the exclusions of the archive
+        try:
+            snapshottarget = SnapshotTarget(
+                Path(arguments.snapshot),
+                source.fspath,
+                Backup.filesystem_exclusion(source, exclusion, arguments.database),
+                checksum=not arguments.snapshot_quick,
+            )
+        except LocalError as exception:
+            logging.error(f"Site-Backup: {exception}")
+            sys.exit(1)
+        logging.info(f"Site-Backup: Target is {snapshottarget}")
+        targets.append(snapshottarget)
+
     mailer = Mailer() if arguments.mail_from else None
     if mailer:
         if arguments.mail_to_admin:
@@ -316,8 +633,16 @@ def main(args: list[str] | None = None) -> None:
         database=arguments.database,
         filesystem=arguments.filesystem,
         thinning=arguments.thinning,
-        attic=arguments.attic,
+        attic=attic,
         dry=arguments.dry,
+        exclusion=exclusion,
+        statedir=statedir,
+        incremental=arguments.incremental,
+        journal=arguments.journal,
+        partitions=arguments.partitions,
+        skip_generated=arguments.skip_generated,
+        reference=arguments.reference_store,
+        stream=arguments.s3_stream,
     )
 
     if backup.error:
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""
+Script to maintain a reference store of known-good releases.
+
+Try 'python sitereference.py -h' for usage information.
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+from backup.reference import CORE, PLUGIN, THEME, ReferenceStore, ReferenceStoreError
+from sitebackup import ArgumentParser, dir_argument, get_version
+
+DESCRIPTION = """
+This script maintains a reference store of known-good releases of
+Wordpress, plugins and themes.
+
+Backups made with a reference store leave out all files matching a
+release in the store and list them in the member PRISTINE instead.
+"""
+
+EPILOG = """
+Releases are imported from the zip files offered for download (with a
+single top directory like 'wordpress' or the slug of a plugin).
+
+To restore the files left out of a backup extract the archive, then
+restore the files listed in its member PRISTINE into the extracted tree.
+
+"""
+
+
+def main(args: list[str] | None = None) -> None:
+    """Main: parse arguments and run."""
+
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s {get_version()}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        dest="loglevel",
+        const=logging.INFO,
+        default=logging.WARN,
+        help="enable log messages",
+    )
+    parser.add_argument(
+        "--store",
+        action="store",
+        metavar="DIR",
+        required=True,
+        type=dir_argument,
+        help="directory of the reference store",
+    )
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command_import = commands.add_parser("import", help="import a release")
+    command_import.add_argument(
+        "kind", action="store", choices=[CORE, PLUGIN, THEME], help="kind of release"
+    )
+    command_import.add_argument(
+        "release", action="store", metavar="VERSION", help="version of release"
+    )
+    command_import.add_argument(
+        "zipfile", action="store", metavar="ZIP", help="zip file of release"
+    )
+
+    command_restore = commands.add_parser("restore", help="restore pristine files")
+    command_restore.add_argument(
+        "listing", action="store", metavar="PRISTINE", help="member PRISTINE of backup"
+    )
+    command_restore.add_argument(
+        "root", action="store", type=dir_argument, help="directory to restore into"
+    )
+
+    arguments = parser.parse_args() if args is None else parser.parse_args(args)
+
+    # logging
+    import coloredlogs
+
+    coloredlogs.install(
+        level=arguments.loglevel,
+        format="%(asctime)s - %(filename)s:%(funcName)s - %(levelname)s - %(message)s",
+        isatty=True,
+    )
+
+    try:
+        store = ReferenceStore(Path(arguments.store))
+        if arguments.command == "import":
+            component = store.import_release(
+                arguments.kind, arguments.release, Path(arguments.zipfile)
+            )
+            print(f"Imported {component.key}")
+        else:
+            with open(arguments.listing) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            count = store.restore(entries, Path(arguments.root))
+            print(f"Restored {count} files")
+    except (OSError, ReferenceStoreError) as exception:
+        logging.error(f"Site-Reference: {exception}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
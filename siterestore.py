@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+"""
+Script to restore a backup from a S3 target.
+
+Try 'python siterestore.py -h' for usage information.
+"""
+
+import argparse
+import logging
+import sys
+import tarfile
+from pathlib import Path
+
+from backup.database import DB, RESTORE_WORKERS, DBError, restore_snapshot
+from backup.restore import RestoreError
+from backup.source.vaultwarden import VW
+from backup.target.s3 import S3, S3Error, S3Tuning
+from sitebackup import ArgumentParser, dir_argument, get_version, size_argument
+
+DESCRIPTION = """
+This script restores a backup from a S3 target into a directory.
+
+The archive is downloaded with concurrent ranged requests and extracted
+while it is downloaded, without a local copy of the archive.
+"""
+
+EPILOG = """
+The tree of the source is restored into the directory, the other members
+of the archive (like MANIFEST and the database dump) are restored next to
+it. A snapshot of a SQLite database (of Vaultwarden) is put back as
+db.sqlite3 into the directory, stale write-ahead log and shared memory
+files are removed. With --subtree only the files below the given path are restored, and
+partition archives outside the path are not downloaded at all. Unchanged
+files of an incremental archive are restored from the earlier archives
+holding them.
+
+With --db the database dump of the archive is loaded into the given
+database: the tables are created one after the other and their data is
+loaded concurrently by --db-workers sessions.
+
+To restore the files left out of a backup by a reference store, use
+'sitereference.py restore' with the member PRISTINE afterwards. Resized
+images left out with --skip-generated are listed in the member GENERATED,
+they are created again by 'wp media regenerate --only-missing' once the
+files and the database are restored.
+
+"""
+
+
+def main(args: list[str] | None = None) -> None:
+    """Main: parse arguments and run."""
+
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s {get_version()}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        dest="loglevel",
+        const=logging.INFO,
+        default=logging.WARN,
+        help="enable log messages",
+    )
+    parser.add_argument(
+        "--s3", action="store", metavar="HOST", required=True, help="s3 host"
+    )
+    parser.add_argument(
+        "--s3accesskey", action="store", metavar="KEY", help="s3 access key"
+    )
+    parser.add_argument(
+        "--s3secretkey", action="store", metavar="KEY", help="s3 secret key"
+    )
+    parser.add_argument(
+        "--s3bucket",
+        action="store",
+        metavar="BUCKET",
+        help="s3 bucket (default is the label)",
+    )
+    parser.add_argument(
+        "--s3-chunk-size",
+        action="store",
+        metavar="SIZE",
+        type=size_argument,
+        help="size of ranges downloaded at once (default 8 MiB)",
+    )
+    parser.add_argument(
+        "--s3-concurrency",
+        action="store",
+        metavar="N",
+        type=int,
+        help="number of threads for downloads (default 10)",
+    )
+    parser.add_argument(
+        "--timestamp",
+        action="store",
+        help="timestamp of the archive to restore (default is the latest)",
+    )
+    parser.add_argument(
+        "--subtree",
+        action="store",
+        metavar="PATH",
+        help="restore only the files below the given relative path",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="list the archives of the label"
+    )
+    parser.add_argument(
+        "--db", action="store", metavar="NAME", help="name of db to restore into"
+    )
+    parser.add_argument("--dbhost", action="store", metavar="HOST", help="db host")
+    parser.add_argument(
+        "--dbport", action="store", metavar="PORT", type=int, help="db port"
+    )
+    parser.add_argument("--dbuser", action="store", metavar="USER", help="db user")
+    parser.add_argument("--dbpass", action="store", metavar="PASS", help="db password")
+    parser.add_argument(
+        "--db-workers",
+        action="store",
+        metavar="N",
+        type=int,
+        default=RESTORE_WORKERS,
+        help=f"number of tables loaded concurrently (default {RESTORE_WORKERS})",
+    )
+    parser.add_argument("label", action="store", help="label of the backup")
+    parser.add_argument(
+        "root",
+        action="store",
+        nargs="?",
+        type=dir_argument,
+        help="directory to restore into",
+    )
+
+    arguments = parser.parse_args() if args is None else parser.parse_args(args)
+
+    if not arguments.list and not arguments.root:
+        parser.error("the directory to restore into is required")
+    if arguments.db and arguments.subtree:
+        parser.error("the database can't be restored with --subtree")
+
+    # logging
+    import coloredlogs
+
+    coloredlogs.install(
+        level=arguments.loglevel,
+        format="%(asctime)s - %(filename)s:%(funcName)s - %(levelname)s - %(message)s",
+        isatty=True,
+    )
+
+    tuning = S3Tuning(
+        **{
+            key: value
+            for key, value in [
+                ("chunksize", arguments.s3_chunk_size),
+                ("concurrency", arguments.s3_concurrency),
+            ]
+            if value is not None
+        }
+    )
+    s3 = S3(
+        arguments.s3,
+        arguments.s3accesskey,
+        arguments.s3secretkey,
+        arguments.s3bucket or arguments.label,
+        tuning=tuning,
+    )
+
+    try:
+        archives = s3.list_archives(arguments.label)
+        if arguments.list:
+            for archive in archives:
+                print(archive.filename)
+            return
+
+        if arguments.timestamp:
+            archives = [a for a in archives if a.timestamp == arguments.timestamp]
+        if not archives:
+            logging.error(f"Site-Restore: no archive of '{arguments.label}' found")
+            sys.exit(1)
+        archive = max(archives, key=lambda a: a.ctime)
+
+        result = s3.restore_archive(archive, Path(arguments.root), arguments.subtree)
+        print(f"Restored {result.files} files from {archive.filename}")
+        generated = Path(arguments.root) / "GENERATED"
+        if generated.is_file():
+            with open(generated) as f:
+                count = sum(1 for line in f if line.strip())
+            print(
+                f"Left out {count} generated files (listed in GENERATED),"
+                " recreate them with 'wp media regenerate --only-missing'"
+            )
+
+        snapshot = Path(arguments.root) / f"{archive.name}-db.sqlite3"
+        if snapshot.is_file():
+            result = restore_snapshot(snapshot, Path(arguments.root) / VW.DBFILE)
+            print(f"Restored {result.numberOfTables} tables into {VW.DBFILE}")
+
+        if arguments.db:
+            db = DB(
+                arguments.db,
+                arguments.dbhost,
+                arguments.dbuser,
+                arguments.dbpass,
+                None,
+                port=arguments.dbport,
+            )
+            dump = Path(arguments.root) / f"{archive.name}-db.sql"
+            result = db.restore_dump(dump, arguments.db_workers)
+            print(f"Restored {result.numberOfTables} tables into {arguments.db}")
+    except (OSError, S3Error, DBError, RestoreError, tarfile.TarError) as exception:
+        logging.error(f"Site-Restore: {exception}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""
+Script to watch a Wordpress Blog instance for changed files.
+
+Try 'python sitewatch.py -h' for usage information.
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from backup.journal import Journal, JournalError, Watcher
+from sitebackup import ArgumentParser, dir_argument, get_version
+
+DESCRIPTION = """
+This script watches the filesystem of an instance for changes.
+
+It records created, modified and deleted files into a journal, which
+allows incremental backups to skip the walk over all files.
+"""
+
+EPILOG = """
+The journal is restarted each time this script is started and records a
+reset if events got lost. In both cases the next incremental backup will
+fall back to a full scan. The same is true if this script is not running.
+Changes read by a successful backup are dropped from the journal.
+
+"""
+
+
+def main(args: list[str] | None = None) -> None:
+    """Main: parse arguments and run."""
+
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s {get_version()}",
+    )
+
+    parser.add_argument(
+        "path", action="store", type=dir_argument, help="path to wordpress instance"
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        dest="loglevel",
+        const=logging.INFO,
+        default=logging.WARN,
+        help="enable log messages",
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_const",
+        dest="loglevel",
+        const=logging.DEBUG,
+        default=logging.WARN,
+        help="enable debug messages",
+    )
+    parser.add_argument(
+        "--journal",
+        action="store",
+        metavar="FILE",
+        required=True,
+        help="journal to record changed files into",
+    )
+    parser.add_argument(
+        "--interval",
+        action="store",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="interval to collect changes before writing them to the journal",
+    )
+
+    arguments = parser.parse_args() if args is None else parser.parse_args(args)
+
+    # logging
+    import coloredlogs
+
+    coloredlogs.install(
+        level=arguments.loglevel,
+        format="%(asctime)s - %(filename)s:%(funcName)s - %(levelname)s - %(message)s",
+        isatty=True,
+    )
+
+    try:
+        watcher = Watcher(
+            Path(arguments.path),
+            Journal(Path(arguments.journal)),
+            interval=arguments.interval,
+        )
+    except JournalError as exception:
+        logging.error(f"Site-Watch: {exception}")
+        sys.exit(1)
+
+    try:
+        watcher.run()
+    except JournalError as exception:
+        logging.error(f"Site-Watch: {exception}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import hashlib
+import io
 import os
 import tarfile
 import tempfile
@@ -7,7 +9,15 @@ from unittest.mock import Mock, patch
 import humanfriendly
 import pytest
 
-from backup.archive import Archive, ArchiveFile, ArchiveResult
+from backup.archive import (
+    Archive,
+    ArchiveChecksums,
+    ArchiveFile,
+    ArchiveResult,
+    ChecksumWriter,
+    QueuedWriter,
+)
+from backup.progress import ProgressResult
 
 
 class TestArchiveResult:
@@ -114,6 +124,33 @@ class TestArchiveResult:
         assert new_result.size == 2048
 
 
+class TestQueuedWriter:
+    """Test cases for QueuedWriter class."""
+
+    def test_write(self):
+        """Test that the data is written in order and closed."""
+        fileobj = Mock()
+        writer = QueuedWriter(fileobj, 2)
+        for data in (b"a", b"b", b"c"):
+            assert writer.write(data) == 1
+        writer.close()
+        assert [c.args[0] for c in fileobj.write.call_args_list] == [b"a", b"b", b"c"]
+        fileobj.close.assert_called_once()
+
+    def test_error(self):
+        """Test that an error aborts the file object and is raised on close."""
+        fileobj = Mock()
+        fileobj.write.side_effect = OSError("disk full")
+        writer = QueuedWriter(fileobj, 2)
+        for data in (b"a", b"b", b"c"):
+            writer.write(data)
+        with pytest.raises(OSError, match="disk full"):
+            writer.close()
+        fileobj.write.assert_called_once()
+        fileobj.abort.assert_called_once()
+        fileobj.close.assert_not_called()
+
+
 class TestArchiveFile:
     """Test cases for ArchiveFile class."""
 
@@ -427,7 +464,9 @@ class TestArchive:
             with archive:
                 assert archive.tar == mock_tar
             expected_tarname = os.path.join(temp_dir, "test-20240101123456.tgz")
-            mock_open.assert_called_once_with(expected_tarname, "w:gz", debug=0)
+            mock_open.assert_called_once_with(
+                expected_tarname, "w:gz", fileobj=archive.writer, debug=0
+            )
             mock_tar.close.assert_called_once()
 
     def test_archive_context_manager_with_debug_logging(self, temp_dir):
@@ -448,11 +487,14 @@ class TestArchive:
             with archive:
                 pass
             expected_tarname = os.path.join(temp_dir, "test-20240101123456.tgz")
-            mock_open.assert_called_once_with(expected_tarname, "w:gz", debug=1)
+            mock_open.assert_called_once_with(
+                expected_tarname, "w:gz", fileobj=archive.writer, debug=1
+            )
 
-    def test_archive_context_manager_exit_error_no_tar(self):
+    def test_archive_context_manager_exit_error_no_tar(self, temp_dir):
         """Test Archive context manager exit with no tar file opened."""
         archive = Archive("test", "20240101123456")
+        archive.path = temp_dir
         with patch("backup.archive.tarfile.open") as mock_open:
             mock_open.return_value = None
             with pytest.raises(RuntimeError, match="archive not opened"):
@@ -473,11 +515,15 @@ class TestArchive:
             with patch.object(archive, "store_result") as mock_store:
                 with archive:
                     pass
-                mock_store.assert_called_once()
-                call_args = mock_store.call_args[0]
+                assert mock_store.call_count == 2
+                call_args = mock_store.call_args_list[0][0]
                 assert call_args[0] == "createArchive"
                 assert isinstance(call_args[1], ArchiveResult)
                 assert call_args[1].size == 1024
+                # the counters of writing the archive are reported as well
+                call_args = mock_store.call_args_list[1][0]
+                assert call_args[0] == "writeArchive"
+                assert isinstance(call_args[1], ProgressResult)
 
     def test_archive_add_archive_file_success(self, temp_dir):
         """Test successfully adding an ArchiveFile to archive."""
@@ -629,3 +675,74 @@ class TestArchive:
             assert manifest_file is not None
             manifest_content = manifest_file.read().decode()
             assert "Timestamp: 20240101123456" in manifest_content
+
+
+class TestChecksums:
+    def test_checksum_writer(self):
+        data = os.urandom(2500)
+        writer = ChecksumWriter(io.BytesIO(), 1000)
+        for offset in range(0, len(data), 300):
+            writer.write(data[offset : offset + 300])
+        checksums = writer.checksums()
+        assert writer.fileobj.getvalue() == data
+        assert checksums.partsize == 1000
+        assert checksums.size == 2500
+        assert checksums.sha256 == hashlib.sha256(data).hexdigest()
+        assert checksums.parts == [
+            hashlib.md5(data[offset : offset + 1000]).digest()
+            for offset in (0, 1000, 2000)
+        ]
+
+    def test_checksum_writer_empty(self):
+        checksums = ChecksumWriter(io.BytesIO(), 1000).checksums()
+        assert checksums.parts == [hashlib.md5(b"").digest()]
+
+    def test_etag(self):
+        parts = [hashlib.md5(b"a").digest(), hashlib.md5(b"b").digest()]
+        assert (
+            ArchiveChecksums(1, parts[:1], "", 1).etag()
+            == hashlib.md5(b"a").hexdigest()
+        )
+        assert ArchiveChecksums(1, parts, "", 2).etag() == (
+            hashlib.md5(b"".join(parts)).hexdigest() + "-2"
+        )
+
+    def test_archive_checksums(self, tmp_path):
+        archive = Archive("test", "20240101123456")
+        archive.path = str(tmp_path)
+        archive.partsize = 100
+        with archive:
+            archive.add_manifest("20240101123456")
+        with open(archive.tarname(), "rb") as f:
+            data = f.read()
+        assert archive.checksums.size == len(data)
+        assert archive.checksums.sha256 == hashlib.sha256(data).hexdigest()
+        assert len(archive.checksums.parts) == (len(data) + 99) // 100
+
+    def test_archive_streams(self, tmp_path):
+        stream = io.BytesIO()
+        stream.close = Mock()
+        stream.abort = Mock()
+        archive = Archive("test", "20240101123456")
+        archive.path = str(tmp_path)
+        archive.streams = [stream]
+        archive.staged = False
+        with archive:
+            archive.add_manifest("20240101123456")
+        assert not os.path.exists(archive.tarname())
+        stream.close.assert_called_once()
+        stream.abort.assert_not_called()
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar:
+            assert tar.getnames() == ["MANIFEST"]
+        assert archive.checksums.size == len(stream.getvalue())
+
+    def test_archive_streams_aborted(self, tmp_path):
+        stream = Mock()
+        archive = Archive("test", "20240101123456")
+        archive.path = str(tmp_path)
+        archive.streams = [stream]
+        with pytest.raises(ValueError):
+            with archive:
+                raise ValueError("failed")
+        stream.abort.assert_called_once()
+        stream.close.assert_not_called()
@@ -0,0 +1,350 @@
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import pytest
+
+from backup.archive import Archive
+from backup.database import (
+    BULK_LOAD,
+    DATA,
+    DB,
+    HEADER,
+    SCHEMA,
+    DBError,
+    DBRestoreResult,
+    DBResult,
+    SQLiteDB,
+    defer_indexes,
+    restore_snapshot,
+    split_dump,
+)
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "db.sqlite3"
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE users (name TEXT)")
+    connection.execute("CREATE TABLE ciphers (data BLOB)")
+    connection.executemany(
+        "INSERT INTO ciphers VALUES (?)", [(b"x" * 1000,) for _ in range(1000)]
+    )
+    connection.execute("INSERT INTO users VALUES ('alice')")
+    connection.commit()
+    yield path
+    connection.close()
+
+
+def test_not_found(tmp_path):
+    with pytest.raises(DBError):
+        SQLiteDB(tmp_path / "missing.sqlite3")
+
+
+def test_dump_to_archive(database, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the writer keeps its connection (and the write-ahead log) open
+    writer = sqlite3.connect(database)
+    writer.execute("INSERT INTO users VALUES ('bob')")
+    writer.commit()
+
+    db = SQLiteDB(database)
+    db.STEP_PAGES = 10
+    archive = Archive("test", "20240101120000")
+    with archive:
+        result = db.dump_to_archive(archive)
+    writer.close()
+    assert result.numberOfTables == 2
+    assert isinstance(result, DBResult)
+
+    with tarfile.open(archive.tarname()) as tar:
+        tar.extract(
+            "test-20240101120000-db.sqlite3", tmp_path / "restore", filter="data"
+        )
+    restored = sqlite3.connect(tmp_path / "restore" / "test-20240101120000-db.sqlite3")
+    names = [row[0] for row in restored.execute("SELECT name FROM users ORDER BY 1")]
+    assert names == ["alice", "bob"]
+    assert restored.execute("SELECT COUNT(*) FROM ciphers").fetchone() == (1000,)
+    restored.close()
+
+
+def test_snapshot_timeout(database, tmp_path):
+    # a writer changing the database after every step restarts the copy
+    writer = sqlite3.connect(database)
+    calls = []
+
+    def progress(status, remaining, total):
+        calls.append(remaining)
+        writer.execute("INSERT INTO users VALUES ('bob')")
+        writer.commit()
+
+    class Source:
+        def __init__(self, connection):
+            self.connection = connection
+
+        def backup(self, target, **kwargs):
+            if "progress" in kwargs:
+                inner = kwargs["progress"]
+
+                def both(*args):
+                    progress(*args)
+                    inner(*args)
+
+                kwargs["progress"] = both
+            self.connection.backup(target, **kwargs)
+
+    db = SQLiteDB(database)
+    db.STEP_PAGES = 10
+    db.STEP_SLEEP = 0
+    db.STEP_TIMEOUT = 0.2
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(tmp_path / "snapshot.sqlite3")
+    start = time.monotonic()
+    db.copy(Source(source), target)
+    assert time.monotonic() - start < 5
+    assert len(calls) > 1
+    assert target.execute("SELECT COUNT(*) FROM ciphers").fetchone() == (1000,)
+    target.close()
+    source.close()
+    writer.close()
+
+
+def test_restore_snapshot(database, tmp_path):
+    snapshot = tmp_path / "test-20240101120000-db.sqlite3"
+    SQLiteDB(database).snapshot(snapshot)
+
+    restored = tmp_path / "restore" / "db.sqlite3"
+    restored.parent.mkdir()
+    restored.write_bytes(b"old")
+    stale = [restored.with_name("db.sqlite3-wal"), restored.with_name("db.sqlite3-shm")]
+    for path in stale:
+        path.write_bytes(b"stale")
+
+    result = restore_snapshot(snapshot, restored)
+    assert result.numberOfTables == 2
+    assert not snapshot.exists()
+    assert not any(path.exists() for path in stale)
+    connection = sqlite3.connect(restored)
+    assert connection.execute("SELECT name FROM users").fetchall() == [("alice",)]
+    connection.close()
+
+
+def test_restore_snapshot_invalid(tmp_path):
+    snapshot = tmp_path / "test-20240101120000-db.sqlite3"
+    snapshot.write_bytes(b"not a database" * 100)
+    with pytest.raises(DBError):
+        restore_snapshot(snapshot, tmp_path / "db.sqlite3")
+    assert snapshot.exists()
+
+
+DUMP = b"""-- MariaDB dump 10.19  Distrib 10.11.6-MariaDB
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET NAMES utf8mb4 */;
+
+--
+-- Table structure for table `wp_posts`
+--
+
+DROP TABLE IF EXISTS `wp_posts`;
+CREATE TABLE `wp_posts` (
+  `ID` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `post_name` varchar(200) NOT NULL DEFAULT '',
+  `post_parent` bigint(20) unsigned NOT NULL DEFAULT 0,
+  PRIMARY KEY (`ID`),
+  KEY `post_name` (`post_name`(191)),
+  KEY `post_parent` (`post_parent`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+--
+-- Dumping data for table `wp_posts`
+--
+
+LOCK TABLES `wp_posts` WRITE;
+INSERT INTO `wp_posts` VALUES (1,'hello-world',0),(2,'about',1);
+UNLOCK TABLES;
+
+--
+-- Table structure for table `wp_options`
+--
+
+DROP TABLE IF EXISTS `wp_options`;
+CREATE TABLE `wp_options` (
+  `option_id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `option_name` varchar(191) NOT NULL DEFAULT '',
+  PRIMARY KEY (`option_id`),
+  UNIQUE KEY `option_name` (`option_name`)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4;
+
+--
+-- Dumping data for table `wp_options`
+--
+
+LOCK TABLES `wp_options` WRITE;
+INSERT INTO `wp_options` VALUES (1,'siteurl');
+UNLOCK TABLES;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+
+-- Dump completed on 2024-01-01 12:00:00
+"""
+
+
+def test_split_dump(tmp_path):
+    sections = list(split_dump(io.BytesIO(DUMP), tmp_path))
+    assert [(s.kind, s.table) for s in sections] == [
+        (HEADER, ""),
+        (SCHEMA, "wp_posts"),
+        (DATA, "wp_posts"),
+        (SCHEMA, "wp_options"),
+        (DATA, "wp_options"),
+    ]
+    assert b"SET NAMES" in sections[0].path.read_bytes()
+    # the footer is left out
+    assert b"@OLD_" not in sections[4].path.read_bytes()
+    assert sum(s.size for s in sections) < len(DUMP)
+    # rows looking like the footer are kept
+    dump = DUMP.replace(b"(1,'siteurl')", b"(1,'a=@OLD_b'),\n(2,'x')")
+    dump = dump.replace(
+        b"UNLOCK TABLES;\n/*",
+        b"/*!40000 SET @a=@OLD_A */;\n" * 2 + b"UNLOCK TABLES;\n/*",
+    )
+    data = list(split_dump(io.BytesIO(dump), tmp_path))[4].path.read_bytes()
+    assert b"(1,'a=@OLD_b')" in data
+    assert data.count(b"SET @a=@OLD_A") == 2
+    assert b"CHARACTER_SET_CLIENT" not in data and b"Dump completed" not in data
+
+    schema, keys = defer_indexes(sections[1].path.read_bytes())
+    assert keys == [
+        b"KEY `post_name` (`post_name`(191))",
+        b"KEY `post_parent` (`post_parent`)",
+    ]
+    assert b"  PRIMARY KEY (`ID`)\n) ENGINE=InnoDB" in schema
+    # only InnoDB tables without foreign keys
+    schema = sections[3].path.read_bytes()
+    assert defer_indexes(schema) == (schema, [])
+    schema = DUMP.replace(b"  KEY `post_parent`", b"  CONSTRAINT `x` FOREIGN KEY")
+    assert defer_indexes(schema)[1] == []
+
+
+@pytest.fixture
+def mysql(tmp_path, monkeypatch):
+    """Fake mysql client writing each session into a file."""
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    sessions = tmp_path / "sessions"
+    sessions.mkdir()
+    client = bin / "mysql"
+    client.write_text(
+        "#!/bin/sh\n"
+        f'cat > "{sessions}/$$.sql"\n'
+        f'if grep -q FAIL "{sessions}/$$.sql"; then echo "ERROR 1064" >&2; exit 1; fi\n'
+    )
+    client.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin}:{os.environ['PATH']}")
+    return sessions
+
+
+def test_restore_dump(tmp_path, mysql):
+    dump = tmp_path / "blog-20240101120000-db.sql"
+    dump.write_bytes(DUMP)
+    db = DB("wp", "localhost", "user", "secret", None, port=3307)
+    result = db.restore_dump(dump, workers=2)
+    assert isinstance(result, DBRestoreResult)
+    assert (result.numberOfTables, result.numberOfIndexes) == (2, 2)
+    assert "RESTORE_DUMP" in db.results
+
+    sessions = [path.read_bytes() for path in mysql.iterdir()]
+    # two schemas, two tables and the final session
+    assert len(sessions) == 5
+    assert all(session.startswith(b"-- MariaDB dump") for session in sessions)
+    (posts,) = [s for s in sessions if b"INSERT INTO `wp_posts`" in s]
+    assert posts.index(BULK_LOAD) < posts.index(b"INSERT") < posts.index(b"COMMIT")
+    assert posts.endswith(
+        b"ALTER TABLE `wp_posts` ADD KEY `post_name` (`post_name`(191)), "
+        b"ADD KEY `post_parent` (`post_parent`);\n"
+    )
+
+    dump.write_bytes(DUMP.replace(b"'about'", b"'FAIL'"))
+    with pytest.raises(DBError, match="ERROR 1064"):
+        db.restore_dump(dump)
+
+
+@pytest.fixture(scope="session")
+def mariadb():
+    """Start a local MariaDB server for integration testing."""
+    server = shutil.which("mariadbd") or shutil.which("mysqld")
+    install = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+    if not server or not install or not shutil.which("mysql"):
+        pytest.skip("MariaDB not installed")
+
+    directory = tempfile.mkdtemp(prefix="mariadb_test_")
+    socket = os.path.join(directory, "mysql.sock")
+    subprocess.run(
+        [
+            install,
+            "--no-defaults",
+            f"--datadir={directory}/data",
+            "--auth-root-authentication-method=normal",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    process = subprocess.Popen(
+        [
+            server,
+            "--no-defaults",
+            f"--datadir={directory}/data",
+            f"--socket={socket}",
+            "--port=3310",
+            "--bind-address=127.0.0.1",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        root = ["mysql", "--no-defaults", f"--socket={socket}", "--user=root"]
+        for _ in range(60):
+            if (
+                subprocess.run(
+                    root + ["--execute=select 1"], capture_output=True
+                ).returncode
+                == 0
+            ):
+                break
+            time.sleep(0.5)
+        subprocess.run(
+            root
+            + [
+                "--execute=create database wp; "
+                "create user 'test'@'%' identified by 'test'; "
+                "grant all on wp.* to 'test'@'%'"
+            ],
+            check=True,
+        )
+        yield DB("wp", "127.0.0.1", "test", "test", "wp_", port=3310)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.mark.integration
+def test_restore_dump_mariadb(mariadb, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dump = tmp_path / "dump.sql"
+    dump.write_bytes(DUMP)
+    result = mariadb.restore_dump(dump)
+    assert result.numberOfTables == 2
+
+    archive = Archive("test", "20240101120000")
+    with archive:
+        assert mariadb.dump_to_archive(archive).numberOfTables == 2
+    with tarfile.open(archive.tarname()) as tar:
+        data = tar.extractfile("test-20240101120000-db.sql").read()
+    assert b"KEY `post_parent`" in data
+    assert b"(2,'about',1)" in data
@@ -0,0 +1,96 @@
+import pytest
+
+from backup.exclusion import Exclusion, ExclusionRule
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    ["", "   ", "# comment", "/"],
+)
+def test_parse_ignores_empty_patterns_and_comments(pattern):
+    assert ExclusionRule.parse(pattern) is None
+
+
+def test_parse_flags():
+    rule = ExclusionRule.parse("!/wp-content/cache/")
+    assert rule is not None
+    assert rule.negate is True
+    assert rule.dironly is True
+
+
+@pytest.mark.parametrize(
+    "pattern, path, is_dir, expected",
+    [
+        # unanchored patterns match at any level
+        ("*.log", "debug.log", False, True),
+        ("*.log", "wp-content/debug.log", False, True),
+        ("*.log", "wp-content/debug.txt", False, False),
+        ("node_modules/", "wp-content/themes/x/node_modules", True, True),
+        # directory only patterns do not match files
+        ("node_modules/", "wp-content/node_modules", False, False),
+        # anchored patterns match relative to the root only
+        ("/assets/", "assets", True, True),
+        ("/assets/", "themes/assets", True, False),
+        ("wp-content/cache/", "wp-content/cache", True, True),
+        ("wp-content/cache/", "x/wp-content/cache", True, False),
+        # asterisks do not match slashes
+        ("wp-content/*.zip", "wp-content/a.zip", False, True),
+        ("wp-content/*.zip", "wp-content/a/b.zip", False, False),
+        # double asterisks match any number of directories
+        ("**/cache", "a/b/cache", True, True),
+        ("**/cache", "cache", True, True),
+        ("a/**/z", "a/z", False, True),
+        ("a/**/z", "a/b/c/z", False, True),
+        ("a/**", "a/b/c", False, True),
+        # character classes and escapes
+        ("file[0-9].txt", "file1.txt", False, True),
+        ("file[!0-9].txt", "file1.txt", False, False),
+        ("\\!important", "!important", False, True),
+        ("?.txt", "a.txt", False, True),
+        ("?.txt", "ab.txt", False, False),
+    ],
+)
+def test_excludes_pattern(pattern, path, is_dir, expected):
+    assert Exclusion([pattern]).excludes(path, is_dir) is expected
+
+
+def test_excludes_last_matching_pattern_wins():
+    exclusion = Exclusion(["*.log", "!keep.log", "/keep.log"])
+    assert exclusion.excludes("other.log") is True
+    assert exclusion.excludes("sub/keep.log") is False
+    assert exclusion.excludes("keep.log") is True
+
+
+def test_excludes_by_size():
+    exclusion = Exclusion(max_size=100)
+    assert exclusion.excludes("small", size=100) is False
+    assert exclusion.excludes("large", size=101) is True
+    # size limits do not apply to directories
+    assert exclusion.excludes("large", is_dir=True, size=4096) is False
+
+
+def test_excludes_nothing_without_patterns():
+    exclusion = Exclusion()
+    assert exclusion.excludes("anything") is False
+    assert exclusion.excludes("anything", is_dir=True) is False
+
+
+def test_profile_prepends_defaults():
+    exclusion = Exclusion(["!/wp-content/cache/"], max_size=10)
+    profiled = exclusion.profile(["/wp-content/cache/"])
+    assert profiled.patterns == ("/wp-content/cache/", "!/wp-content/cache/")
+    assert profiled.max_size == 10
+    assert profiled.excludes("wp-content/cache", is_dir=True) is False
+
+
+def test_profile_without_defaults():
+    exclusion = Exclusion(["*.log"], defaults=False)
+    assert exclusion.profile(["/wp-content/cache/"]) is exclusion
+
+
+def test_equality_and_str():
+    assert Exclusion(["a"], max_size=1) == Exclusion(["a"], max_size=1)
+    assert Exclusion(["a"]) != Exclusion(["b"])
+    assert str(Exclusion(["a", "# comment"], max_size=1024)) == (
+        "1 rules, max size 1.02 KB"
+    )
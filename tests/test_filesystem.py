@@ -0,0 +1,302 @@
+import json
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from backup.archive import Archive
+from backup.exclusion import Exclusion
+from backup.filesystem import FS, FSError, FSNotFoundError, FSResult
+from backup.index import FileIndex, hash_file
+from backup.journal import CHANGED, DELETED, Journal
+from backup.partition import Partition, PartitionArchive
+from backup.target.local import LocalTarget
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / "site"
+    (root / "wp-content" / "cache" / "deep").mkdir(parents=True)
+    (root / "wp-content" / "cache" / "deep" / "page.html").write_text("cached")
+    (root / "wp-content" / "uploads").mkdir()
+    (root / "wp-content" / "uploads" / "image.jpg").write_bytes(b"x" * 100)
+    (root / "wp-content" / "uploads" / "movie.mp4").write_bytes(b"x" * 1000)
+    (root / "index.php").write_text("<?php")
+    (root / "debug.log").write_text("log")
+    return root
+
+
+def test_not_found(tmp_path):
+    with pytest.raises(FSNotFoundError):
+        FS(tmp_path / "missing")
+
+
+def test_walk_is_sorted_and_complete(site):
+    names = [name for _path, name, _stat in FS(site).walk()]
+    assert names == [
+        "debug.log",
+        "index.php",
+        "wp-content",
+        "wp-content/cache",
+        "wp-content/cache/deep",
+        "wp-content/cache/deep/page.html",
+        "wp-content/uploads",
+        "wp-content/uploads/image.jpg",
+        "wp-content/uploads/movie.mp4",
+    ]
+
+
+def test_walk_does_not_descend_into_excluded_directories(site, monkeypatch):
+    fs = FS(site, Exclusion(["/wp-content/cache/", "*.log"], max_size=500))
+
+    scanned = []
+    walk = fs._walk
+
+    def spy(directory, prefix):
+        scanned.append(prefix)
+        return walk(directory, prefix)
+
+    monkeypatch.setattr(fs, "_walk", spy)
+
+    names = [name for _path, name, _stat in fs.walk()]
+    assert names == [
+        "index.php",
+        "wp-content",
+        "wp-content/uploads",
+        "wp-content/uploads/image.jpg",
+    ]
+    assert fs.excluded == 3
+    assert "wp-content/cache/" not in scanned
+
+
+def test_add_to_archive(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fs = FS(site, Exclusion(["/wp-content/cache/"]))
+    archive = Archive("test", "20240101120000")
+    with archive:
+        result = fs.add_to_archive(archive)
+    assert result == FSResult(files=4, directories=2, excluded=1, size=1108)
+
+    with tarfile.open(archive.tarname()) as tar:
+        names = tar.getnames()
+    assert names[0] == "test-20240101120000"
+    assert "test-20240101120000/wp-content/uploads/movie.mp4" in names
+    assert not any("cache" in name for name in names)
+
+
+def test_incremental_needs_index(site):
+    with pytest.raises(FSError):
+        FS(site, incremental=True)
+
+
+def archive_files(fs, name):
+    archive = Archive("test", name)
+    with archive:
+        result = fs.add_to_archive(archive)
+        archive.add_manifest(archive.timestamp)
+    with tarfile.open(archive.tarname()) as tar:
+        listing = [json.loads(line) for line in tar.extractfile("FILES")]
+        manifest = tar.extractfile("MANIFEST").read().decode()
+        names = tar.getnames()
+    return result, listing, manifest, names
+
+
+def test_add_to_archive_incremental(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    index = FileIndex(tmp_path / "test.index")
+
+    # first run archives everything and lists hashes
+    fs = FS(site, index=index, incremental=True)
+    result, listing, _manifest, _names = archive_files(fs, "20240101120000")
+    assert result.files == 5
+    assert result.unchanged == 0
+    assert {entry["archive"] for entry in listing} == {"test-20240101120000"}
+    index.commit()
+    index.close()
+
+    # second run archives changed files only
+    (site / "index.php").write_text("<?php // changed")
+    (site / "debug.log").unlink()
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, incremental=True)
+    result, listing, manifest, names = archive_files(fs, "20240102120000")
+    assert result.files == 1
+    assert result.unchanged == 3
+    assert "test-20240102120000/index.php" in names
+    assert "test-20240102120000/wp-content/uploads/image.jpg" not in names
+    assert "Mode: incremental" in manifest
+    archives = {entry["name"]: entry["archive"] for entry in listing}
+    assert archives["index.php"] == "test-20240102120000"
+    assert archives["wp-content/uploads/image.jpg"] == "test-20240101120000"
+    assert "debug.log" not in archives
+    # the references are kept for thinning
+    assert index.references() == {"test-20240102120000": {"test-20240101120000"}}
+    index.close()
+
+
+def test_add_to_archive_incremental_with_journal(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    index = FileIndex(tmp_path / "test.index")
+    journal = Journal(tmp_path / "test.journal")
+    journal.create(site)
+
+    # first run needs a full scan
+    fs = FS(site, index=index, incremental=True, journal=journal)
+    result, _listing, _manifest, _names = archive_files(fs, "20240101120000")
+    assert result.files == 5
+    index.commit()
+    index.close()
+
+    # second run looks at the changed entries only
+    (site / "index.php").write_text("<?php // changed")
+    (site / "debug.log").unlink()
+    (site / "wp-content" / "new").mkdir()
+    (site / "wp-content" / "new" / "file.txt").write_text("new")
+    journal.record(
+        {
+            "index.php": CHANGED,
+            "debug.log": DELETED,
+            "wp-content/new": CHANGED,
+            "wp-content/new/file.txt": CHANGED,
+        }
+    )
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, incremental=True, journal=journal)
+    monkeypatch.setattr(fs, "walk", None)
+    result, listing, _manifest, names = archive_files(fs, "20240102120000")
+    assert result.files == 2
+    # the directories known to the index are archived, too
+    assert result.directories == 5
+    assert "test-20240102120000/wp-content/new/file.txt" in names
+    archives = {entry["name"]: entry["archive"] for entry in listing}
+    assert "debug.log" not in archives
+    assert archives["index.php"] == "test-20240102120000"
+    assert archives["wp-content/uploads/image.jpg"] == "test-20240101120000"
+    index.close()
+    journal.close()
+
+
+def test_restore_incremental_with_journal(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (site / "wp-content" / "empty").mkdir()
+    (site / "wp-content" / "empty").chmod(0o700)
+    (site / "latest.jpg").symlink_to("wp-content/uploads/image.jpg")
+    attic = tmp_path / "attic"
+    attic.mkdir()
+    target = LocalTarget(attic)
+    index = FileIndex(tmp_path / "test.index")
+    journal = Journal(tmp_path / "test.journal")
+    journal.create(site)
+    fs = FS(site, index=index, incremental=True, journal=journal)
+    archive_files(fs, "20240101120000")
+    target.transfer_archive(Archive("test", "20240101120000"))
+    index.commit()
+    index.close()
+
+    # the unchanged symlink and empty directory are restored
+    (site / "index.php").write_text("<?php // changed")
+    journal.record({"index.php": CHANGED})
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, incremental=True, journal=journal)
+    archive_files(fs, "20240102120000")
+    target.transfer_archive(Archive("test", "20240102120000"))
+    index.close()
+    journal.close()
+
+    root = tmp_path / "restored"
+    target.restore_archive(Archive("test", "20240102120000"), root)
+    assert (root / "index.php").read_text() == "<?php // changed"
+    assert (root / "wp-content" / "uploads" / "image.jpg").read_bytes() == b"x" * 100
+    assert (root / "latest.jpg").readlink() == Path("wp-content/uploads/image.jpg")
+    assert (root / "wp-content" / "empty").is_dir()
+    assert (root / "wp-content" / "empty").stat().st_mode & 0o777 == 0o700
+
+
+def test_partitions(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    partition = Partition("uploads", "wp-content/uploads")
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, partitions=[partition])
+
+    # the digest only changes with the content of the partition
+    digest, files = fs.partition_digest(partition)
+    assert [name for name, _stat, _digest in files] == [
+        "wp-content/uploads/image.jpg",
+        "wp-content/uploads/movie.mp4",
+    ]
+    assert fs.partition_digest(partition)[0] == digest
+    assert index.cached == 2
+    (site / "index.php").write_text("<?php // changed")
+    assert fs.partition_digest(partition)[0] == digest
+    (site / "wp-content" / "uploads" / "image.jpg").write_bytes(b"y" * 100)
+    assert fs.partition_digest(partition)[0] != digest
+    digest, files = fs.partition_digest(partition)
+
+    partarchive = PartitionArchive("test", partition, digest)
+    assert partarchive.filename == f"test.uploads.{digest[:16]}.partition.tgz"
+    assert PartitionArchive.is_partition(partarchive.filename)
+    with partarchive:
+        result = fs.add_partition_to_archive(partarchive)
+    assert result == FSResult(files=2, directories=1, excluded=0, size=1100)
+    fs.record_partition(partarchive, files)
+
+    # the filesystem archive leaves the partition out but lists its files
+    result, listing, _manifest, names = archive_files(fs, "20240101120000")
+    assert result.files == 3
+    assert not any("uploads" in name for name in names)
+    archives = {entry["name"]: entry["archive"] for entry in listing}
+    assert archives["wp-content/uploads/image.jpg"] == partarchive.name
+    assert archives["index.php"] == "test-20240101120000"
+    index.close()
+
+
+def test_generated_files(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (site / "wp-content" / "uploads" / "image-150x150.jpg").write_bytes(b"x" * 10)
+    generated = {"wp-content/uploads/image-150x150.jpg": "wp-content/uploads/image.jpg"}
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, generated=generated)
+    result, listing, manifest, names = archive_files(fs, "20240101120000")
+    assert result.excluded == 1
+    assert "test-20240101120000/wp-content/uploads/image-150x150.jpg" not in names
+    assert "wp-content/uploads/image-150x150.jpg" not in [e["name"] for e in listing]
+    assert "Generated: 1" in manifest
+    with tarfile.open("test-20240101120000.tgz") as tar:
+        lines = [json.loads(line) for line in tar.extractfile("GENERATED")]
+    assert lines == [
+        {
+            "name": "wp-content/uploads/image-150x150.jpg",
+            "original": "wp-content/uploads/image.jpg",
+        }
+    ]
+    index.close()
+
+
+def test_pristine_files(site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pristine = {
+        "index.php": (hash_file(site / "index.php"), "core/wordpress/6.4.2"),
+        "debug.log": ("0" * 64, "core/wordpress/6.4.2"),
+    }
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, incremental=True, pristine=pristine)
+    result, listing, manifest, names = archive_files(fs, "20240101120000")
+    assert result.pristine == 1
+    assert "test-20240101120000/index.php" not in names
+    assert "test-20240101120000/debug.log" in names
+    assert "Pristine: 1" in manifest
+    archives = {entry["name"]: entry["archive"] for entry in listing}
+    assert archives["index.php"] == "core/wordpress/6.4.2"
+    index.commit()
+    index.close()
+
+    # modified files are archived again
+    (site / "index.php").write_text("<?php // modified")
+    index = FileIndex(tmp_path / "test.index")
+    fs = FS(site, index=index, incremental=True, pristine=pristine)
+    result, listing, manifest, names = archive_files(fs, "20240102120000")
+    assert result.pristine == 0
+    assert "test-20240102120000/index.php" in names
+    archives = {entry["name"]: entry["archive"] for entry in listing}
+    assert archives["index.php"] == "test-20240102120000"
+    index.close()
@@ -0,0 +1,131 @@
+import hashlib
+
+import pytest
+
+from backup.index import FileIndex, FileIndexError, hash_file
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"content")
+    return path
+
+
+def test_hash_file(file):
+    assert hash_file(file) == hashlib.sha256(b"content").hexdigest()
+
+
+def test_open_invalid_index(tmp_path):
+    with pytest.raises(FileIndexError):
+        FileIndex(tmp_path / "missing" / "test.index")
+
+
+def test_digest_is_cached_while_stat_unchanged(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    digest = index.digest(file, "file.txt", file.stat())
+    index.commit()
+    index.close()
+
+    index = FileIndex(tmp_path / "test.index")
+    assert index.generation == 2
+    assert index.digest(file, "file.txt", file.stat()) == digest
+    assert (index.hashed, index.cached) == (0, 1)
+
+    file.write_bytes(b"changed content")
+    assert index.digest(file, "file.txt", file.stat()) == hash_file(file)
+    assert (index.hashed, index.cached) == (1, 1)
+    index.close()
+
+
+def test_lookup_checks_stat(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    index.update("file.txt", file.stat(), "digest", "archive")
+    assert index.lookup("file.txt").archive == "archive"
+    assert index.lookup("file.txt", file.stat()).digest == "digest"
+    file.write_bytes(b"other")
+    assert index.lookup("file.txt", file.stat()) is None
+    assert index.lookup("other.txt") is None
+    index.close()
+
+
+def test_update_keeps_archive(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    index.update("file.txt", file.stat(), "digest", "archive")
+    index.update("file.txt", file.stat(), "digest")
+    assert index.lookup("file.txt").archive == "archive"
+    index.close()
+
+
+def test_rollback_discards_changes(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    index.update("file.txt", file.stat(), "digest")
+    index.rollback()
+    index.close()
+
+    index = FileIndex(tmp_path / "test.index")
+    assert index.lookup("file.txt") is None
+    index.close()
+
+
+def test_sweep_removes_unseen_entries(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    index.update("file.txt", file.stat(), "digest")
+    index.update("gone.txt", file.stat(), "digest")
+    index.commit()
+    index.close()
+
+    index = FileIndex(tmp_path / "test.index")
+    index.update("file.txt", file.stat(), "digest")
+    index.sweep()
+    index.commit()
+    assert index.lookup("file.txt") is not None
+    assert index.lookup("gone.txt") is None
+    index.close()
+
+
+def test_remove_entries_below(tmp_path, file):
+    index = FileIndex(tmp_path / "test.index")
+    for name in ["dir", "dir/a", "dir/sub/b", "dir.txt", "dir0"]:
+        index.update(name, file.stat(), "digest")
+    index.remove("dir")
+    assert [entry.name for entry in index.entries()] == ["dir.txt", "dir0"]
+    index.close()
+
+
+def test_state(tmp_path):
+    index = FileIndex(tmp_path / "test.index")
+    assert index.get_state("key") is None
+    index.set_state("key", "value")
+    index.set_state("key", "other")
+    assert index.get_state("key") == "other"
+    index.close()
+
+
+def test_references(tmp_path):
+    index = FileIndex(tmp_path / "test.index")
+    index.add_references("blog-2", ["blog-1", "blog-2"])
+    index.add_references("blog-3", ["blog-1", "blog-2"])
+    index.commit()
+    index.close()
+
+    index = FileIndex(tmp_path / "test.index")
+    assert index.references() == {"blog-2": {"blog-1"}, "blog-3": {"blog-1", "blog-2"}}
+    index.close()
+
+
+def test_nodes(tmp_path):
+    index = FileIndex(tmp_path / "test.index")
+    for name in ("a", "a/b", "c", "link"):
+        index.add_node(name)
+    index.remove("a")
+    index.commit()
+    index.close()
+
+    # nodes not seen during a full walk are swept
+    index = FileIndex(tmp_path / "test.index")
+    assert index.nodes() == ["c", "link"]
+    index.add_node("link")
+    index.sweep()
+    assert index.nodes() == ["link"]
+    index.close()
@@ -0,0 +1,204 @@
+import json
+import os
+
+import pytest
+
+from backup.journal import (
+    CHANGED,
+    DELETED,
+    EVENT,
+    IN_CREATE,
+    IN_ISDIR,
+    IN_Q_OVERFLOW,
+    Journal,
+    JournalError,
+    Watcher,
+)
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "site"
+    (root / "wp-content").mkdir(parents=True)
+    return root
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(tmp_path / "site.journal")
+    yield journal
+    journal.close()
+
+
+def test_changes_without_watcher(root, journal):
+    assert journal.changes(root, None) == (None, "")
+
+
+def test_changes(root, journal):
+    journal.create(root)
+    # without a position a full scan is needed
+    names, position = journal.changes(root, None)
+    assert names is None
+
+    journal.record({"a.txt": CHANGED, "b.txt": DELETED})
+    names, position = journal.changes(root, position)
+    assert names == {"a.txt", "b.txt"}
+
+    # nothing changed since the position
+    assert journal.changes(root, position) == (set(), position)
+
+    journal.record({"c.txt": CHANGED})
+    names, position = journal.changes(root, position)
+    assert names == {"c.txt"}
+
+
+def test_changes_after_reset(root, journal):
+    journal.create(root)
+    _names, position = journal.changes(root, None)
+    journal.record({"a.txt": CHANGED})
+    journal.reset()
+    journal.record({"b.txt": CHANGED})
+    names, new_position = journal.changes(root, position)
+    assert names is None
+    assert new_position != position
+    assert journal.changes(root, new_position) == (set(), new_position)
+
+
+def test_changes_after_restart(root, journal):
+    journal.create(root)
+    _names, position = journal.changes(root, None)
+    journal.close()
+    journal.create(root)
+    names, new_position = journal.changes(root, position)
+    assert names is None
+    assert new_position.startswith(journal.id)
+
+
+def test_changes_for_other_root(root, tmp_path, journal):
+    journal.create(root)
+    assert journal.changes(tmp_path, None) == (None, "")
+
+
+def test_changes_before_create(root, journal):
+    # the journal is locked while the watches are added
+    journal.lock()
+    assert journal.watched()
+    assert journal.changes(root, None) == (None, "")
+
+
+def test_compact(root, journal):
+    journal.create(root)
+    _names, position = journal.changes(root, None)
+    journal.record({"a.txt": CHANGED})
+    names, position = journal.changes(root, position)
+    assert names == {"a.txt"}
+    journal.record({"b.txt": CHANGED})
+
+    # only the records after the acknowledged position are kept
+    journal.acknowledge(position)
+    assert journal.compact()
+    assert not journal.ackpath.exists()
+    with open(journal.path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["since"] == position
+    assert records[1:] == [{"op": CHANGED, "path": "b.txt"}]
+    names, new_position = journal.changes(root, position)
+    assert names == {"b.txt"}
+    assert new_position.startswith(journal.id)
+    journal.record({"c.txt": CHANGED})
+    assert journal.changes(root, new_position)[0] == {"c.txt"}
+
+    # acknowledgements of earlier journals are ignored
+    journal.acknowledge(position)
+    assert not journal.compact()
+    assert not journal.compact()
+
+
+def test_create_locked(root, journal):
+    journal.create(root)
+    with pytest.raises(JournalError):
+        Journal(journal.path).create(root)
+
+
+def test_changes_ignores_incomplete_record(root, journal):
+    journal.create(root)
+    _names, position = journal.changes(root, None)
+    journal.handle.write(b'{"op": "M", "pa')
+    journal.handle.flush()
+    names, position = journal.changes(root, position)
+    assert names == set()
+    journal.handle.write(b'th": "a.txt"}\n')
+    journal.handle.flush()
+    assert journal.changes(root, position)[0] == {"a.txt"}
+
+
+def test_watcher_records_changes(root, journal):
+    watcher = Watcher(root, journal, interval=0.01)
+    journal.create(root)
+    watcher.watch("")
+
+    (root / "wp-content" / "new").mkdir()
+    (root / "index.php").write_text("<?php")
+    watcher.handle(os.read(watcher.fd, 64 * 1024))
+    # the new directory is watched, too
+    (root / "wp-content" / "new" / "file.txt").write_text("new")
+    (root / "index.php").unlink()
+    watcher.handle(os.read(watcher.fd, 64 * 1024))
+
+    assert watcher.changes == {
+        "wp-content/new": CHANGED,
+        "wp-content/new/file.txt": CHANGED,
+        "index.php": DELETED,
+    }
+    watcher.run(iterations=1)
+    with open(journal.path) as f:
+        records = [json.loads(line) for line in f][1:]
+    assert {record["path"] for record in records} == {
+        "wp-content/new",
+        "wp-content/new/file.txt",
+        "index.php",
+    }
+    watcher.close()
+
+
+def test_watcher_watches_before_create(root, journal):
+    watcher = Watcher(root, journal)
+    contents = []
+    watch = watcher.watch
+
+    def record_content(name):
+        contents.append(journal.path.read_bytes())
+        watch(name)
+
+    watcher.watch = record_content
+    watcher.run(iterations=0)
+    # the journal is started once all directories are watched
+    assert set(contents) == {b""}
+    assert sorted(watcher.watches.values()) == ["", "wp-content"]
+    assert journal.changes(root, None)[1].startswith(journal.id)
+    watcher.close()
+
+
+def test_watcher_overflow(root, journal):
+    watcher = Watcher(root, journal)
+    journal.create(root)
+    watcher.watch("")
+    watcher.changes["a.txt"] = CHANGED
+    watcher.handle(EVENT.pack(-1, IN_Q_OVERFLOW, 0, 0))
+    assert watcher.changes == {}
+    with open(journal.path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[-1] == {"op": "R"}
+    watcher.close()
+
+
+def test_watcher_new_directory_event(root, journal):
+    watcher = Watcher(root, journal)
+    journal.create(root)
+    watcher.watch("")
+    (root / "added").mkdir()
+    name = b"added\0\0\0"
+    wd = next(iter(watcher.watches))
+    watcher.handle(EVENT.pack(wd, IN_CREATE | IN_ISDIR, 0, len(name)) + name)
+    assert "added" in watcher.watches.values()
+    watcher.close()
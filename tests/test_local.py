@@ -0,0 +1,192 @@
+import datetime
+import errno
+import json
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+
+from backup import Backup
+from backup.archive import Archive
+from backup.target.local import (
+    COPY,
+    HARDLINK,
+    INDEX_FILENAME,
+    REFLINK,
+    LocalError,
+    LocalResult,
+    LocalTarget,
+    LocalThinningResult,
+)
+from backup.thinning import LatestStrategy, ThinOutStrategy
+
+
+@pytest.fixture
+def attic(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "attic"
+    path.mkdir()
+    return path
+
+
+def write_archive(label, timestamp):
+    archive = Archive(label, timestamp)
+    with open(archive.filename, "wb") as f:
+        f.write(timestamp.encode())
+    return archive
+
+
+def test_not_found(tmp_path):
+    with pytest.raises(LocalError):
+        LocalTarget(tmp_path / "missing")
+
+
+def test_transfer_archive(attic):
+    target = LocalTarget(attic)
+    archive = write_archive("blog", "20240101120000")
+    assert not target.contains_archive(archive)
+
+    result = target.transfer_archive(archive)
+    assert result.size == 14
+    assert result.method == HARDLINK
+    assert target.contains_archive(archive)
+    assert "TRANSFER_ARCHIVE" in target.results
+    assert target.transfer_archive(archive, dry=True) == LocalResult(0, 0, None)
+
+    # other filesystems: the archive is cloned or copied
+    os.remove(attic / archive.filename)
+    other = write_archive("blog", "20240102120000")
+    with patch("backup.target.local.os.link", side_effect=OSError(errno.EXDEV, "")):
+        result = target.transfer_archive(other)
+    assert result.method in (REFLINK, COPY)
+    assert (attic / other.filename).read_bytes() == b"20240102120000"
+    assert not list(attic.glob(".*.tmp"))
+
+    # an archive written into the directory is kept as it is
+    target = LocalTarget(attic.parent)
+    assert target.transfer_archive(other).method is None
+
+
+def test_list_archives(attic):
+    target = LocalTarget(attic)
+    for timestamp in ["20240101120000", "20240102120000", "20240103120000"]:
+        target.transfer_archive(write_archive("blog", timestamp))
+    target.transfer_archive(write_archive("shop", "20240101120000"))
+    (attic / "blog.uploads-2023.0123456789abcdef.partition.tgz").touch()
+    (attic / "notes.txt").touch()
+
+    archives = target.list_archives("blog")
+    assert [a.timestamp for a in archives] == [
+        "20240101120000",
+        "20240102120000",
+        "20240103120000",
+    ]
+    assert archives[0].tarname() == str(attic / "blog-20240101120000.tgz")
+    since = datetime.datetime(2024, 1, 2)
+    assert len(target.list_archives("blog", since=since)) == 2
+    assert len(target.list_archives()) == 4
+
+    # the index is used as long as the directory is unchanged
+    index = json.loads((attic / INDEX_FILENAME).read_text())
+    assert index["mtime"] == attic.stat().st_mtime_ns
+    with patch("backup.target.local.os.scandir", side_effect=AssertionError):
+        assert len(LocalTarget(attic).list_archives("blog")) == 3
+
+    # changes by others are found
+    (attic / "blog-20240104120000.tgz").touch()
+    assert len(target.list_archives("blog")) == 4
+    os.remove(attic / "blog-20240101120000.tgz")
+    assert len(LocalTarget(attic).list_archives("blog")) == 3
+
+
+def test_perform_thinning(attic):
+    target = LocalTarget(attic)
+    for day in range(1, 29):
+        target.transfer_archive(write_archive("blog", f"202402{day:02}120000"))
+    target.transfer_archive(write_archive("shop", "20240201120000"))
+
+    def thin_archives(archives):
+        return ThinOutStrategy(7, 1, 1).execute_on(archives, attr="ctime")
+
+    result = target.perform_thinning("blog", thin_archives, dry=True)
+    assert result.archivesDeleted > 0
+    assert len(list(attic.glob("*.tgz"))) == 29
+
+    result = target.perform_thinning("blog", thin_archives)
+    assert result == LocalThinningResult(
+        result.archivesRetained, result.archivesDeleted
+    )
+    assert len(list(attic.glob("blog-*.tgz"))) == result.archivesRetained
+    assert len(target.list_archives("blog")) == result.archivesRetained
+    assert len(target.list_archives("shop")) == 1
+    # the index written after deleting is valid
+    with patch("backup.target.local.os.scandir", side_effect=AssertionError):
+        assert len(LocalTarget(attic).list_archives()) == result.archivesRetained + 1
+
+
+def test_restore_archive(attic, tmp_path):
+    (tmp_path / "index.php").write_text("<?php")
+    archive = Archive("blog", "20240101120000")
+    with archive:
+        archive.add_entry(str(tmp_path / "index.php"), f"{archive.name}/index.php")
+        archive.add_manifest(archive.timestamp)
+    target = LocalTarget(attic)
+    target.transfer_archive(archive)
+    os.remove(archive.filename)
+
+    (listed,) = target.list_archives("blog")
+    result = target.restore_archive(listed, tmp_path / "restore")
+    assert result.files == 1
+    assert (tmp_path / "restore" / "index.php").read_text() == "<?php"
+    assert (tmp_path / "restore" / "MANIFEST").is_file()
+
+
+def test_thin_out_keeps_referenced_archives(attic):
+    target = LocalTarget(attic)
+    now = datetime.datetime.now()
+    for day in range(28):
+        timestamp = (now - datetime.timedelta(days=day)).strftime("%Y%m%d%H%M%S")
+        target.transfer_archive(write_archive("blog", timestamp))
+    archives = target.list_archives("blog")
+    strategy = ThinOutStrategy(7, 1, 1)
+    retained, thinned = strategy.execute_on(archives, attr="ctime")
+    latest = max(archives, key=lambda a: a.ctime)
+    referenced = min(thinned, key=lambda a: a.ctime)
+
+    # the latest archive refers to an archive thinned out otherwise
+    references = {latest.name: {referenced.name}}
+    backup = Backup(Mock(slug="blog"), quiet=True)
+    result = backup.thin_out(target, strategy, references=references)
+    assert result.archivesDeleted == len(thinned) - 1
+    names = {a.name for a in target.list_archives("blog")}
+    assert names == {a.name for a in retained} | {referenced.name}
+
+
+def test_thin_out_partitions(attic):
+    target = LocalTarget(attic)
+    old = write_archive("blog", "20240101120000")
+    new = write_archive("blog", "20240102120000")
+    for archive in (old, new):
+        target.transfer_archive(archive)
+
+    def partition(label, name):
+        filename = f"{label}.uploads-{name}.0123456789abcdef.partition.tgz"
+        (attic / filename).write_bytes(b"partition")
+        return filename
+
+    # the partition archive of the thinned out archive is deleted, partition
+    # archives unknown to the references or of other labels are left alone
+    references = {
+        old.name: {partition("blog", "a"), partition("blog.shop", "a")},
+        new.name: {partition("blog", "b")},
+    }
+    partition("blog", "c")
+    backup = Backup(Mock(slug="blog"), quiet=True)
+    backup.thin_out(target, LatestStrategy(1), references=references)
+    assert target.results["THIN_OUT_PARTITIONS"] == LocalThinningResult(2, 1)
+    assert sorted(path.name for path in attic.glob("*.partition.tgz")) == [
+        "blog.shop.uploads-a.0123456789abcdef.partition.tgz",
+        "blog.uploads-b.0123456789abcdef.partition.tgz",
+        "blog.uploads-c.0123456789abcdef.partition.tgz",
+    ]
+    assert "blog.uploads-a.0123456789abcdef.partition.tgz" not in target.read_index()
@@ -4,6 +4,8 @@ from unittest.mock import patch
 
 import pytest
 
+from backup.exclusion import Exclusion
+from backup.target.s3 import S3Tuning
 from backup.utils.mail import Recipient, Sender
 from sitebackup import main
 
@@ -71,6 +73,14 @@ def test_with_no_arguments(
         thinning=None,
         attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
 
@@ -79,7 +89,10 @@ def test_with_no_arguments(
 @patch("sitebackup.Mailer")
 @patch("sitebackup.SourceFactory")
 @patch("sitebackup.Backup")
-def test_with_arguments(mock_backup, mock_source_factory, mock_mailer, _mock_get_version, _mock_os_isdir):
+@patch("sitebackup.LocalTarget")
+def test_with_arguments(
+    mock_local, mock_backup, mock_source_factory, mock_mailer, _mock_get_version, _mock_os_isdir
+):
     mailer = mock_mailer()
 
     # Mock SourceFactory and its create method
@@ -123,6 +136,14 @@ def test_with_arguments(mock_backup, mock_source_factory, mock_mailer, _mock_get
         thinning=None,
         attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
     # test 2: configure mail reporting
@@ -150,27 +171,58 @@ def test_with_arguments(mock_backup, mock_source_factory, mock_mailer, _mock_get
         thinning=None,
         attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
     # test 3: switch on database processing and configure attic with no parameter
     main(["--database", "--attic", "--", "."])
-    # calls to backup
+    # calls to backup: the archive is kept in the working directory
+    mock_local.assert_called_with(Path("."))
     mock_backup.assert_called_with(source, mailer=None, quiet=False, version="2.0.0rc1")
     bup.execute.assert_called_with(
-        targets=[], database=True, filesystem=False, thinning=None, attic=".", dry=False
+        targets=[mock_local.return_value],
+        database=True,
+        filesystem=False,
+        thinning=None,
+        attic=".",
+        dry=False,
+        exclusion=Exclusion(),
+        statedir=".",
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
     # test 4: switch on filesystem processing and configure attic with parameter
     main(["--filesystem", "--attic=path_to_attic", "."])
-    # calls to backup
+    # calls to backup: the archive is transferred to the local target
+    mock_local.assert_called_with(Path("path_to_attic"))
     mock_backup.assert_called_with(source, mailer=None, quiet=False, version="2.0.0rc1")
     bup.execute.assert_called_with(
-        targets=[],
+        targets=[mock_local.return_value],
         database=False,
         filesystem=True,
         thinning=None,
-        attic="path_to_attic",
+        attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir="path_to_attic",
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
 
@@ -200,7 +252,9 @@ def test_with_s3_arguments(mock_backup, mock_s3, mock_source_factory, _mock_get_
             ".",
         ]
     )
-    mock_s3.assert_called_with("s3.host.com", "ABCDEF", "000000", "bucket")
+    mock_s3.assert_called_with(
+        "s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning()
+    )
     bup.execute.assert_called_once_with(
         targets=[s3],
         database=False,
@@ -208,12 +262,24 @@ def test_with_s3_arguments(mock_backup, mock_s3, mock_source_factory, _mock_get_
         thinning=None,
         attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
     )
 
     # test: configure s3 target with no bucket (bucket should be source.slug)
     main(["--s3=s3.host.com", "--s3accesskey=ABCDEF", "--s3secretkey=000000", "."])
     mock_s3.assert_called_with(
-        "s3.host.com", "ABCDEF", "000000", "wordpress-instance-to-backup"
+        "s3.host.com",
+        "ABCDEF",
+        "000000",
+        "wordpress-instance-to-backup",
+        tuning=S3Tuning(),
     )
     bup.execute.assert_called_with(
         targets=[s3],
@@ -222,4 +288,389 @@ def test_with_s3_arguments(mock_backup, mock_s3, mock_source_factory, _mock_get_
         thinning=None,
         attic=None,
         dry=False,
+        exclusion=Exclusion(),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
+    )
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.Backup")
+def test_with_exclusion_arguments(
+    mock_backup, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(
+        [
+            "--filesystem",
+            "--exclude=*.log",
+            "--include=important.log",
+            "--exclude=/tmp/",
+            "--max-file-size=1M",
+            "--no-default-excludes",
+            "--skip-generated",
+            "--reference-store=store",
+            ".",
+        ]
+    )
+    bup.execute.assert_called_with(
+        targets=[],
+        database=False,
+        filesystem=True,
+        thinning=None,
+        attic=None,
+        dry=False,
+        exclusion=Exclusion(
+            ["*.log", "!important.log", "/tmp/"], max_size=1048576, defaults=False
+        ),
+        statedir=None,
+        incremental=False,
+        journal=None,
+        partitions=False,
+        skip_generated=True,
+        reference="store",
+        stream=False,
+    )
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.Backup")
+@patch("sitebackup.LocalTarget")
+def test_with_state_arguments(
+    mock_local, mock_backup, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    # incremental mode needs a state directory
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(["--filesystem", "--incremental", "."])
+    assert exceptioninfo.value.code == 2
+
+    # and a target keeping the archives the file index refers to
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(["--filesystem", "--incremental", "--statedir=state", "."])
+    assert exceptioninfo.value.code == 2
+
+    main(["--filesystem", "--incremental", "--statedir=state", "--attic=attic", "."])
+    bup.execute.assert_called_with(
+        targets=[mock_local.return_value],
+        database=False,
+        filesystem=True,
+        thinning=None,
+        attic=None,
+        dry=False,
+        exclusion=Exclusion(),
+        statedir="state",
+        incremental=True,
+        journal=None,
+        partitions=False,
+        skip_generated=False,
+        reference=None,
+        stream=False,
+    )
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_partitions_argument(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    # partitions need a target to be stored on
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(["--filesystem", "--partitions", "--statedir=/var/lib/backup", "."])
+    assert exceptioninfo.value.code == 2
+
+    # partitions need a file index to be thinned out
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(["--filesystem", "--partitions", "--s3=s3.host.com", "."])
+    assert exceptioninfo.value.code == 2
+
+    main(
+        [
+            "--filesystem",
+            "--partitions",
+            "--s3=s3.host.com",
+            "--statedir=/var/lib/backup",
+            ".",
+        ]
+    )
+    bup.execute.assert_called_with(
+        targets=[s3],
+        database=False,
+        filesystem=True,
+        thinning=None,
+        attic=None,
+        dry=False,
+        exclusion=Exclusion(),
+        statedir="/var/lib/backup",
+        incremental=False,
+        journal=None,
+        partitions=True,
+        skip_generated=False,
+        reference=None,
+        stream=False,
+    )
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_tuning_arguments(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(
+        [
+            "--s3=s3.host.com",
+            "--s3bucket=bucket",
+            "--s3-chunk-size=64M",
+            "--s3-concurrency=32",
+            "--s3-calibrate",
+            "--statedir=state",
+            ".",
+        ]
+    )
+    mock_s3.assert_called_with(
+        "s3.host.com",
+        None,
+        None,
+        "bucket",
+        tuning=S3Tuning(chunksize=64 * 1024**2, concurrency=32),
+    )
+    s3.calibrate.assert_called_once_with(Path("state"))
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_stream_argument(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(["--filesystem", "--s3=s3.host.com", "--s3-stream", "."])
+    assert bup.execute.call_args.kwargs["targets"] == [s3]
+    assert bup.execute.call_args.kwargs["stream"] is True
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_several_s3_arguments(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(
+        [
+            "--s3=s3.one.com",
+            "--s3=s3.two.com",
+            "--s3accesskey=ABCDEF",
+            "--s3secretkey=000000",
+            "--s3bucket=one",
+            "--s3bucket=two",
+            ".",
+        ]
+    )
+    # options not repeated apply to all targets
+    assert mock_s3.call_args_list == [
+        mock.call(
+            "s3.one.com", "ABCDEF", "000000", "one", tuning=S3Tuning(), label="S3-1"
+        ),
+        mock.call(
+            "s3.two.com", "ABCDEF", "000000", "two", tuning=S3Tuning(), label="S3-2"
+        ),
+    ]
+    assert len(bup.execute.call_args.kwargs["targets"]) == 2
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_replica_arguments(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(
+        [
+            "--s3=s3.one.com",
+            "--s3accesskey=ABCDEF",
+            "--s3bucket=bucket",
+            "--s3-replica=archive",
+            "--s3-replica=copy@s3.one.com",
+            "--s3-replica=remote@s3.two.com",
+            ".",
+        ]
+    )
+    # replicas at another service are uploaded to
+    assert mock_s3.call_args_list == [
+        mock.call(
+            "s3.one.com", "ABCDEF", None, "bucket", tuning=S3Tuning(), label="S3-1"
+        ),
+        mock.call(
+            "s3.two.com", "ABCDEF", None, "remote", tuning=S3Tuning(), label="S3-2"
+        ),
+    ]
+    targets = bup.execute.call_args.kwargs["targets"]
+    assert targets[0].replicas == ["archive", "copy"]
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_layout_arguments(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(["--s3=s3.host.com", "--s3-layout=dated", "--s3-migrate-layout", "."])
+    assert s3.layout == "dated"
+    s3.migrate_layout.assert_called_once_with(source_factory.create.return_value.slug)
+    bup.execute.assert_called_once()
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_lifecycle_argument(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    # lifecycle rules can only express thinning out by age
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(["--s3=s3.host.com", "--s3-lifecycle", "--thinning=L5", "."])
+    assert exceptioninfo.value.code == 2
+
+    # lifecycle rules can't keep archives incremental archives refer to
+    with pytest.raises(SystemExit) as exceptioninfo:
+        main(
+            [
+                "--s3=s3.host.com",
+                "--s3-lifecycle",
+                "--thinning=7D4W12M",
+                "--incremental",
+                "--statedir=state",
+                ".",
+            ]
+        )
+    assert exceptioninfo.value.code == 2
+
+    main(["--s3=s3.host.com", "--s3-lifecycle", "--thinning=7D4W12M", "."])
+    assert str(s3.lifecycle) == "THIN OUT 7D4W12M"
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.S3")
+@patch("sitebackup.Backup")
+def test_with_s3_verify_arguments(
+    mock_backup, mock_s3, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source_factory = mock_source_factory.return_value
+    source_factory.create.return_value = setup_source(mock.Mock)
+
+    s3 = mock_s3()
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(["--s3=s3.host.com", "--s3-verify=sample", "--s3-verify-samples=4", "."])
+    assert s3.verification == "sample"
+    assert s3.samples == 4
+
+
+@patch("sitebackup.os.path.isdir", return_value=True)
+@patch("sitebackup.get_version", return_value="2.0.0rc1")
+@patch("sitebackup.SourceFactory")
+@patch("sitebackup.Backup")
+@patch("sitebackup.SnapshotTarget")
+def test_with_snapshot_arguments(
+    mock_snapshot, mock_backup, mock_source_factory, _mock_get_version, _mock_os_isdir
+):
+    source = setup_source(mock.Mock)
+    mock_source_factory.return_value.create.return_value = source
+
+    bup = mock_backup()
+    bup.error = None  # Ensure no error to prevent sys.exit(1)
+
+    main(["--filesystem", "--snapshot=snapshots", "--snapshot-quick", "."])
+    # the snapshot gets the exclusion of the filesystem of the archive
+    mock_backup.filesystem_exclusion.assert_called_once_with(source, Exclusion(), False)
+    mock_snapshot.assert_called_once_with(
+        Path("snapshots"),
+        source.fspath,
+        mock_backup.filesystem_exclusion.return_value,
+        checksum=False,
     )
+    assert bup.execute.call_args.kwargs["targets"] == [mock_snapshot.return_value]
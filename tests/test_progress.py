@@ -0,0 +1,48 @@
+import io
+from unittest.mock import patch
+
+from backup.progress import Progress, ProgressResult
+
+
+class Console(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_progress():
+    output = Console()
+    clock = iter([0.0, 0.1, 0.2, 0.3, 2.0, 2.5, 3.0])
+    with patch("backup.progress.time.monotonic", lambda: next(clock)):
+        progress = Progress("upload", 1000, output=output)
+        progress.update(100)
+        progress.update(100)
+        # updates are displayed at most every interval
+        assert output.getvalue() == ""
+        progress.update(100)
+        assert "300 bytes of 1 KB (30%)" in output.getvalue()
+        assert "left" in output.getvalue()
+
+        # the longest time without progress is kept
+        progress.update(500)
+        progress.update(200)
+        result = progress.finish()
+
+    assert result == ProgressResult(1000, 3.0, 333, 1.7)
+    assert output.getvalue().endswith("\n")
+    assert "stall=1.7 seconds" in str(result)
+    assert "stall" not in str(result._replace(stall=0.5))
+
+
+def test_progress_quiet():
+    output = Console()
+    progress = Progress("upload", output=output, quiet=True)
+    progress.update(100)
+    assert progress.finish().size == 100
+    assert output.getvalue() == ""
+
+    # nothing is displayed if the output is not a console
+    output = io.StringIO()
+    progress = Progress("upload", output=output, interval=0)
+    progress.update(100)
+    progress.finish()
+    assert output.getvalue() == ""
@@ -0,0 +1,79 @@
+import json
+import zipfile
+
+import pytest
+
+from backup.reference import (
+    CORE,
+    PLUGIN,
+    Component,
+    ReferenceStore,
+    ReferenceStoreError,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "store"
+    path.mkdir()
+    return ReferenceStore(path)
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return path
+
+
+def test_not_found(tmp_path):
+    with pytest.raises(ReferenceStoreError):
+        ReferenceStore(tmp_path / "missing")
+
+
+def test_import_release(store, tmp_path):
+    filename = make_zip(
+        tmp_path / "akismet.zip",
+        {"akismet/akismet.php": b"<?php", "akismet/readme.txt": b"readme"},
+    )
+    component = store.import_release(PLUGIN, "5.3", filename)
+    assert component == Component(PLUGIN, "akismet", "5.3", "")
+    listing = store.listing("plugin/akismet/5.3")
+    assert sorted(listing) == ["akismet.php", "readme.txt"]
+    assert store.object_path(listing["readme.txt"]).read_bytes() == b"readme"
+    assert store.listing("plugin/akismet/5.2") is None
+
+    # releases need a single top directory
+    filename = make_zip(tmp_path / "bad.zip", {"a/x": b"", "b/y": b""})
+    with pytest.raises(ReferenceStoreError):
+        store.import_release(PLUGIN, "1.0", filename)
+
+
+def test_pristine_and_restore(store, tmp_path):
+    filename = make_zip(
+        tmp_path / "wordpress.zip",
+        {"wordpress/index.php": b"<?php", "wordpress/wp-admin/admin.php": b"admin"},
+    )
+    store.import_release(CORE, "6.4.2", filename)
+
+    components = [
+        Component(CORE, "wordpress", "6.4.2", ""),
+        Component(PLUGIN, "unknown", "1.0", "wp-content/plugins/unknown"),
+    ]
+    pristine = store.pristine(components)
+    assert sorted(pristine) == ["index.php", "wp-admin/admin.php"]
+    assert {release for _digest, release in pristine.values()} == {
+        "core/wordpress/6.4.2"
+    }
+
+    root = tmp_path / "root"
+    entries = [
+        {"name": name, "digest": digest, "release": release}
+        for name, (digest, release) in pristine.items()
+    ]
+    assert store.restore(entries, root) == 2
+    assert (root / "wp-admin" / "admin.php").read_bytes() == b"admin"
+
+    with pytest.raises(ReferenceStoreError):
+        store.restore([{"name": "x", "digest": "0" * 64}], root)
+    assert json.loads(store.release_path("core/wordpress/6.4.2").read_text())
@@ -0,0 +1,250 @@
+import hashlib
+import io
+import sqlite3
+import tarfile
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from backup.archive import Archive
+from backup.partition import PartitionArchive
+from backup.restore import RestoreError, RestoreResult, extract_archive, overlaps
+from backup.target._base import Target
+from backup.target.s3 import S3, S3Download, S3Error, S3Tuning
+
+
+def tgz(members: dict[str, bytes | None], manifest: str | None = None) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        if manifest is not None:
+            info = tarfile.TarInfo("MANIFEST")
+            info.size = len(manifest.encode())
+            tar.addfile(info, io.BytesIO(manifest.encode()))
+    return buffer.getvalue()
+
+
+PARTITION = "blog.uploads-2023.0123456789abcdef.partition.tgz"
+
+ARCHIVES = {
+    "blog-20240101120000.tgz": tgz(
+        {
+            "blog-20240101120000": None,
+            "blog-20240101120000/index.php": b"<?php",
+            "blog-20240101120000/wp-content/themes/style.css": b"body {}",
+            "blog-20240101120000-db.sql": b"CREATE TABLE",
+        },
+        f"Timestamp: 20240101120000\nPartition: wp-content/uploads/2023 {PARTITION}\n",
+    ),
+    PARTITION: tgz(
+        {"blog.uploads-2023.0123456789abcdef/wp-content/uploads/2023/a.jpg": b"jpg"},
+        "Partition: wp-content/uploads/2023\n",
+    ),
+    # incremental: index.php is unchanged since the first archive
+    "blog-20240102120000.tgz": tgz(
+        {
+            "blog-20240102120000": None,
+            "blog-20240102120000/wp-content/themes/style.css": b"body { }",
+            "FILES": b'{"name": "index.php", "archive": "blog-20240101120000"}\n'
+            b'{"name": "wp-content/themes/style.css",'
+            b' "archive": "blog-20240102120000"}\n'
+            b'{"name": "wp-includes/version.php", "archive": "wordpress-6.4"}\n',
+            "PRISTINE": b'{"name": "wp-includes/version.php"}\n',
+        },
+        "Timestamp: 20240102120000\nMode: incremental\n",
+    ),
+    "blog-20240103120000.tgz": tgz(
+        {
+            "blog-20240103120000": None,
+            "FILES": b'{"name": "index.php", "archive": "blog-20231231120000"}\n',
+        },
+        "Timestamp: 20240103120000\nMode: incremental\n",
+    ),
+}
+
+
+class FakeTarget(Target):
+    label = "Fake"
+
+    def __init__(self):
+        super().__init__()
+        self.opened = []
+
+    def open_archive(self, archive):
+        self.opened.append(archive.filename)
+        return io.BytesIO(ARCHIVES[archive.filename])
+
+    def list_archives(self, label=None, since=None):
+        return [Archive.fromfilename(name) for name in ARCHIVES if name != PARTITION]
+
+
+def test_overlaps():
+    assert overlaps("wp-content/uploads/2023", None)
+    assert overlaps("wp-content/uploads/2023", "wp-content/uploads")
+    assert overlaps("wp-content/uploads/2023", "wp-content/uploads/2023/01/")
+    assert not overlaps("wp-content/uploads/2023", "wp-content/themes")
+    assert not overlaps("wp-content/uploads/20231", "wp-content/uploads/2023")
+
+
+def test_extract_archive(tmp_path):
+    data = ARCHIVES["blog-20240101120000.tgz"]
+    result, partitions, _ = extract_archive(io.BytesIO(data), tmp_path)
+    assert result == RestoreResult(3, 24)
+    assert (tmp_path / "index.php").read_bytes() == b"<?php"
+    assert (tmp_path / "blog-20240101120000-db.sql").is_file()
+    assert (tmp_path / "MANIFEST").is_file()
+    assert partitions == {"wp-content/uploads/2023": PARTITION}
+
+    # entries leaving root are rejected
+    with pytest.raises(tarfile.FilterError):
+        extract_archive(io.BytesIO(tgz({"blog/../../evil": b"x"})), tmp_path / "x")
+
+
+def test_restore_archive(tmp_path):
+    target = FakeTarget()
+    archive = PartitionArchive.fromfilename(PARTITION, "wp-content/uploads/2023")
+    assert archive.filename == PARTITION
+
+    # partitions outside the subtree are not read
+    main = type("Main", (), {"filename": "blog-20240101120000.tgz"})()
+    result = target.restore_archive(main, tmp_path / "a", "wp-content/themes")
+    assert result == RestoreResult(1, 7, 0)
+    assert sorted(p.name for p in (tmp_path / "a").rglob("*")) == [
+        "style.css",
+        "themes",
+        "wp-content",
+    ]
+    assert target.opened == ["blog-20240101120000.tgz"]
+
+    result = target.restore_archive(main, tmp_path / "b")
+    assert result == RestoreResult(4, 27, 1)
+    assert (tmp_path / "b/wp-content/uploads/2023/a.jpg").read_bytes() == b"jpg"
+    assert b"Timestamp" in (tmp_path / "b/MANIFEST").read_bytes()
+
+
+def test_restore_incremental_archive(tmp_path):
+    target = FakeTarget()
+
+    # unchanged files are restored from the archive holding them
+    archive = Archive("blog", "20240102120000")
+    result = target.restore_archive(archive, tmp_path / "a")
+    assert result == RestoreResult(2, 13, 0, 1)
+    assert (tmp_path / "a/index.php").read_bytes() == b"<?php"
+    assert (tmp_path / "a/wp-content/themes/style.css").read_bytes() == b"body { }"
+    assert not (tmp_path / "a/blog-20240101120000-db.sql").exists()
+    assert target.opened[-1] == "blog-20240101120000.tgz"
+
+    # within a subtree only the files inside are looked up
+    target.opened.clear()
+    result = target.restore_archive(archive, tmp_path / "b", "wp-content")
+    assert result == RestoreResult(1, 8, 0, 0)
+    assert target.opened == ["blog-20240102120000.tgz"]
+
+    # archives referred to must exist
+    archive = Archive("blog", "20240103120000")
+    with pytest.raises(RestoreError, match="blog-20231231120000"):
+        target.restore_archive(archive, tmp_path / "c")
+
+
+@patch("backup.target.s3.PART_BACKOFF", 0)
+@patch("backup.target.s3.boto3.client")
+def test_download(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 4))
+    client = mock_client.return_value
+    data = bytes(range(256)) * 40
+    failures = {2000: 1}
+    lock = threading.Lock()
+
+    def get_object(**kwargs):
+        start, end = map(int, kwargs["Range"][len("bytes=") :].split("-"))
+        # later parts may arrive first
+        time.sleep(0.01 * (start % 3000) / 1000)
+        with lock:
+            if failures.get(start):
+                failures[start] -= 1
+                raise ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+        return {"Body": io.BytesIO(data[start : end + 1])}
+
+    client.get_object.side_effect = get_object
+    sha256 = hashlib.sha256(data).hexdigest()
+    with S3Download(s3, "key", len(data), sha256) as download:
+        assert download.read(10) == data[:10]
+        assert download.read() == data[10:]
+        assert download.read() == b""
+    assert client.get_object.call_count == 12
+
+    # corrupted data is detected at the end
+    with S3Download(s3, "key", len(data), "0" * 64) as download:
+        with pytest.raises(S3Error):
+            while download.read(4096):
+                pass
+
+
+@patch("siterestore.S3")
+def test_main(mock_s3, tmp_path, capsys):
+    import siterestore
+
+    s3 = mock_s3.return_value
+    old = type(
+        "A",
+        (),
+        {"filename": "blog-1.tgz", "name": "blog-1", "ctime": 1, "timestamp": "1"},
+    )()
+    new = type(
+        "A",
+        (),
+        {"filename": "blog-2.tgz", "name": "blog-2", "ctime": 2, "timestamp": "2"},
+    )()
+    s3.list_archives.return_value = [new, old]
+    s3.restore_archive.return_value = RestoreResult(3, 100, 1)
+
+    siterestore.main(["--s3", "s3.host.com", "blog", str(tmp_path)])
+    s3.restore_archive.assert_called_once_with(new, tmp_path, None)
+    assert "Restored 3 files from blog-2.tgz" in capsys.readouterr().out
+
+    # generated files left out of the archive are listed
+    (tmp_path / "GENERATED").write_text('["a-150x150.jpg", "a.jpg"]\n' * 2)
+    siterestore.main(["--s3", "s3.host.com", "blog", str(tmp_path)])
+    out = capsys.readouterr().out
+    assert "Left out 2 generated files" in out
+    assert "wp media regenerate --only-missing" in out
+
+    # a restored SQLite snapshot replaces the database and its stale log
+    connection = sqlite3.connect(tmp_path / "blog-2-db.sqlite3")
+    connection.execute("CREATE TABLE users (name TEXT)")
+    connection.close()
+    (tmp_path / "db.sqlite3-wal").write_bytes(b"stale")
+    siterestore.main(["--s3", "s3.host.com", "blog", str(tmp_path)])
+    assert "Restored 1 tables into db.sqlite3" in capsys.readouterr().out
+    assert (tmp_path / "db.sqlite3").is_file()
+    assert not (tmp_path / "blog-2-db.sqlite3").exists()
+    assert not (tmp_path / "db.sqlite3-wal").exists()
+
+    siterestore.main(
+        [
+            "--s3",
+            "s3.host.com",
+            "--timestamp",
+            "1",
+            "--subtree",
+            "wp",
+            "blog",
+            str(tmp_path),
+        ]
+    )
+    s3.restore_archive.assert_called_with(old, tmp_path, "wp")
+
+    s3.restore_archive.side_effect = S3Error(s3, "failed")
+    with pytest.raises(SystemExit):
+        siterestore.main(["--s3", "s3.host.com", "blog", str(tmp_path)])
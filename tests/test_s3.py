@@ -0,0 +1,944 @@
+import base64
+import datetime
+import hashlib
+import io
+import json
+import tarfile
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from backup import Backup
+from backup.archive import Archive, ArchiveChecksums, ChecksumWriter
+from backup.partition import Partition, PartitionArchive
+from backup.target.s3 import (
+    DATED,
+    S3,
+    VERIFY_FULL,
+    S3Error,
+    S3ReplicaResult,
+    S3Result,
+    S3Stream,
+    S3ThinningResult,
+    S3Tuning,
+    S3VerifyResult,
+)
+from backup.thinning import LatestStrategy, ThinOutStrategy
+
+
+def test_tuning():
+    tuning = S3Tuning()
+    assert tuning.max_pool_connections == 10
+    assert S3Tuning(concurrency=32).max_pool_connections == 32
+    assert S3Tuning(concurrency=32, pool_connections=16).max_pool_connections == 16
+
+    config = S3Tuning(chunksize=64 * 1024**2, concurrency=4).transfer_config()
+    assert config.multipart_chunksize == 64 * 1024**2
+    assert config.multipart_threshold == 64 * 1024**2
+    assert config.max_concurrency == 4
+
+
+def test_result():
+    assert str(S3Result(2000, 2, 1000)) == (
+        "Result(size=2 KB, duration=2 seconds, throughput=1 KB/s)"
+    )
+    assert S3Result(0, 0).throughput == 0
+
+
+@patch("backup.target.s3.boto3.client")
+def test_calibrate(mock_client, tmp_path):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    client.list_multipart_uploads.return_value = {}
+    candidates = [S3Tuning(concurrency=4), S3Tuning(concurrency=32)]
+
+    # the probe is faster with more threads
+    clock = iter([0.0, 2.0, 10.0, 11.0])
+    with patch("backup.target.s3.time.monotonic", side_effect=lambda: next(clock)):
+        tuning = s3.calibrate(tmp_path, candidates=candidates, probe_size=1024)
+    assert tuning == S3Tuning(concurrency=32)
+    assert s3.tuning == tuning
+    assert client.upload_fileobj.call_count == 2
+    client.delete_object.assert_called_once()
+    assert (tmp_path / "s3-tuning.json").is_file()
+
+    # the result is cached per endpoint
+    client.reset_mock()
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    assert s3.calibrate(tmp_path, candidates=candidates) == S3Tuning(concurrency=32)
+    client.upload_fileobj.assert_not_called()
+
+
+@patch("backup.target.s3.CALIBRATION_BUDGET", 1024)
+@patch("backup.target.s3.boto3.client")
+def test_calibrate_cleanup(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    candidates = [S3Tuning(concurrency=4), S3Tuning(concurrency=32)]
+
+    # candidates beyond the budget are skipped
+    client.list_multipart_uploads.return_value = {}
+    assert s3.calibrate(candidates=candidates, probe_size=1024) == candidates[0]
+    assert client.upload_fileobj.call_count == 1
+    client.delete_object.assert_called_once()
+
+    # a failing upload doesn't leave the probe behind
+    client.reset_mock()
+    client.upload_fileobj.side_effect = client_error("InternalError")
+    key = None
+
+    def list_multipart_uploads(**kwargs):
+        nonlocal key
+        key = kwargs["Prefix"]
+        return {"Uploads": [{"Key": key, "UploadId": "upload-1"}]}
+
+    client.list_multipart_uploads.side_effect = list_multipart_uploads
+    with pytest.raises(S3Error, match="InternalError"):
+        s3.calibrate(candidates=candidates, probe_size=1024)
+    assert client.delete_object.call_args.kwargs["Key"] == key
+    client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key=key, UploadId="upload-1"
+    )
+
+
+@patch("backup.target.s3.boto3.client")
+def test_list_archives(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    paginator = mock_client.return_value.get_paginator.return_value
+    paginator.paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": "blog-20240101120000.tgz"},
+                {"Key": "blog-notes.txt"},
+                {"Key": "blog.uploads-2023-01.0123456789abcdef.partition.tgz"},
+            ]
+        },
+        {"Contents": [{"Key": "blog-20240102120000.tgz"}]},
+        {},
+    ]
+
+    archives = s3.iter_archives("blog")
+    assert next(archives).timestamp == "20240101120000"
+    assert [archive.timestamp for archive in archives] == ["20240102120000"]
+    paginator.paginate.assert_called_once_with(Bucket="bucket", Prefix="blog")
+
+
+@patch("backup.target.s3.boto3.client")
+def test_perform_thinning(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    client.get_object.side_effect = client_error("NoSuchKey")
+    archives = [
+        Archive("blog", f"2024{i // 28 + 1:02}{i % 28 + 1:02}120000")
+        for i in range(300)
+    ]
+    s3.list_archives = lambda label, since=None: archives
+    client.delete_objects.return_value = {}
+
+    with patch("backup.target.s3.DELETE_BATCH_SIZE", 100):
+        # errors are reported per key
+        client.delete_objects.side_effect = [
+            {},
+            {"Errors": [{"Key": archives[150].filename, "Code": "AccessDenied"}]},
+        ]
+        result = s3.perform_thinning("blog", lambda a: (a[:100], a[100:]))
+    assert result == S3ThinningResult(
+        100, 199, ((archives[150].filename, "AccessDenied"),)
+    )
+    assert client.delete_objects.call_count == 2
+    keys = [
+        obj["Key"]
+        for call in client.delete_objects.call_args_list
+        for obj in call.kwargs["Delete"]["Objects"]
+    ]
+    assert sorted(keys) == sorted(archive.filename for archive in archives[100:])
+    assert "AccessDenied" in str(result)
+
+    client.reset_mock()
+    result = s3.perform_thinning("blog", lambda a: (a[:100], a[100:]), dry=True)
+    assert result == S3ThinningResult(100, 200)
+    client.delete_objects.assert_not_called()
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "operation")
+
+
+@patch("backup.target.s3.PART_BACKOFF", 0)
+@patch("backup.target.s3.boto3.client")
+def test_multipart_upload_resumes(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    archive = Archive("blog", "20240101120000")
+    with open(archive.filename, "wb") as f:
+        f.write(b"x" * 2500)
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    client = mock_client.return_value
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+
+    # the third part fails for good: the upload is interrupted
+    uploaded = []
+
+    def upload_part(**kwargs):
+        if kwargs["PartNumber"] == 3:
+            raise client_error("InternalError")
+        uploaded.append(kwargs["PartNumber"])
+        return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+    client.upload_part.side_effect = upload_part
+    with pytest.raises(ClientError):
+        s3.multipart_upload(archive)
+    assert uploaded == [1, 2]
+    state = json.loads(s3.upload_state_path(archive).read_text())
+    assert state["upload_id"] == "upload-1"
+    assert state["parts"] == {"1": "etag-1", "2": "etag-2"}
+
+    # the next run uploads the missing part only
+    client.upload_part.side_effect = lambda **kwargs: {"ETag": "etag-3"}
+    client.upload_part.reset_mock()
+    client.get_paginator.return_value.paginate.return_value = [
+        {"Parts": [{"PartNumber": 1, "ETag": "etag-1"}]},
+        {"Parts": [{"PartNumber": 2, "ETag": "etag-2"}]},
+    ]
+    s3.multipart_upload(archive)
+    assert [c.kwargs["PartNumber"] for c in client.upload_part.call_args_list] == [3]
+    client.create_multipart_upload.assert_called_once()
+    client.complete_multipart_upload.assert_called_once_with(
+        Bucket="bucket",
+        Key=archive.filename,
+        UploadId="upload-1",
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": 1, "ETag": "etag-1"},
+                {"PartNumber": 2, "ETag": "etag-2"},
+                {"PartNumber": 3, "ETag": "etag-3"},
+            ]
+        },
+    )
+    assert not s3.upload_state_path(archive).exists()
+
+
+@patch("backup.target.s3.boto3.client")
+def test_abort_stale_uploads(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    old = datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC)
+    new = datetime.datetime.now(datetime.UTC)
+    client.get_paginator.return_value.paginate.return_value = [
+        {
+            "Uploads": [
+                {"Key": "blog-20200101120000.tgz", "UploadId": "a", "Initiated": old},
+                {"Key": "blog-20200102120000.tgz", "UploadId": "b", "Initiated": old},
+                {"Key": "blog-20240101120000.tgz", "UploadId": "c", "Initiated": new},
+                {"Key": "blogger-2020010.tgz", "UploadId": "d", "Initiated": old},
+            ]
+        }
+    ]
+    # uploads with a local state can still be resumed
+    archive = Archive("blog", "20200102120000")
+    s3.upload_state_path(archive).write_text(json.dumps({"upload_id": "b"}))
+
+    assert s3.abort_stale_uploads("blog") == 1
+    client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="blog-20200101120000.tgz", UploadId="a"
+    )
+
+
+@patch("backup.target.s3.boto3.client")
+def test_abort_stale_uploads_of_prefixed_label(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    old = datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC)
+    client.get_paginator.return_value.paginate.return_value = [
+        {
+            "Uploads": [
+                {"Key": "foo-20200101120000.tgz", "UploadId": "a", "Initiated": old},
+                {"Key": "foo-20200102120000.tgz", "UploadId": "b", "Initiated": old},
+                {
+                    "Key": "foo-bar-20200101120000.tgz",
+                    "UploadId": "c",
+                    "Initiated": old,
+                },
+                {
+                    "Key": "foo-bar.wp.0123.partition.tgz",
+                    "UploadId": "d",
+                    "Initiated": old,
+                },
+                {
+                    "Key": "foo.wp.4567.partition.tgz",
+                    "UploadId": "e",
+                    "Initiated": old,
+                },
+            ]
+        }
+    ]
+    # the local state of the label foo-bar doesn't protect uploads of foo
+    archive = Archive("foo-bar", "20200102120000")
+    s3.upload_state_path(archive).write_text(json.dumps({"upload_id": "b"}))
+
+    assert s3.abort_stale_uploads("foo") == 3
+    assert [
+        c.kwargs["UploadId"] for c in client.abort_multipart_upload.call_args_list
+    ] == ["a", "b", "e"]
+
+
+@patch("backup.target.s3.boto3.client")
+def test_multipart_upload_checksums(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    archive = Archive("blog", "20240101120000")
+    data = bytes(range(256)) * 10
+    with open(archive.filename, "wb") as f:
+        f.write(data)
+    parts = [hashlib.md5(data[i : i + 1000]).digest() for i in (0, 1000, 2000)]
+    checksums = ArchiveChecksums(1000, parts, hashlib.sha256(data).hexdigest(), 2560)
+    archive.checksums = checksums
+
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    assert s3.archive_checksums(archive, 2560) == checksums
+    assert s3.archive_checksums(archive, 2561) is None
+
+    client = mock_client.return_value
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    client.upload_part.side_effect = lambda **kwargs: {"ETag": "etag"}
+    client.complete_multipart_upload.return_value = {"ETag": f'"{checksums.etag()}"'}
+    s3.multipart_upload(archive, checksums=checksums)
+
+    client.create_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key=archive.filename, Metadata={"sha256": checksums.sha256}
+    )
+    assert [c.kwargs["ContentMD5"] for c in client.upload_part.call_args_list] == [
+        base64.b64encode(part).decode() for part in parts
+    ]
+
+    # a corrupted object is detected by its ETag
+    client.complete_multipart_upload.return_value = {"ETag": '"0123-3"'}
+    with pytest.raises(S3Error, match="ETag"):
+        s3.multipart_upload(archive, checksums=checksums)
+
+
+def multipart_etag(data, chunksize):
+    digests = [
+        hashlib.md5(data[i : i + chunksize]).digest()
+        for i in range(0, len(data), chunksize)
+    ]
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+@patch("backup.target.s3.boto3.client")
+def test_stream(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    client = mock_client.return_value
+    client.get_object.side_effect = client_error("NoSuchKey")
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+
+    # uploads falling behind stall the writer
+    release = threading.Event()
+    uploaded = {}
+
+    def upload_part(**kwargs):
+        release.wait(5)
+        uploaded[kwargs["PartNumber"]] = kwargs["Body"]
+        return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+    client.upload_part.side_effect = upload_part
+    data = bytes(range(256)) * 10
+    client.complete_multipart_upload.return_value = {
+        "ETag": f'"{multipart_etag(data, 1000)}"'
+    }
+
+    archive = Archive("blog", "20240101120000")
+    stream = s3.open_stream(archive)
+    writer = threading.Thread(target=stream.write, args=(data,))
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive()
+    release.set()
+    writer.join(5)
+    stream.close()
+
+    assert b"".join(uploaded[n] for n in sorted(uploaded)) == data
+    client.complete_multipart_upload.assert_called_once_with(
+        Bucket="bucket",
+        Key=archive.filename,
+        UploadId="upload-1",
+        MultipartUpload={
+            "Parts": [{"PartNumber": n, "ETag": f"etag-{n}"} for n in (1, 2, 3)]
+        },
+    )
+
+    # the result of the upload is reported as transfer
+    result = s3.transfer_archive(archive)
+    assert result.size == len(data)
+    client.upload_file.assert_not_called()
+
+
+@patch("backup.target.s3.boto3.client")
+def test_stream_small(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    client = mock_client.return_value
+    client.put_object.return_value = {"ETag": f'"{hashlib.md5(b"small").hexdigest()}"'}
+
+    stream = S3Stream(s3, "blog-20240101120000.tgz")
+    stream.write(b"small")
+    stream.close()
+    client.create_multipart_upload.assert_not_called()
+    assert client.put_object.call_args.kwargs["Body"] == b"small"
+    assert stream.result.size == 5
+
+
+@patch("backup.target.s3.boto3.client")
+def test_stream_digest(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    client = mock_client.return_value
+    store = CatalogStore(client)
+    store.objects[s3.catalog_key("blog")] = json.dumps(
+        {"listed": time.time(), "archives": {}}
+    ).encode()
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        info = tarfile.TarInfo("content")
+        info.size = 3000
+        tar.addfile(info, io.BytesIO(bytes(range(250)) * 12))
+    data = buffer.getvalue()
+    writer = ChecksumWriter(io.BytesIO(), 1000)
+    writer.write(data)
+
+    # the digest of a streamed archive is only known when it is written
+    archive = Archive("blog", "20240101120000")
+    archive.checksums = writer.checksums()
+    s3.streams[archive.filename] = Mock(error=None, result=S3Result(len(data), 1))
+    s3.transfer_archive(archive)
+    store.objects[archive.filename] = data
+    client.head_object.return_value = {"ContentLength": len(data), "Metadata": {}}
+
+    # downloads and verifications use the digest in the catalog
+    with s3.open_archive(archive) as download:
+        assert download.sha256 == hashlib.sha256(data).hexdigest()
+    s3.verification = VERIFY_FULL
+    result = s3.verify_archive(Archive("blog", "20240101120000"))
+    assert (result.level, result.checked) == (VERIFY_FULL, len(data))
+
+    s3.update_catalog(
+        "blog", lambda archives: archives[archive.filename].update(sha256="0" * 64)
+    )
+    with pytest.raises(S3Error, match="SHA-256"):
+        s3.verify_archive(Archive("blog", "20240101120000"))
+
+
+@patch("backup.target.s3.PART_ATTEMPTS", 1)
+@patch("backup.target.s3.boto3.client")
+def test_stream_aborted(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", tuning=S3Tuning(1000, 1))
+    client = mock_client.return_value
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    client.upload_part.side_effect = client_error("InternalError")
+
+    # the writer isn't interrupted, the error is reported by the transfer
+    archive = Archive("blog", "20240101120000")
+    stream = s3.open_stream(archive)
+    for _ in range(3):
+        stream.write(b"x" * 1000)
+    stream.close()
+    client.abort_multipart_upload.assert_called_with(
+        Bucket="bucket", Key=archive.filename, UploadId="upload-1"
+    )
+    client.complete_multipart_upload.assert_not_called()
+    with pytest.raises(S3Error, match="InternalError"):
+        s3.transfer_archive(archive)
+
+
+@patch("backup.target.s3.boto3.client")
+def test_fan_out(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    archive = Archive("blog", "20240101120000")
+    data = b"archive"
+    with open(archive.filename, "wb") as f:
+        f.write(data)
+    etag = f'"{hashlib.md5(data).hexdigest()}"'
+
+    clients = [Mock(), Mock()]
+    mock_client.side_effect = clients
+    first = S3("s3.one.com", "ABCDEF", "000000", "bucket", label="S3-1")
+    second = S3("s3.two.com", "ABCDEF", "000000", "bucket", label="S3-2")
+    for client in clients:
+        client.get_paginator.return_value.paginate.return_value = []
+        client.get_object.side_effect = client_error("NoSuchKey")
+    clients[0].put_object.return_value = {"ETag": etag}
+    clients[1].put_object.side_effect = client_error("InternalError")
+
+    # the failing target doesn't stop the transfer to the other target
+    backup = Backup(Mock(), quiet=True)
+    with pytest.raises(S3Error, match="InternalError"):
+        backup.transfer_to_targets(archive, [first, second])
+    assert clients[0].put_object.call_args.kwargs["Body"] == data
+    assert clients[1].put_object.call_args.kwargs["Body"] == data
+    assert first.results["TRANSFER_ARCHIVE"].size == len(data)
+    assert second.results["TRANSFER_ARCHIVE"] is False
+    clients[0].upload_file.assert_not_called()
+
+
+@patch("backup.target.s3.COPY_PART_SIZE", 1000)
+@patch("backup.target.s3.boto3.client")
+def test_replicate_archive(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    archive = Archive("blog", "20240101120000")
+    with open(archive.filename, "wb") as f:
+        f.write(b"x" * 500)
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", replicas=["copy", "large"])
+    client = mock_client.return_value
+    client.get_object.side_effect = client_error("NoSuchKey")
+    client.get_paginator.return_value.paginate.return_value = []
+    client.head_object.side_effect = [{"ContentLength": 500}, {"ContentLength": 2500}]
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    client.upload_part_copy.side_effect = lambda **kwargs: {
+        "CopyPartResult": {"ETag": f"etag-{kwargs['PartNumber']}"}
+    }
+
+    s3.transfer_archive(archive)
+    client.upload_file.assert_called_once()
+    source = {"Bucket": "bucket", "Key": archive.filename}
+    client.copy_object.assert_called_once_with(
+        Bucket="copy", Key=archive.filename, CopySource=source
+    )
+    assert sorted(
+        c.kwargs["CopySourceRange"] for c in client.upload_part_copy.call_args_list
+    ) == ["bytes=0-999", "bytes=1000-1999", "bytes=2000-2499"]
+    assert client.complete_multipart_upload.call_args.kwargs["MultipartUpload"] == {
+        "Parts": [{"PartNumber": n, "ETag": f"etag-{n}"} for n in (1, 2, 3)]
+    }
+
+    results = s3.results["REPLICATE_ARCHIVE"]
+    assert [(r.bucket, r.size, r.parts) for r in results] == [
+        ("copy", 500, 1),
+        ("large", 2500, 3),
+    ]
+    assert isinstance(results[0], S3ReplicaResult)
+
+
+class CatalogStore:
+    """Stores objects of a mocked client with conditional writes."""
+
+    def __init__(self, client):
+        self.objects = {}
+        self.conflicts = 0
+        client.get_object.side_effect = self.get_object
+        client.put_object.side_effect = self.put_object
+
+    def get_object(self, **kwargs):
+        key = kwargs["Key"]
+        if key not in self.objects:
+            raise client_error("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[key]), "ETag": self.etag(key)}
+
+    def put_object(self, **kwargs):
+        key = kwargs["Key"]
+        if self.conflicts:
+            self.conflicts -= 1
+            raise client_error("PreconditionFailed")
+        if kwargs.get("IfNoneMatch") and key in self.objects:
+            raise client_error("PreconditionFailed")
+        if kwargs.get("IfMatch") and self.etag(key) != kwargs["IfMatch"]:
+            raise client_error("PreconditionFailed")
+        body = kwargs["Body"]
+        self.objects[key] = body.encode() if isinstance(body, str) else body
+        return {"ETag": self.etag(key)}
+
+    def etag(self, key):
+        return (
+            hashlib.md5(self.objects[key]).hexdigest() if key in self.objects else None
+        )
+
+
+@patch("backup.target.s3.boto3.client")
+def test_catalog(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    store = CatalogStore(client)
+    paginator = client.get_paginator.return_value
+    paginator.paginate.return_value = [
+        {"Contents": [{"Key": "blog-20240101120000.tgz", "Size": 100}]}
+    ]
+
+    # without a catalog the bucket is listed and the catalog is created
+    assert [a.filename for a in s3.list_archives("blog")] == ["blog-20240101120000.tgz"]
+    assert [a.filename for a in s3.list_archives("blog")] == ["blog-20240101120000.tgz"]
+    paginator.paginate.assert_called_once()
+
+    # updates are retried on concurrent writes
+    store.conflicts = 1
+    s3.update_catalog(
+        "blog",
+        lambda archives: archives.__setitem__(
+            "blog-20240102120000.tgz", {"size": 200, "sha256": "abc"}
+        ),
+    )
+    catalog, _ = s3.read_catalog("blog")
+    assert catalog["archives"]["blog-20240102120000.tgz"]["sha256"] == "abc"
+    assert len(s3.list_archives("blog")) == 2
+    paginator.paginate.assert_called_once()
+
+    # a stale catalog is repaired from a listing
+    catalog["listed"] = 0
+    store.objects[s3.catalog_key("blog")] = json.dumps(catalog).encode()
+    assert len(s3.list_archives("blog")) == 1
+    assert paginator.paginate.call_count == 2
+    catalog, _ = s3.read_catalog("blog")
+    assert list(catalog["archives"]) == ["blog-20240101120000.tgz"]
+
+    # a catalog which can't be updated is deleted
+    store.conflicts = 3
+    s3.update_catalog("blog", lambda archives: archives.clear())
+    client.delete_object.assert_called_once_with(
+        Bucket="bucket", Key=s3.catalog_key("blog")
+    )
+
+
+@patch("backup.target.s3.boto3.client")
+def test_catalog_expired(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    store = CatalogStore(client)
+    now = datetime.datetime.now()
+    expired = Archive(
+        "blog", (now - datetime.timedelta(days=10)).strftime("%Y%m%d%H%M%S")
+    )
+    overdue = Archive(
+        "blog", (now - datetime.timedelta(days=9)).strftime("%Y%m%d%H%M%S")
+    )
+    recent = Archive(
+        "blog", (now - datetime.timedelta(days=1)).strftime("%Y%m%d%H%M%S")
+    )
+    deleted = Archive(
+        "blog", (now - datetime.timedelta(days=2)).strftime("%Y%m%d%H%M%S")
+    )
+    store.objects[s3.catalog_key("blog")] = json.dumps(
+        {
+            "listed": time.time(),
+            "archives": {
+                a.filename: {"timestamp": a.timestamp, "tier": "8d"}
+                for a in (expired, overdue, recent, deleted)
+            },
+        }
+    ).encode()
+    existing = {overdue.filename, recent.filename}
+
+    def head_object(**kwargs):
+        if kwargs["Key"] not in existing:
+            raise client_error("404")
+        return {"ContentLength": 100}
+
+    client.head_object.side_effect = head_object
+
+    # archives past the expiration of their tier are looked up, expired
+    # archives are dropped from the listing and the catalog
+    archives = s3.list_archives("blog")
+    assert [a.filename for a in archives] == [
+        overdue.filename,
+        deleted.filename,
+        recent.filename,
+    ]
+    assert sorted(c.kwargs["Key"] for c in client.head_object.call_args_list) == [
+        expired.filename,
+        overdue.filename,
+    ]
+    catalog, _ = s3.read_catalog("blog")
+    assert expired.filename not in catalog["archives"]
+    client.get_paginator.return_value.paginate.assert_not_called()
+
+    # an archive deleted behind the back of the catalog is dropped when used
+    with pytest.raises(S3Error):
+        s3.open_archive(deleted)
+    assert [a.filename for a in s3.list_archives("blog")] == [
+        overdue.filename,
+        recent.filename,
+    ]
+
+
+@patch("backup.target.s3.boto3.client")
+def test_dated_layout(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket", layout=DATED)
+    client = mock_client.return_value
+    client.get_object.side_effect = client_error("NoSuchKey")
+    archive = Archive("blog", "20240305120000")
+    assert s3.object_key(archive) == "blog/2024/03/blog-20240305120000.tgz"
+    partition = PartitionArchive("blog", Partition("uploads", "uploads"), "0" * 64)
+    assert s3.object_key(partition) == partition.filename
+
+    # archives are listed in both layouts with their keys
+    objects = {
+        "blog": ["blog-20231201120000.tgz", "blog/2024/03/blog-20240305120000.tgz"],
+        "blog-": ["blog-20231201120000.tgz"],
+        "blog/2023/12/": [],
+        "blog/2024/": ["blog/2024/03/blog-20240305120000.tgz"],
+    }
+    paginator = client.get_paginator.return_value
+    paginator.paginate.side_effect = lambda **kwargs: [
+        {
+            "Contents": [
+                {"Key": key, "Size": 100} for key in objects.get(kwargs["Prefix"], [])
+            ]
+        }
+    ]
+    archives = s3.list_archives("blog")
+    assert [s3.object_key(a) for a in archives] == objects["blog"]
+
+    # only the months since the given date are listed
+    archives = s3.list_archives("blog", since=datetime.datetime(2023, 12, 1))
+    years = range(2024, datetime.date.today().year + 1)
+    assert [p.kwargs["Prefix"] for p in paginator.paginate.call_args_list[1:]] == [
+        "blog-",
+        "blog/2023/12/",
+        *(f"blog/{year}/" for year in years),
+    ]
+    assert [a.timestamp for a in archives] == ["20231201120000", "20240305120000"]
+
+    # archives are moved into the layout by server-side copies
+    paginator.paginate.side_effect = None
+    paginator.paginate.return_value = [
+        {"Contents": [{"Key": key, "Size": 100} for key in objects["blog"]]}
+    ]
+    s3.copy_object = Mock()
+    client.delete_objects.return_value = {}
+    assert s3.migrate_layout("blog") == 1
+    s3.copy_object.assert_called_once_with(
+        "blog-20231201120000.tgz", "bucket", "blog/2023/12/blog-20231201120000.tgz", 100
+    )
+    assert client.delete_objects.call_args.kwargs["Delete"]["Objects"] == [
+        {"Key": "blog-20231201120000.tgz"}
+    ]
+
+
+@patch("backup.target.s3.boto3.client")
+def test_thin_out_partitions(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    CatalogStore(client)
+    client.delete_objects.return_value = {}
+    old = Archive("blog", "20240101120000")
+    new = Archive("blog", "20240102120000")
+    s3.list_archives = Mock(side_effect=[[old, new], [new]])
+
+    def partition(name):
+        return f"blog.uploads-{name}.0123456789abcdef.partition.tgz"
+
+    client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": partition(name)} for name in ("a", "b", "c")]}
+    ]
+
+    # the partition archive of the thinned out archive is deleted, the
+    # partition archive unknown to the references is left alone
+    references = {old.name: {partition("a")}, new.name: {partition("b")}}
+    backup = Backup(Mock(slug="blog"), quiet=True)
+    backup.thin_out(s3, LatestStrategy(1), references=references)
+    assert [
+        c.kwargs["Delete"]["Objects"] for c in client.delete_objects.call_args_list
+    ] == [[{"Key": old.filename}], [{"Key": partition("a")}]]
+    assert s3.results["THIN_OUT_PARTITIONS"] == S3ThinningResult(2, 1, ())
+
+
+@patch("backup.target.s3.boto3.client")
+def test_lifecycle(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    s3.lifecycle = ThinOutStrategy(7, 4, 12)
+    client = mock_client.return_value
+    store = CatalogStore(client)
+
+    def archive(days, tier=None):
+        ctime = datetime.datetime.now() - datetime.timedelta(days=days)
+        return Archive("blog", ctime.strftime("%Y%m%d%H%M%S")), tier
+
+    archives = dict(
+        [
+            archive(1, "8d"),
+            archive(2, "8d"),
+            archive(30, "8d"),
+            archive(31, "20d"),
+            archive(400),
+            archive(500, "yearly"),
+        ]
+    )
+    store.objects[s3.catalog_key("blog")] = json.dumps(
+        {
+            "listed": time.time(),
+            "archives": {
+                a.filename: {"timestamp": a.timestamp, **({"tier": t} if t else {})}
+                for a, t in archives.items()
+            },
+        }
+    ).encode()
+    names = [a.filename for a in archives]
+
+    # new archives are tagged with their retention tier
+    assert s3.tagging(Archive("blog", "20300101120000")) == {
+        "Tagging": "sitebackup-retention=blog.yearly"
+    }
+    # a second archive of a day is dropped on the same day
+    latest = next(iter(archives)).ctime.replace(hour=23, minute=59, second=59)
+    second = Archive("blog", latest.strftime("%Y%m%d%H%M%S"))
+    assert s3.tagging(second) == {"Tagging": "sitebackup-retention=blog.1d"}
+
+    # the rules are installed next to foreign rules, unused rules are removed
+    foreign = {"ID": "other", "Status": "Enabled", "Filter": {"Prefix": "tmp/"}}
+    unused = {"ID": "sitebackup-blog-43d", "Expiration": {"Days": 43}}
+    client.get_bucket_lifecycle_configuration.return_value = {
+        "Rules": [foreign, unused]
+    }
+
+    # only untagged archives are deleted, expired archives are looked up
+    def head_object(**kwargs):
+        if kwargs["Key"] == names[3]:
+            raise client_error("404")
+        return {}
+
+    client.head_object.side_effect = head_object
+    client.delete_objects.return_value = {}
+    result = s3.perform_thinning("blog", lambda a: (a[-1:], a[:-1]))
+    assert result == S3ThinningResult(2, 1, (), 1, 1)
+    assert "expiring=1, overdue=1" in str(result)
+
+    rules = client.put_bucket_lifecycle_configuration.call_args.kwargs[
+        "LifecycleConfiguration"
+    ]["Rules"]
+    assert rules[0] == foreign
+    # the expired archive of the 20d tier is dropped by the listing already
+    assert [rule["Expiration"]["Days"] for rule in rules[1:]] == [8]
+    assert rules[1]["ID"] == "sitebackup-blog-8d"
+    assert rules[1]["Filter"] == {
+        "Tag": {"Key": "sitebackup-retention", "Value": "blog.8d"}
+    }
+    assert client.delete_objects.call_args.kwargs["Delete"]["Objects"] == [
+        {"Key": names[4]}
+    ]
+    catalog, _ = s3.read_catalog("blog")
+    assert sorted(catalog["archives"]) == sorted(names[i] for i in (0, 1, 2, 5))
+
+
+@patch("backup.target.s3.boto3.client")
+def test_verify_archive(mock_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    archive = Archive("blog", "20240101120000")
+
+    content = bytes(range(256)) * 400
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        info = tarfile.TarInfo("content")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    data = buffer.getvalue()
+    (tmp_path / archive.filename).write_bytes(data)
+    writer = ChecksumWriter(io.BytesIO(), s3.tuning.chunksize)
+    writer.write(data)
+    archive.checksums = writer.checksums()
+
+    stored = {"data": data}
+    client.head_object.return_value = {
+        "ContentLength": len(data),
+        "ETag": f'"{archive.checksums.etag()}"',
+        "Metadata": {"sha256": archive.checksums.sha256},
+    }
+
+    def get_object(**kwargs):
+        if "Range" in kwargs:
+            start, end = map(int, kwargs["Range"][len("bytes=") :].split("-"))
+            return {"Body": io.BytesIO(stored["data"][start : end + 1])}
+        return {"Body": io.BytesIO(stored["data"])}
+
+    client.get_object.side_effect = get_object
+
+    s3.verification = "etag"
+    assert s3.verify_archive(archive)[:3] == ("etag", len(data), 0)
+    client.get_object.assert_not_called()
+
+    # sampled ranges cost a small fraction of the archive
+    s3.verification = "sample"
+    result = s3.verify_archive(archive)
+    assert result.level == "sample"
+    assert 0 < result.checked <= 8 * 4096
+    assert "level=sample" in str(result)
+
+    s3.verification = "full"
+    assert s3.verify_archive(archive)[:3] == ("full", len(data), len(data))
+
+    # corrupted objects are detected at each level
+    stored["data"] = bytes(len(data))
+    for level in ("sample", "full"):
+        s3.verification = level
+        with pytest.raises(S3Error):
+            s3.verify_archive(archive)
+    client.head_object.return_value["ContentLength"] = len(data) - 1
+    s3.verification = "etag"
+    with pytest.raises(S3Error, match="size"):
+        s3.verify_archive(archive)
+
+    # without the local file sampling falls back to the etag
+    client.head_object.return_value["ContentLength"] = len(data)
+    (tmp_path / archive.filename).unlink()
+    s3.verification = "sample"
+    result = s3.verify_archive(archive)
+    assert isinstance(result, S3VerifyResult)
+    assert result.level == "etag"
+
+
+@patch("backup.target.s3.boto3.client")
+def test_thin_out_horizon(mock_client):
+    s3 = S3("s3.host.com", "ABCDEF", "000000", "bucket")
+    client = mock_client.return_value
+    objects = {}
+
+    def get_object(**kwargs):
+        if kwargs["Key"] not in objects:
+            raise client_error("NoSuchKey")
+        return {"Body": io.BytesIO(objects[kwargs["Key"]])}
+
+    def put_object(**kwargs):
+        body = kwargs["Body"]
+        objects[kwargs["Key"]] = body.encode() if isinstance(body, str) else body
+
+    client.get_object.side_effect = get_object
+    client.put_object.side_effect = put_object
+
+    # three years of daily archives
+    now = datetime.datetime.now()
+    archives = [
+        Archive("blog", (now - datetime.timedelta(days=i)).strftime("%Y%m%d%H%M%S"))
+        for i in range(3 * 365)
+    ]
+    listed = []
+
+    def list_archives(label, since=None):
+        listed.append(since)
+        return [a for a in archives if since is None or a.ctime >= since]
+
+    def delete_keys(keys):
+        for key in keys:
+            archives[:] = [a for a in archives if s3.object_key(a) != key]
+        return []
+
+    s3.list_archives = list_archives
+    s3.delete_keys = delete_keys
+    strategy = ThinOutStrategy(7, 4, 6)
+    backup = Backup(Mock(slug="blog"), quiet=True)
+
+    # the first thinning considers (and deletes) archives older than the horizon
+    horizon = strategy.horizon()
+    assert any(a.ctime < horizon for a in archives)
+    backup.thin_out(s3, strategy)
+    assert listed[-1] is None
+    assert len([a for a in archives if a.ctime < horizon]) <= 3
+    assert s3.thinning_marker("blog") == str(strategy)
+
+    # later thinnings with the same strategy stop at the horizon
+    backup.thin_out(s3, strategy)
+    assert listed[-1] is not None
+
+    # a changed strategy thins out all archives again
+    backup.thin_out(s3, ThinOutStrategy(7, 4, 3))
+    assert listed[-1] is None
+    assert s3.thinning_marker("blog") == "THIN OUT 7D4W3M"
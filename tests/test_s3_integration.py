@@ -325,3 +325,17 @@ def test_progress_with_large_file(s3_config, capsys):
 
         finally:
             os.unlink(large_file.name)
+
+
+@pytest.mark.integration
+def test_transfer_archive_with_replica(s3_config, mock_archive):
+    """Test copying an archive server-side into a replica bucket."""
+    s3 = S3(**s3_config, replicas=["test-replica"])
+
+    s3.transfer_archive(mock_archive)
+
+    response = s3.s3_client.head_object(
+        Bucket="test-replica", Key=mock_archive.filename
+    )
+    assert response["ContentLength"] == os.path.getsize(mock_archive.filename)
+    assert s3.results["REPLICATE_ARCHIVE"].bucket == "test-replica"
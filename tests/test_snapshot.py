@@ -0,0 +1,164 @@
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+from backup import Backup
+from backup.archive import Archive
+from backup.exclusion import Exclusion
+from backup.partition import Partition, PartitionArchive
+from backup.target.local import LocalError, LocalThinningResult
+from backup.target.snapshot import LISTING_FILENAME, SnapshotResult, SnapshotTarget
+from backup.thinning import ThinOutStrategy
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "site"
+    (root / "wp-content" / "uploads").mkdir(parents=True)
+    (root / "index.php").write_text("<?php")
+    (root / "wp-content" / "uploads" / "a.jpg").write_bytes(b"jpg" * 1000)
+    (root / "wp-content" / "cache.tmp").write_text("cache")
+    os.symlink("index.php", root / "home.php")
+    (tmp_path / "snapshots").mkdir()
+    return root
+
+
+def write_archive(root, timestamp, tree=True):
+    """Writes an archive with a database dump (and the top directory)."""
+    archive = Archive("blog", timestamp)
+    dump = root.parent / "dump.sql"
+    dump.write_text(f"-- dump {timestamp}")
+    with archive:
+        archive.add_entry(str(dump), f"{archive.name}-db.sql")
+        if tree:
+            archive.add_entry(str(root), archive.name)
+            archive.add_entry(str(root / "index.php"), f"{archive.name}/index.php")
+        archive.add_manifest(archive.timestamp)
+    return archive
+
+
+def test_not_found(tmp_path):
+    with pytest.raises(LocalError):
+        SnapshotTarget(tmp_path / "missing", tmp_path)
+
+
+def test_transfer_archive(site):
+    path = site.parent / "snapshots"
+    target = SnapshotTarget(path, site, Exclusion(["*.tmp"], defaults=False))
+
+    archive = write_archive(site, "20240101120000")
+    assert not target.contains_archive(archive)
+    result = target.transfer_archive(archive)
+    assert result == SnapshotResult(2, 0, 2, 3005, result.duration)
+    assert target.contains_archive(archive)
+    assert target.contains_archive(PartitionArchive("blog", Partition("a", "b"), "0"))
+
+    first = path / "blog" / "20240101120000"
+    assert (first / "index.php").read_text() == "<?php"
+    assert (
+        first / "blog-20240101120000-db.sql"
+    ).read_text() == "-- dump 20240101120000"
+    assert os.readlink(first / "home.php") == "index.php"
+    assert not (first / "wp-content" / "cache.tmp").exists()
+    assert "TRANSFER_ARCHIVE" in target.results
+
+    # unchanged files are shared with the previous snapshot
+    (site / "index.php").write_text("<?php // changed")
+    archive = write_archive(site, "20240102120000")
+    result = target.transfer_archive(archive)
+    assert (result.files, result.linked, result.copied) == (2, 1, 1)
+    second = path / "blog" / "20240102120000"
+    assert (second / "index.php").read_text() == "<?php // changed"
+    image = "wp-content/uploads/a.jpg"
+    assert (second / image).stat().st_ino == (first / image).stat().st_ino
+    assert (first / "index.php").read_text() == "<?php"
+    assert not list((path / "blog").glob(".*.tmp"))
+
+    # content changes keeping size and time are found by the hashes
+    stat = (site / image).stat()
+    (site / image).write_bytes(b"JPG" * 1000)
+    os.utime(site / image, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    target.checksum = False
+    result = target.transfer_archive(write_archive(site, "20240103000000"))
+    assert (result.linked, result.copied) == (2, 0)
+    shutil.rmtree(path / "blog" / "20240103000000")
+    target.checksum = True
+    result = target.transfer_archive(write_archive(site, "20240103120000"))
+    assert (result.linked, result.copied) == (1, 1)
+
+    # files with the same inode and change time are not hashed again
+    with patch("backup.target.snapshot.hash_file") as hash_file:
+        result = target.transfer_archive(write_archive(site, "20240103180000"))
+    assert (result.linked, result.copied) == (2, 0)
+    hash_file.assert_not_called()
+    shutil.rmtree(path / "blog" / "20240103180000")
+
+    # without tree only the members are kept
+    result = target.transfer_archive(write_archive(site, "20240104120000", False))
+    assert result.files == 0
+    assert (path / "blog" / "20240104120000" / "MANIFEST").is_file()
+
+    assert [a.timestamp for a in target.list_archives("blog")] == [
+        "20240101120000",
+        "20240102120000",
+        "20240103120000",
+        "20240104120000",
+    ]
+    assert len(target.list_archives()) == 4
+
+
+def test_failed_transfer(site):
+    path = site.parent / "snapshots"
+    target = SnapshotTarget(path, site)
+    archive = write_archive(site, "20240101120000")
+    with open(archive.filename, "wb") as f:
+        f.write(b"broken")
+    with pytest.raises(LocalError):
+        target.transfer_archive(archive)
+    # nothing incomplete is left
+    assert target.list_archives() == []
+    assert os.listdir(path / "blog") == []
+
+
+def test_perform_thinning(site):
+    path = site.parent / "snapshots"
+    target = SnapshotTarget(path, site)
+    for day in range(1, 15):
+        target.transfer_archive(write_archive(site, f"202402{day:02}120000"))
+
+    def thin_archives(archives):
+        return ThinOutStrategy(7, 1, 1).execute_on(archives, attr="ctime")
+
+    result = target.perform_thinning("blog", thin_archives, dry=True)
+    assert len(os.listdir(path / "blog")) == 14
+
+    result = target.perform_thinning("blog", thin_archives)
+    assert result == LocalThinningResult(
+        result.archivesRetained, 14 - result.archivesRetained
+    )
+    assert len(os.listdir(path / "blog")) == result.archivesRetained
+    # the remaining snapshots are complete
+    for archive in target.list_archives("blog"):
+        snapshot = target.snapshot_path(archive)
+        assert (snapshot / LISTING_FILENAME).is_file()
+        assert (
+            snapshot / "wp-content/uploads/a.jpg"
+        ).stat().st_nlink == result.archivesRetained
+
+
+def test_resume_transfers(site):
+    target = SnapshotTarget(site.parent / "snapshots", site)
+    other = Mock(mirrors_source=False)
+    other.contains_archive.return_value = False
+    archive = write_archive(site, "20240101120000")
+    Path(f"{archive.filename}.s3.upload.json").write_text("{}")
+
+    # the current files are not snapshotted under the old timestamp
+    Backup(Mock(slug="blog"), quiet=True).resume_transfers([target, other])
+    assert not target.contains_archive(archive)
+    other.transfer_archive.assert_called_once()
+    assert not Path(archive.filename).exists()
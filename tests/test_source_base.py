@@ -19,6 +19,7 @@ def test_initialization(mock_reporter_init, paths):
 
     assert source.fspath == paths[0]
     assert source.fsconfig == paths[1]
+    assert source.fsexcludes == []
 
     assert source.title == ""
     assert source.slug == ""
@@ -32,6 +33,8 @@ def test_initialization(mock_reporter_init, paths):
     assert source.dbpass is None
     assert source.dbprefix is None
     assert source.dbcharset == "utf8mb4"
+    assert source.dbfile is None
+    assert source.dbexcludes == []
 
 
 @patch("backup.source._base.Reporter.__init__", return_value=None)
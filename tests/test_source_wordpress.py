@@ -1,14 +1,18 @@
+from datetime import date
 from pathlib import Path
-from unittest.mock import mock_open, patch
+from unittest.mock import Mock, mock_open, patch
 
-from backup.source.wordpress import WP
+from backup import Backup
+from backup.partition import Partition
+from backup.reference import CORE, PLUGIN, THEME, Component
+from backup.source.wordpress import WP, WPDatabaseError
 
 TEST_CONFIG = """
 define('DB_NAME', 'name');
 define('DB_USER', 'michael');
 define('DB_PASSWORD', '123456');
 define('DB_HOST', 'localhost');
-define('DB_CHARSET', 'utf8');
+define('DB_CHARSET', 'utf8mb4');
 $table_prefix  = 'wp_';
 """
 
@@ -44,3 +48,118 @@ def test_construction_with_given_arguments(_mock_query, _mock_check):
     assert wp.dbprefix == "wp_"
     m.assert_called_once_with(Path("path_to_instance/wp-config.php"))
     # NEXT: add mock for database and test it
+
+
+@patch.object(WP, "_check_configuration", return_value=True)
+@patch.object(WP, "_query_database", return_value=("title", "email"))
+def test_partitions(_mock_query, _mock_check, tmp_path):
+    with patch(
+        "backup.source.wordpress.open", mock_open(read_data=TEST_CONFIG), create=True
+    ):
+        wp = WP(tmp_path)
+    assert wp.partitions() == []
+
+    for month in ["2023/12", "2024/01", "2024/02", "2024/03", "2024/extra"]:
+        (tmp_path / "wp-content" / "uploads" / month).mkdir(parents=True)
+    (tmp_path / "wp-content" / "uploads" / "sites").mkdir()
+
+    # the current and the previous month are still open
+    partitions = wp.partitions(today=date(2024, 3, 15))
+    assert partitions == [
+        Partition("uploads-2023-12", "wp-content/uploads/2023/12"),
+        Partition("uploads-2024-01", "wp-content/uploads/2024/01"),
+    ]
+
+
+METADATA = (
+    'a:5:{s:5:"width";i:2560;s:6:"height";i:1920;'
+    's:4:"file";s:25:"2024/01/photo-scaled.jpeg";'
+    's:5:"sizes";a:2:{'
+    's:9:"thumbnail";a:3:{s:4:"file";s:17:"photo-150x150.jpg";'
+    's:5:"width";i:150;s:7:"sources";a:1:{s:10:"image/webp";'
+    'a:1:{s:4:"file";s:18:"photo-150x150.webp";}}}'
+    's:6:"medium";a:2:{s:4:"file";s:17:"photo-300x225.jpg";s:5:"width";i:300;}}'
+    's:14:"original_image";s:10:"photo.jpeg";}'
+)
+
+
+@patch.object(WP, "_check_configuration", return_value=True)
+@patch.object(WP, "_query_database", return_value=("title", "email"))
+def test_generated_files(_mock_query, _mock_check, tmp_path):
+    with patch(
+        "backup.source.wordpress.open", mock_open(read_data=TEST_CONFIG), create=True
+    ):
+        wp = WP(tmp_path)
+
+    uploads = tmp_path / "wp-content" / "uploads" / "2024" / "01"
+    uploads.mkdir(parents=True)
+    with patch.object(WP, "_query_attachments", return_value=[METADATA, "x:"]):
+        # copies of missing originals are kept
+        assert wp.generated_files() == {}
+
+        (uploads / "photo.jpeg").write_bytes(b"original")
+        original = "wp-content/uploads/2024/01/photo.jpeg"
+        assert wp.generated_files() == {
+            "wp-content/uploads/2024/01/photo-scaled.jpeg": original,
+            "wp-content/uploads/2024/01/photo-150x150.jpg": original,
+            "wp-content/uploads/2024/01/photo-150x150.webp": original,
+            "wp-content/uploads/2024/01/photo-300x225.jpg": original,
+        }
+
+
+@patch.object(WP, "_check_configuration", return_value=True)
+@patch.object(WP, "_query_database", return_value=("title", "email"))
+def test_generated_files_without_database(
+    _mock_query, _mock_check, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    site = tmp_path / "site"
+    (site / "wp-content" / "uploads").mkdir(parents=True)
+    with patch(
+        "backup.source.wordpress.open", mock_open(read_data=TEST_CONFIG), create=True
+    ):
+        wp = WP(site)
+
+    # the error ends the backup with a report instead of a traceback
+    mailer = Mock()
+    backup = Backup(wp, mailer=mailer, quiet=True)
+    error = WPDatabaseError(wp, "Access denied")
+    with patch.object(WP, "_query_attachments", side_effect=error):
+        backup.execute([], filesystem=True, skip_generated=True)
+    assert backup.error is error
+    mailer.send.assert_called_once()
+
+
+@patch.object(WP, "_check_configuration", return_value=True)
+@patch.object(WP, "_query_database", return_value=("title", "email"))
+def test_components(_mock_query, _mock_check, tmp_path):
+    with patch(
+        "backup.source.wordpress.open", mock_open(read_data=TEST_CONFIG), create=True
+    ):
+        wp = WP(tmp_path)
+    assert wp.components() == []
+
+    (tmp_path / "wp-includes").mkdir()
+    (tmp_path / "wp-includes" / "version.php").write_text(
+        "<?php\n/**\n * The WordPress version string.\n */\n$wp_version = '6.4.2';\n"
+    )
+    plugin = tmp_path / "wp-content" / "plugins" / "akismet"
+    plugin.mkdir(parents=True)
+    (plugin / "class.akismet.php").write_text("<?php\nclass Akismet {}\n")
+    (plugin / "akismet.php").write_text(
+        "<?php\n/*\nPlugin Name: Akismet Anti-spam\nVersion: 5.3\n*/\n"
+    )
+    theme = tmp_path / "wp-content" / "themes" / "twentytwentyfour"
+    theme.mkdir(parents=True)
+    (theme / "style.css").write_text(
+        "/*\nTheme Name: Twenty Twenty-Four\nVersion: 1.0\n*/\n"
+    )
+    (tmp_path / "wp-content" / "themes" / "index.php").write_text("<?php")
+
+    assert wp.components() == [
+        Component(CORE, "wordpress", "6.4.2", ""),
+        Component(PLUGIN, "akismet", "5.3", "wp-content/plugins/akismet"),
+        Component(
+            THEME, "twentytwentyfour", "1.0", "wp-content/themes/twentytwentyfour"
+        ),
+    ]
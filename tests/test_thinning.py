@@ -204,3 +204,51 @@ def test_thin_out():
             indates, fix=fixdate, attr="timestamp"
         )
     assert len(indates) == 6
+
+
+def test_horizon():
+    assert LatestStrategy(3).horizon() is None
+
+    # dates before the span of the first year are not thinned out anymore
+    strategy = ThinOutStrategy(2, 3, 2)
+    assert strategy.horizon(datetime(2024, 5, 20, 13)) == datetime(2023, 2, 1)
+
+    dates = everyday(datetime(2024, 5, 20))
+    fixdate = datetime(2024, 5, 20)
+    indates, _ = strategy.execute_on(dates, fix=fixdate)
+    for _ in range(0, 20):
+        fixdate = fixdate + timedelta(weeks=1)
+        horizon = strategy.horizon(fixdate)
+        recent = [d for d in indates if d >= horizon]
+        _, outdates = strategy.execute_on(recent, fix=fixdate)
+        _, expected = strategy.execute_on(indates, fix=fixdate)
+        assert outdates <= expected
+        indates = indates - outdates
+
+
+def test_expiration():
+    # the expiration of each date matches the day it is thinned out by daily
+    # executions (after the upload of the day)
+    strategy = ThinOutStrategy(3, 2, 2)
+    start = datetime(2022, 1, 1, 12)
+    dates = []
+    expirations = {}
+    dropped = {}
+    for n in range(750):
+        date = start + timedelta(days=n)
+        expirations[date] = strategy.expiration(date, dates)
+        dates.insert(0, date)
+        indates, outdates = strategy.execute_on(list(dates), fix=date)
+        for d in outdates:
+            dropped[d] = (date.date() - d.date()).days
+        dates = sorted(indates, reverse=True)
+
+    assert dropped
+    for date, days in dropped.items():
+        assert expirations[date] == days
+    for date in dates:
+        assert expirations[date] is None or expirations[date] > (
+            start + timedelta(days=749) - date
+        ).days
+    assert expirations[datetime(2022, 1, 2, 12)] == 4
+    assert None in expirations.values()
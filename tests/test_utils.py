@@ -1,6 +1,13 @@
 import pytest
 
-from backup.utils import formatsize, slugify, timestamp2date, timestamp4now
+from backup.utils import (
+    codec4charset,
+    formatsize,
+    slugify,
+    timestamp2date,
+    timestamp4now,
+)
+from backup.utils.php import PHPUnserializeError, unserialize
 
 
 def test_timestamp():
@@ -11,6 +18,14 @@ def test_timestamp():
     assert timestamp2date(timestamp) == now
 
 
+def test_codec4charset():
+    assert codec4charset("utf8mb4") == "utf-8"
+    assert codec4charset("utf8mb3") == "utf-8"
+    assert codec4charset("latin1") == "cp1252"
+    assert codec4charset("koi8r") == "utf-8"
+    assert codec4charset(None) == "utf-8"
+
+
 def test_slugify():
     assert slugify("This") == "this"
     assert slugify("is") == "is"
@@ -51,3 +66,23 @@ def test_format_size_binary():
     assert formatsize(123123123123123123123123123, binary=True) == "101.8 YiB"
     assert formatsize(123123123123123123123123123123, binary=True) == "101845.1 YiB"
     assert formatsize(123123123123123123123123123123, binary=True) == "101845.1 YiB"
+
+
+def test_php_unserialize():
+    assert unserialize("N;") is None
+    assert unserialize("b:1;") is True
+    assert unserialize("i:-42;") == -42
+    assert unserialize("d:0.5;") == 0.5
+    # string lengths are given in bytes
+    assert unserialize('s:6:"Grüß";') == "Grüß"
+    assert unserialize('a:2:{i:0;s:1:"a";s:1:"b";a:1:{s:1:"c";b:0;}}') == {
+        0: "a",
+        "b": {"c": False},
+    }
+
+    with pytest.raises(PHPUnserializeError):
+        unserialize('O:8:"stdClass":0:{}')
+    with pytest.raises(PHPUnserializeError):
+        unserialize('s:5:"abc";')
+    with pytest.raises(PHPUnserializeError):
+        unserialize("i:1;i:2;")